@@ -15,129 +15,877 @@
 # permissions and limitations under the License.
 #
 import argparse
+import collections
+import contextlib
 import functools
-import itertools
+import json
 import logging
-import multiprocessing.pool
+import os
 import pathlib
 import sys
-from typing import IO, Iterable, Optional, Sequence, Tuple, Type
+from typing import (
+    IO,
+    Counter,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
 from . import validators  # import validators to register them
-from . import PROGNAME, base, match, pathtools, terminfo
+from . import (
+    PROGNAME,
+    archives,
+    base,
+    classindex,
+    gittree,
+    match,
+    pathtools,
+    rules,
+    sfdx,
+    terminfo,
+    tracing,
+)
+from .baseline import Baseline
+from .cache import Cache
+from .limits import MARKERS, Limits, Skip
+from .metrics import Metrics
+from .results import Results, concat
+from .workers import Options as WorkerOptions
 
 log = logging.getLogger(__name__)
 
 
-def render_parallel(
+@contextlib.contextmanager
+def worker_pool(
+    jobs: Optional[int], options: WorkerOptions = WorkerOptions()
+) -> Iterator:
+    """Return a pool of `jobs` worker processes, or None for one job.
+    multiprocessing is only imported if there are workers.
+    Workers are replaced and files given up on as `options` say; with any
+    of them, even one job has a worker. Files given up on return a
+    workers.TaskError.
+    """
+    if jobs == 1 and not any(options):
+        yield None
+        return
+
+    if options.max_rss or options.timeout:
+        from . import workers
+
+        with workers.Pool(jobs, **options._asdict()) as pool:
+            yield pool
+        return
+
+    import multiprocessing
+
+    with multiprocessing.Pool(
+        jobs, maxtasksperchild=options.max_tasks
+    ) as pool:
+        yield pool
+
+
+def default_jobs(files: Sequence[str]) -> Optional[int]:
+    """Return one job per CPU, but no more than there are `files` if they
+    are all regular files, so validating one file starts no workers.
+    """
+    if not files or not all(f == "-" or os.path.isfile(f) for f in files):
+        return None
+    if any(archives.is_archive(pathlib.Path(f)) for f in files):
+        return None
+    return min(os.cpu_count() or 1, len(files))
+
+
+# The messages of a file, and its errors or why it was skipped
+Collected = Tuple[Results, List[Union[Exception, Skip]]]
+
+
+def collect_parallel(
     paths: Iterable[pathlib.Path],
     *,
-    pool: Optional[multiprocessing.pool.Pool],
+    hooks: Optional[tracing.Hooks] = None,
+    metrics: Optional[Metrics] = None,
+    pool,
     **kwargs,
-):
+) -> Iterator[Tuple[pathlib.Path, Collected]]:
+    """Return the messages of each path, in order, as `match.collect` does.
+    Workers return their own metrics, which are added to `metrics`, and
+    record the events `hooks` wants, which are replayed on it. With
+    `dedup`, files with the same contents are sent to the same worker.
+    """
+    events = tracing.wanted(hooks)
+    if metrics is None and not events:
+        fn = functools.partial(match.collect, **kwargs)
+    else:
+        fn = functools.partial(
+            measure,
+            events=events,
+            measured=None if metrics is None else type(metrics),
+            **kwargs,
+        )
+
     if not pool:
-        return match.render(paths, **kwargs)
+        results = ((p, fn((p,))) for p in paths)
+    elif kwargs.get("dedup"):
+        paths = list(paths)
+        groups = match.duplicates(paths, limits=kwargs.get("limits"))
+        found = pool.imap(
+            functools.partial(each, fn=fn),
+            ([paths[i] for i in group] for group in groups),
+        )
+        results = _given_up(
+            _ordered(paths, groups, found), measured=fn.func is measure
+        )
+    else:
+        # Paths are consumed by the pool's task thread, in order
+        sent: Deque[pathlib.Path] = collections.deque()
+
+        def tasks():
+            for p in paths:
+                sent.append(p)
+                yield (p,)
+
+        results = _given_up(
+            ((sent.popleft(), r) for r in pool.imap(fn, tasks())),
+            measured=fn.func is measure,
+        )
+
+    if metrics is None and not events:
+        return results
+    return _measured(results, hooks=hooks, metrics=metrics)
+
+
+def each(paths: Sequence[pathlib.Path], *, fn) -> List:
+    """Return `fn((path,))` for each of `paths`, in one worker."""
+    return [fn((p,)) for p in paths]
+
+
+def _ordered(paths, groups, found):
+    """Return each of `paths` with its result, from what was `found` for
+    each of `groups` of their positions, in the order of their first.
+    """
+    pending = {}
+    n = 0
+    for group, results in zip(groups, found):
+        if isinstance(results, Exception):
+            results = [results] * len(group)
+        pending.update(zip(group, results))
+        while n in pending:
+            yield paths[n], pending.pop(n)
+            n += 1
+
 
-    return itertools.chain.from_iterable(
-        pool.imap(functools.partial(render, **kwargs), ((p,) for p in paths))
+def _given_up(results, *, measured: bool):
+    """Replace the result of each file given up on by its error."""
+    for path, result in results:
+        if isinstance(result, Exception):
+            log.error(f"{PROGNAME}: {result}")
+            result = (Results(), [result])
+            if measured:
+                result = (result, None, None)
+        yield path, result
+
+
+def _measured(results, *, hooks, metrics):
+    for path, (collected, found, recorder) in results:
+        if found is not None:
+            metrics.update(found)
+        if recorder is not None:
+            recorder.replay(hooks)
+        yield path, collected
+
+
+def measure(
+    *args,
+    events: FrozenSet[str],
+    measured: Optional[Type[Metrics]],
+    **kwargs,
+) -> Tuple[Collected, Optional[Metrics], Optional[tracing.Recorder]]:
+    """Collect messages, returning the metrics and events of the worker.
+    `measured` is the class of metrics to return, such as a MemProfile.
+    """
+    metrics = measured() if measured is not None else None
+    recorder = tracing.Recorder(events) if events else None
+    collected = match.collect(
+        *args, hooks=recorder, metrics=metrics, **kwargs
     )
+    return collected, metrics, recorder
 
 
-def render(*args, **kwargs):
-    return list(match.render(*args, **kwargs))
+def fingerprints(
+    paths: Iterable[pathlib.Path], *, baseline: Baseline, **kwargs
+) -> Tuple[List[str], List[Exception], List[Skip]]:
+    """Return the fingerprints of the messages of `paths`, the errors
+    reading them, and those skipped.
+    """
+    found = []
+    errors = []
+    skipped = []
+    for message in match.files(paths, **kwargs):
+        if isinstance(message, Exception):
+            errors.append(message)
+        elif isinstance(message, Skip):
+            skipped.append(message)
+        else:
+            found.append(baseline.fingerprint(message))
+    return found, errors, skipped
+
+
+def update_baseline(
+    paths: Iterable[pathlib.Path],
+    *,
+    baseline: Baseline,
+    jobs: Optional[int] = None,
+    skipped: Optional[List[Skip]] = None,
+    worker_options: WorkerOptions = WorkerOptions(),
+    **kwargs,
+) -> Tuple[int, List[Exception]]:
+    """Replace the errors in `baseline` with those found in `paths`, and
+    return how many there are, and the errors reading `paths`. The files
+    skipped are added to `skipped`. If any file couldn't be read, its
+    errors aren't known, so `baseline` isn't saved.
+    """
+    baseline.fingerprints.clear()
+    errors: List[Exception] = []
+    if skipped is None:
+        skipped = []
+    fn = functools.partial(fingerprints, baseline=baseline, **kwargs)
+
+    with worker_pool(jobs, worker_options) as pool:
+        index = kwargs.get("index")
+        if index is not None:
+            paths = list(paths)
+            index.update(paths, pool=pool)
+            index.save()
+
+        mapper = pool.imap if pool is not None else map
+        for result in mapper(fn, ((p,) for p in paths)):
+            if isinstance(result, Exception):
+                log.error(f"{PROGNAME}: {result}")
+                errors.append(result)
+                continue
+            found, failed, passed = result
+            baseline.add(found)
+            errors += failed
+            skipped += passed
+
+    if not errors:
+        baseline.save()
+    return len(baseline), errors
 
 
 def lint(
     paths: Iterable[pathlib.Path],
     *,
+    baseline: Optional[Baseline] = None,
+    cache: Optional[Cache] = None,
+    dedup: bool = False,
+    hooks: Optional[tracing.Hooks] = None,
+    index: Optional[classindex.Index] = None,
     jobs: Optional[int] = None,
+    limits: Optional[Limits] = None,
+    metrics: Optional[Metrics] = None,
+    order: Optional[Dict[str, int]] = None,
     output: Optional[IO] = sys.stdout,
     output_count: Optional[IO] = None,
+    project: Optional[sfdx.Project] = None,
+    results: Optional[IO] = None,
+    skipped: Optional[List[Skip]] = None,
     suppress: bool = True,
     term: Optional[Type[terminfo.TermInfo]] = None,
     validators: Sequence[Type[base.Validator]],
     verbose: int = 0,
-) -> Tuple[Iterable[str], Iterable[Exception]]:
-    messages = []
+    worker_options: WorkerOptions = WorkerOptions(),
+) -> Tuple[Results, Iterable[Exception]]:
+    """Validate `paths`, and print their messages in order. Workers return
+    them as Results, which are rendered and kept together here.
+    The files the `limits` skip are added to `skipped`, and saved in
+    `results`, with the position each file was found in: its position in
+    `order`, such as that of a shard in all files, or else in `paths`.
+    The files, lines, times and messages of the run are added to `metrics`,
+    and the progress of each file is reported to `hooks`, from workers too.
+    With `dedup`, the same contents are validated only once, by the worker
+    sent all their paths, and not at all if they are kept in the `cache`.
+    """
+    messages = Results()
+    discovered: Dict[str, int] = {}
     errors = []
+    if skipped is None:
+        skipped = []
+
+    with worker_pool(jobs, worker_options) as pool:
+        if metrics is not None:
+            metrics.workers = 1 if pool is None else jobs or os.cpu_count()
+        if index is not None:
+            # Index every file before validating any of them
+            paths = list(paths)
+            changed = index.update(paths, pool=pool)
+            log.debug(f"Indexed {changed} changed files")
+            index.save()
 
-    with multiprocessing.Pool(jobs) as pool:
-        for message in render_parallel(
+        collected = collect_parallel(
             paths,
-            pool=(pool if jobs != 1 else None),
+            baseline=baseline,
+            cache=cache,
+            dedup=dedup,
+            hooks=hooks,
+            index=index,
+            limits=limits,
+            metrics=metrics,
+            pool=pool,
+            project=project,
             suppress=suppress,
-            term=term,
             validators=validators,
-            verbose=verbose,
-        ):
-            if isinstance(message, Exception):
-                errors.append(message)
-                continue
+        )
+        if metrics is not None:
+            # From the parent, as workers validate files at once
+            collected = metrics.spanned("match", collected)
+        for n, (path, (found, others)) in enumerate(collected):
+            if found:
+                filename = os.fspath(path)
+                discovered[filename] = (
+                    n if order is None else order.get(filename, n)
+                )
+            for other in others:
+                if isinstance(other, Skip):
+                    skipped.append(other)
+                else:
+                    errors.append(other)
 
-            messages.append(message)
-            if output is not None:
-                print(message, file=output)
+            with (
+                metrics.timer("render")
+                if metrics is not None
+                else contextlib.nullcontext()
+            ):
+                messages.extend(found)
+                if output is not None:
+                    for message in found:
+                        print(
+                            message.render(term=term, verbose=verbose),
+                            file=output,
+                        )
 
     if output_count is not None:
         print(len(messages), file=output_count)
 
+    if results is not None:
+        json.dump(
+            {
+                "messages": messages.json(),
+                "order": [
+                    discovered[os.fspath(p)] for p in messages.paths.values
+                ],
+                "errors": [str(e) for e in errors],
+                "skipped": [str(s) for s in skipped],
+            },
+            results,
+        )
+
     return messages, errors
 
 
+def statistics(
+    paths: Iterable[pathlib.Path],
+    *,
+    index: Optional[classindex.Index] = None,
+    jobs: Optional[int] = None,
+    output: Optional[IO] = sys.stdout,
+    output_count: Optional[IO] = None,
+    skipped: Optional[List[Skip]] = None,
+    worker_options: WorkerOptions = WorkerOptions(),
+    **kwargs,
+) -> Tuple[Counter[Tuple[str, str]], List[Exception]]:
+    """Count the messages of `paths` by validator and directory, and print
+    a summary. Workers return only their counts, and the files skipped,
+    which are added to `skipped`.
+    """
+    counts: Counter[Tuple[str, str]] = collections.Counter()
+    errors: List[Exception] = []
+    if skipped is None:
+        skipped = []
+    fn = functools.partial(match.statistics, index=index, **kwargs)
+
+    with worker_pool(jobs, worker_options) as pool:
+        if index is not None:
+            paths = list(paths)
+            index.update(paths, pool=pool)
+            index.save()
+
+        mapper = pool.imap_unordered if pool is not None else map
+        for result in mapper(fn, ((p,) for p in paths)):
+            if isinstance(result, Exception):
+                log.error(f"{PROGNAME}: {result}")
+                errors.append(result)
+                continue
+            found, failed, passed = result
+            counts.update(found)
+            errors += failed
+            skipped += passed
+
+    if output is not None:
+        print_statistics(counts, output=output)
+    if output_count is not None:
+        print(sum(counts.values()), file=output_count)
+    return counts, errors
+
+
+def print_statistics(
+    counts: Counter[Tuple[str, str]], *, output: IO = sys.stdout
+) -> None:
+    """Print the count of each validator, then of each of its directories,
+    most first.
+    """
+    totals: Counter[str] = collections.Counter()
+    for (validator, _), n in counts.items():
+        totals[validator] += n
+
+    def most(item):
+        name, n = item
+        return -n, name
+
+    width = len(str(max(totals.values(), default=0)))
+    for validator, total in sorted(totals.items(), key=most):
+        print(f"{total:{width}} {validator}", file=output)
+        directories = (
+            (d, n) for (v, d), n in counts.items() if v == validator
+        )
+        for d, n in sorted(directories, key=most):
+            print(f"{n:{width}}   {d}", file=output)
+    print(f"{sum(totals.values()):{width}} total", file=output)
+
+
+def merge(
+    results: Iterable[IO],
+    *,
+    fail_on_skip: bool = False,
+    output: Optional[IO] = sys.stdout,
+    output_count: Optional[IO] = None,
+    term: Optional[Type[terminfo.TermInfo]] = None,
+    verbose: int = 0,
+) -> int:
+    """Print the messages in `results` written by `lint`, such as those
+    of each --shard, in the order their files were found, as one run
+    would. Return the exit status of `main`.
+    """
+    found = []
+    order: Dict[str, int] = {}
+    errors = []
+    skipped = []
+    for f in results:
+        data = json.load(f)
+        found.append(Results.from_json(data["messages"]))
+        order.update(zip(data["messages"]["paths"], data["order"]))
+        errors += data["errors"]
+        skipped += data.get("skipped", [])
+
+    joined = concat(found)
+    paths = [order[os.fspath(p)] for p in joined.paths.values]
+    column = joined.columns["path"]
+    # Stable, so each file keeps its own order
+    messages = joined.take(
+        sorted(range(len(joined)), key=lambda i: paths[column[i]])
+    )
+    if output is not None:
+        for message in messages:
+            print(message.render(term=term, verbose=verbose), file=output)
+    for e in errors:
+        log.error(f"{PROGNAME}: {e}")
+    report_skipped(skipped)
+
+    if output_count is not None:
+        print(len(messages), file=output_count)
+
+    return status(messages, errors, skipped, fail_on_skip=fail_on_skip)
+
+
+def status(
+    messages: Sequence[object],
+    errors: Sequence[object],
+    skipped: Sequence[object] = (),
+    *,
+    fail_on_skip: bool = False,
+) -> int:
+    """Return the exit status of a run: 1 if it found errors, or else 2 if
+    files couldn't be read, or were skipped and that should fail it.
+    """
+    if messages:
+        return 1
+    if errors or (skipped and fail_on_skip):
+        return 2
+    return 0
+
+
+def report_skipped(skipped: Sequence[object], *, verbose: int = 0) -> None:
+    """Log the files that weren't validated, or how many with -q."""
+    if not skipped:
+        return
+    if verbose >= 0:
+        for s in skipped:
+            log.info(f"{PROGNAME}: skipped {s}")
+    else:
+        log.info(f"{PROGNAME}: skipped {len(skipped)} generated or big files")
+
+
 def main(
     config: argparse.Namespace,
     *,
     output: IO = sys.stdout,
     output_count: IO = sys.stderr,
 ):
-    messages, errors = lint(
-        pathtools.unique(pathtools.walk(pathtools.paths(config.files))),
-        jobs=config.jobs,
-        output_count=sys.stderr if config.count else None,
-        suppress=config.suppress,
-        term=terminfo.TermInfo.get(color=config.color),
-        validators=tuple(
-            validators.library(
-                select=frozenset(config.select),
-                ignore=frozenset(config.ignore),
+    if config.command == "merge":
+        with contextlib.ExitStack() as stack:
+            return merge(
+                (stack.enter_context(p.open()) for p in config.results),
+                fail_on_skip=config.fail_on_skip,
+                output=output,
+                output_count=output_count if config.count else None,
+                term=terminfo.TermInfo.get(color=config.color),
+                verbose=config.verbose,
             )
+
+    git = config.git_tree is not None or config.staged
+    project = (
+        sfdx.Project.discover(pathtools.paths(config.files))
+        if config.sfdx_project and not git
+        else None
+    )
+    roots = pathtools.paths(filenames(config))
+    if project is not None:
+        roots = project.expand(roots)
+    limits = Limits(
+        max_bytes=config.max_bytes,
+        max_line=config.max_line_length,
+        generated=tuple(config.generated),
+        markers=(
+            ()
+            if config.include_generated
+            else MARKERS + tuple(config.generated_marker)
         ),
-        verbose=config.verbose,
     )
-    if messages:
-        return 1
-    if errors:
-        return 2
-    return 0
+    skipped: List[Skip] = []
+    metrics: Optional[Metrics] = None
+    if config.memprofile:
+        from . import memprofile  # Only needed with --memprofile
+
+        metrics = profile = memprofile.MemProfile()
+    elif config.metrics_file:
+        metrics = Metrics()
+    # Lazy, so linting starts before a long --files-from is fully read
+    paths: Iterable[pathlib.Path]
+    if git:
+        try:
+            paths = gittree.blobs(config.git_tree, pathspecs=config.files)
+        except OSError as e:
+            log.error(f"{PROGNAME}: {e}")
+            return 2
+    else:
+        paths = pathtools.unique(pathtools.walk(roots))
+    if metrics is not None:
+        paths = metrics.counted("files_discovered", paths)
+        paths = metrics.timed("walk", paths)
+    order: Optional[Dict[str, int]] = None
+    if config.shard:
+        order = {}
+        paths = pathtools.shard(
+            paths, index=config.shard[0], count=config.shard[1], order=order
+        )
+
+    index = (
+        classindex.Index.open(config.class_index)
+        if config.class_index
+        else None
+    )
+    term = terminfo.TermInfo.get(color=config.color)
+    enabled = tuple(
+        validators.library(
+            select=frozenset(config.select),
+            ignore=frozenset(config.ignore),
+            rules=config.rules,
+        )
+    )
+
+    worker_options = WorkerOptions(
+        max_rss=config.max_worker_rss,
+        max_tasks=config.max_worker_files,
+        timeout=config.timeout,
+    )
+
+    baseline = Baseline.open(config.baseline) if config.baseline else None
+    cache = Cache(config.cache) if config.cache else None
+    if config.update_baseline:
+        n, errors = update_baseline(
+            paths,
+            baseline=baseline,
+            cache=cache,
+            dedup=config.dedup,
+            index=index,
+            jobs=config.jobs,
+            limits=limits,
+            project=project,
+            skipped=skipped,
+            suppress=config.suppress,
+            validators=enabled,
+            worker_options=worker_options,
+        )
+        report_skipped(skipped, verbose=config.verbose)
+        if errors:
+            log.error(f"{PROGNAME}: not updating {config.baseline}")
+        else:
+            log.info(f"{PROGNAME}: recorded {n} errors in {config.baseline}")
+        return status((), errors, skipped, fail_on_skip=config.fail_on_skip)
+
+    if config.watch:
+        from . import watch
+
+        with worker_pool(config.jobs, worker_options) as pool:
+            # The same files as any other run, found again on each change
+            watch.run(
+                list(roots),
+                watch.Session(
+                    baseline=baseline,
+                    index=index,
+                    limits=limits,
+                    pool=pool,
+                    project=project,
+                    suppress=config.suppress,
+                    term=term,
+                    validators=enabled,
+                    verbose=config.verbose,
+                ),
+                output=output,
+            )
+        return 0
+
+    if config.statistics:
+        counts, errors = statistics(
+            paths,
+            baseline=baseline,
+            cache=cache,
+            dedup=config.dedup,
+            index=index,
+            jobs=config.jobs,
+            limits=limits,
+            output=output,
+            output_count=output_count if config.count else None,
+            project=project,
+            skipped=skipped,
+            suppress=config.suppress,
+            validators=enabled,
+            worker_options=worker_options,
+        )
+        report_skipped(skipped, verbose=config.verbose)
+        return status(
+            counts, errors, skipped, fail_on_skip=config.fail_on_skip
+        )
+
+    with contextlib.ExitStack() as stack:
+        messages, errors = lint(
+            paths,
+            baseline=baseline,
+            cache=cache,
+            dedup=config.dedup,
+            index=index,
+            jobs=config.jobs,
+            limits=limits,
+            metrics=metrics,
+            order=order,
+            output=output,
+            output_count=output_count if config.count else None,
+            project=project,
+            results=(
+                stack.enter_context(config.results.open(mode="w"))
+                if config.results
+                else None
+            ),
+            skipped=skipped,
+            suppress=config.suppress,
+            term=term,
+            validators=enabled,
+            verbose=config.verbose,
+            worker_options=worker_options,
+        )
+    report_skipped(skipped, verbose=config.verbose)
+    if metrics is not None and config.metrics_file:
+        metrics.save(config.metrics_file)
+    if config.memprofile:
+        profile.report(output_count)
+    return status(messages, errors, skipped, fail_on_skip=config.fail_on_skip)
+
+
+def filenames(config: argparse.Namespace) -> Iterator[str]:
+    """Return the FILE arguments, then those read from --files-from."""
+    yield from config.files
+    if not config.files_from:
+        return
+
+    separator = b"\0" if config.null else b"\n"
+    if config.files_from == "-":
+        yield from pathtools.names(sys.stdin.buffer, separator=separator)
+        return
+    with open(config.files_from, mode="rb") as f:
+        yield from pathtools.names(f, separator=separator)
+
+
+def parse_megabytes(value: str) -> int:
+    """Return the bytes in `value` megabytes."""
+    try:
+        megabytes = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected megabytes, got {value!r}")
+    return int(megabytes * 1024 * 1024)
+
+
+def parse_rules(value: str) -> Tuple[rules.Rule, ...]:
+    try:
+        return rules.load(pathlib.Path(value))
+    except rules.RuleError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    try:
+        index, count = (int(n) for n in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, got {value!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"expected 1 <= I <= N: {value!r}")
+    return index, count
+
+
+class ColorAction(argparse.Action):
+    def __call__(self, parser, namespace, values, *args, **kwargs):
+        namespace.color = self.parse(values)
+
+    @staticmethod
+    def parse(values):
+        if values == "never":
+            return False
+        if values == "always":
+            return True
+        if values == "auto":
+            return sys.stdout.isatty()
+
+
+class QuietAction(argparse.Action):
+    def __call__(self, parser, namespace, values, *args, **kwargs):
+        namespace.verbose -= 1
+
+
+def parse_merge_args(args: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Merge the --results of several runs, such as shards",
+        prog=f"{PROGNAME} merge",
+    )
+
+    parser.add_argument(
+        "results",
+        metavar="FILE",
+        nargs="+",
+        type=pathlib.Path,
+        help="results to merge",
+    )
+
+    parser.add_argument(
+        "--color",
+        action=ColorAction,
+        choices=("always", "auto", "never"),
+        default=ColorAction.parse("auto"),
+        metavar="WHEN",
+        help=("colorize the output; WHEN can be 'always', 'auto', or 'never'"),
+    )
+
+    parser.add_argument(
+        "--count",
+        action="store_true",
+        help="print total number of errors to standard error",
+    )
+
+    parser.add_argument(
+        "--debug", action="count", default=0, help="debug output"
+    )
+
+    parser.add_argument(
+        "--fail-on-skip",
+        action="store_true",
+        help="exit with status 2 if any file was skipped",
+    )
+
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action=QuietAction,
+        nargs=0,
+        help="less verbose messages; see --verbose",
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="more verbose messages",
+    )
+
+    config = parser.parse_args(args)
+    config.command = "merge"
+    return config
 
 
 def parse_args(args: Sequence[str]) -> argparse.Namespace:
-    validator_names = validators.names()
+    if args[:1] == ["merge"]:
+        return parse_merge_args(args[1:])
 
     parser = argparse.ArgumentParser(
-        description="Validate Salesforce code for common errors", prog=PROGNAME
+        description="Validate Salesforce code for common errors",
+        epilog=f"Use '{PROGNAME} merge --help' to merge --results.",
+        prog=PROGNAME,
     )
+    parser.set_defaults(command="lint")
 
     parser.add_argument(
         "files",
         metavar="FILE",
-        default=["-"],
+        default=[],
         nargs="*",
-        help="files to validate",
+        help="files to validate (default: standard input)",
     )
 
-    class ColorAction(argparse.Action):
-        def __call__(self, parser, namespace, values, *args, **kwargs):
-            namespace.color = self.parse(values)
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        metavar="FILE",
+        type=pathlib.Path,
+        help="ignore the known errors recorded in FILE",
+    )
 
-        @staticmethod
-        def parse(values):
-            if values == "never":
-                return False
-            if values == "always":
-                return True
-            if values == "auto":
-                return sys.stdout.isatty()
+    parser.add_argument(
+        "--cache",
+        default=None,
+        metavar="DIR",
+        type=pathlib.Path,
+        help=(
+            "keep the errors of each file's contents in DIR, and don't "
+            "validate them again in later runs"
+        ),
+    )
+
+    parser.add_argument(
+        "--class-index",
+        default=None,
+        metavar="FILE",
+        type=pathlib.Path,
+        help=(
+            "find test classes by their @isTest annotation, indexed in FILE; "
+            "only files that changed since the last run are indexed again"
+        ),
+    )
 
     parser.add_argument(
         "--color",
@@ -158,15 +906,72 @@ def parse_args(args: Sequence[str]) -> argparse.Namespace:
         "--debug", action="count", default=0, help="debug output"
     )
 
+    parser.add_argument(
+        "--fail-on-skip",
+        action="store_true",
+        help=(
+            "exit with status 2 if any file was skipped as generated or "
+            "too big, as if it couldn't be read"
+        ),
+    )
+
+    parser.add_argument(
+        "--files-from",
+        default=None,
+        metavar="PATH",
+        help=(
+            "also validate the files named in PATH, one per line, "
+            "or '-' for standard input; see --null"
+        ),
+    )
+
+    parser.add_argument(
+        "--generated",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="skip generated files that match GLOB, such as '*_Gen.cls'",
+    )
+
+    parser.add_argument(
+        "--generated-marker",
+        action="append",
+        default=[],
+        metavar="TEXT",
+        help=(
+            "skip files with TEXT in a comment near the top, such as "
+            "'Generated by wsdl2apex', as well as '@generated'"
+        ),
+    )
+
+    parser.add_argument(
+        "--git-tree",
+        default=None,
+        metavar="REV",
+        help=(
+            "validate the files of the commit, branch or tree REV of the "
+            "git repository, without checking it out; FILE arguments "
+            "limit it to those paths"
+        ),
+    )
+
     parser.add_argument(
         "--ignore",
         action="append",
-        choices=validator_names,
         default=[],
         metavar="VALIDATOR",
         help="list of errors to ignore (default: none)",
     )
 
+    parser.add_argument(
+        "--include-generated",
+        action="store_true",
+        help=(
+            "validate files marked as generated by a comment near the top, "
+            "such as '// @generated'"
+        ),
+    )
+
     parser.add_argument(
         "-j",
         "--jobs",
@@ -176,17 +981,95 @@ def parse_args(args: Sequence[str]) -> argparse.Namespace:
         help="number of parallel checks (default: number of CPUs)",
     )
 
+    parser.add_argument(
+        "--max-bytes",
+        default=0,
+        metavar="N",
+        type=int,
+        help="skip files larger than N bytes (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--max-line-length",
+        default=0,
+        metavar="N",
+        type=int,
+        help=(
+            "validate lines longer than N characters N characters at a "
+            "time, in overlapping windows (default: no limit)"
+        ),
+    )
+
+    parser.add_argument(
+        "--max-worker-files",
+        default=None,
+        metavar="N",
+        type=int,
+        help="replace each worker process after it validates N files",
+    )
+
+    parser.add_argument(
+        "--max-worker-rss",
+        default=None,
+        metavar="MB",
+        type=parse_megabytes,
+        help=(
+            "replace each worker process once its resident memory "
+            "exceeds MB megabytes"
+        ),
+    )
+
+    parser.add_argument(
+        "--memprofile",
+        action="store_true",
+        help=(
+            "trace memory, and report the peak, the memory of each stage "
+            "and the lines that allocated the most, for each process"
+        ),
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        metavar="PATH",
+        type=pathlib.Path,
+        help=(
+            "write the files, lines, times and errors of the run to PATH, "
+            "in the OpenMetrics text format"
+        ),
+    )
+
+    parser.add_argument(
+        "--no-dedup",
+        action="store_false",
+        default=True,
+        dest="dedup",
+        help=(
+            "validate every file, even those with the same contents as "
+            "another"
+        ),
+    )
+
     parser.add_argument(
         "--no-suppress",
         action="store_false",
         default=True,
         dest="suppress",
-        help='disable the effect of "# noqa"; so suppression is ignored',
+        help=(
+            'disable the effect of "// noqa" and "// apexlint: disable"; '
+            "so suppression is ignored"
+        ),
     )
 
-    class QuietAction(argparse.Action):
-        def __call__(self, parser, namespace, values, *args, **kwargs):
-            namespace.verbose -= 1
+    parser.add_argument(
+        "-0",
+        "--null",
+        action="store_true",
+        help=(
+            "file names in --files-from are separated by NUL characters, "
+            "as produced by 'git ls-files -z'"
+        ),
+    )
 
     parser.add_argument(
         "-q",
@@ -196,14 +1079,88 @@ def parse_args(args: Sequence[str]) -> argparse.Namespace:
         help="less verbose messages; see --verbose",
     )
 
+    parser.add_argument(
+        "--results",
+        default=None,
+        metavar="FILE",
+        type=pathlib.Path,
+        help="also write the errors to FILE, for merging",
+    )
+
+    parser.add_argument(
+        "--no-sfdx-project",
+        action="store_false",
+        dest="sfdx_project",
+        help=(
+            "validate every file in directories with an sfdx-project.json, "
+            "not only those in its packageDirectories"
+        ),
+    )
+
+    parser.add_argument(
+        "--rules",
+        default=(),
+        metavar="FILE",
+        type=parse_rules,
+        help=(
+            "also validate the regexp rules in FILE, in TOML (.toml) "
+            "or INI format"
+        ),
+    )
+
     parser.add_argument(
         "--select",
         action="append",
-        choices=validator_names,
         default=[],
         metavar="VALIDATOR",
         help="list of errors to enable (default: all)",
     )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        metavar="I/N",
+        type=parse_shard,
+        help=(
+            "validate only the Ith of N shards of the files, "
+            "balanced by size; see '%(prog)s merge'"
+        ),
+    )
+
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help=(
+            "validate the files staged in the git index, as they will be "
+            "committed; FILE arguments limit it to those paths"
+        ),
+    )
+
+    parser.add_argument(
+        "--statistics",
+        action="store_true",
+        help=(
+            "print how many errors each validator found in each directory, "
+            "or sfdx package, instead of the errors"
+        ),
+    )
+
+    parser.add_argument(
+        "--timeout",
+        default=None,
+        metavar="SECONDS",
+        type=float,
+        help=(
+            "give up on a file after SECONDS, stopping its worker, "
+            "and report it as an error"
+        ),
+    )
+
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="record all errors in the --baseline FILE, and exit",
+    )
+
     parser.add_argument(
         "-v",
         "--verbose",
@@ -212,7 +1169,65 @@ def parse_args(args: Sequence[str]) -> argparse.Namespace:
         help="more verbose messages",
     )
 
-    return parser.parse_args(args)
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help=(
+            "validate again whenever files change, "
+            "printing the errors that were added or removed"
+        ),
+    )
+
+    config = parser.parse_args(args)
+    git = config.git_tree is not None or config.staged
+    if not config.files and not config.files_from and not git:
+        config.files = ["-"]
+    if config.jobs is None and not config.files_from:
+        config.jobs = default_jobs(config.files)
+    try:
+        names = validators.names(config.rules)
+    except rules.RuleError as e:
+        parser.error(f"argument --rules: {e}")
+    for option, selected in (
+        ("--select", config.select),
+        ("--ignore", config.ignore),
+    ):
+        for name in selected:
+            if name not in names:
+                parser.error(
+                    f"argument {option}: invalid choice: {name!r} "
+                    f"(choose from {', '.join(names)})"
+                )
+    if config.update_baseline and not config.baseline:
+        parser.error("--update-baseline requires --baseline FILE")
+    if config.cache and not config.dedup:
+        parser.error("--cache can't be used with --no-dedup")
+    if config.statistics and (config.results or config.watch):
+        parser.error("--statistics can't be used with --results or --watch")
+    for option, value in (
+        ("--memprofile", config.memprofile),
+        ("--metrics-file", config.metrics_file),
+    ):
+        if value and (
+            config.statistics or config.update_baseline or config.watch
+        ):
+            parser.error(
+                f"{option} can't be used with --statistics, "
+                "--update-baseline or --watch"
+            )
+    if config.watch and ("-" in config.files or config.files_from == "-"):
+        parser.error("--watch requires files or directories to watch")
+    if config.watch and (config.results or config.shard):
+        parser.error("--watch can't be used with --results or --shard")
+    if config.git_tree is not None and config.staged:
+        parser.error("--git-tree can't be used with --staged")
+    if git and (config.class_index or config.files_from or config.watch):
+        parser.error(
+            f"{'--staged' if config.staged else '--git-tree'} can't be used "
+            "with --class-index, --files-from or --watch"
+        )
+    return config
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import contextlib
+import functools
+import io
+import os
+import pathlib
+import stat
+from typing import IO, Iterator, NamedTuple
+
+ZIP = (".zip",)
+TAR = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def _suffix(path: pathlib.Path, suffixes) -> bool:
+    return path.name.lower().endswith(suffixes)
+
+
+def is_archive(path: pathlib.Path) -> bool:
+    return _suffix(path, ZIP + TAR)
+
+
+class Member(NamedTuple):
+    """A file in a zip or tar archive, usable in place of a pathlib.Path.
+    `offset` is where the data of a tar member starts in the uncompressed
+    archive, so workers read it without scanning the archive again.
+    Zip members are opened by name.
+    """
+
+    archive: pathlib.Path
+    name: str
+    offset: int
+    size: int
+
+    def __fspath__(self) -> str:
+        return f"{os.fspath(self.archive)}!/{self.name}"
+
+    def __str__(self) -> str:
+        return self.__fspath__()
+
+    def is_dir(self) -> bool:
+        return False
+
+    def is_file(self) -> bool:
+        return True
+
+    def match(self, pattern: str) -> bool:
+        return pathlib.PurePosixPath(self.name).match(pattern)
+
+    def open(self, mode: str = "r") -> IO:
+        key = (self.archive, self.archive.stat().st_mtime_ns, os.getpid())
+        with _errors(f"Can't read {self}"):
+            if _suffix(self.archive, ZIP):
+                data = _zipfile(*key).read(self.name)
+            else:
+                stream = _tarfile(*key).fileobj
+                stream.seek(self.offset)
+                data = stream.read(self.size)
+        if "b" in mode:
+            return io.BytesIO(data)
+        return io.StringIO(data.decode("utf-8"), newline=None)
+
+    def resolve(self, *args, **kwargs) -> "Member":
+        return self._replace(archive=self.archive.resolve())
+
+    def stat(self) -> os.stat_result:
+        """Return the stat of the archive, with the size of the member."""
+        st = self.archive.stat()
+        return os.stat_result(
+            (stat.S_IFREG | 0o444, 0, st.st_dev, 1, st.st_uid, st.st_gid)
+            + (self.size, st.st_atime, st.st_mtime, st.st_ctime)
+        )
+
+    @classmethod
+    def typeof(cls, instance) -> bool:
+        return isinstance(instance, cls)
+
+
+def members(path: pathlib.Path) -> Iterator[Member]:
+    """Return the files in the archive at `path`, in archive order.
+    Raise OSError if it can't be read.
+    """
+    with _errors(f"Can't read {path}"):
+        if _suffix(path, ZIP):
+            import zipfile
+
+            with zipfile.ZipFile(path) as zf:
+                infos = zf.infolist()
+            yield from (
+                Member(path, info.filename, -1, info.file_size)
+                for info in infos
+                if not info.is_dir()
+            )
+            return
+
+        import tarfile
+
+        with tarfile.open(path) as tf:
+            for info in tf:
+                if info.isfile():
+                    yield Member(path, info.name, info.offset_data, info.size)
+
+
+@contextlib.contextmanager
+def _errors(message: str) -> Iterator[None]:
+    """Raise errors reading archives as OSError, like any unreadable file.
+    zipfile and tarfile are only imported once an archive is used.
+    """
+    try:
+        yield
+    except OSError:
+        raise
+    except Exception as e:
+        import tarfile
+        import zipfile
+
+        if isinstance(
+            e, (EOFError, KeyError, tarfile.TarError, zipfile.BadZipFile)
+        ):
+            raise OSError(f"{message}: {e}") from e
+        raise
+
+
+# Each process opens its own archives, so forked workers never share a
+# file offset, and opens them again when they change.
+@functools.lru_cache(maxsize=4)
+def _zipfile(path: pathlib.Path, mtime: int, pid: int):
+    import zipfile
+
+    return zipfile.ZipFile(path)
+
+
+@functools.lru_cache(maxsize=4)
+def _tarfile(path: pathlib.Path, mtime: int, pid: int):
+    import tarfile
+
+    return tarfile.open(path)
+
@@ -0,0 +1,463 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+"""Find validator patterns that backtrack badly.
+
+Each pattern is parsed, its quantifiers checked for overlaps that let it
+match the same text in many ways, and then timed on inputs built to make
+it backtrack, of growing length. A pattern whose time grows faster than
+linearly with the input is reported:
+
+    python3 -m apexlint.backtracking --rules apexlint-rules.toml
+"""
+import argparse
+import math
+import os
+import pathlib
+import re
+import string
+import sys
+import time
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
+
+from . import base, retools
+
+# Characters considered when comparing what quantifiers can match, in the
+# order representatives are chosen
+ALPHABET = "ax0 _'\"/*\\" + "".join(
+    c for c in string.printable if c not in "ax0 _'\"/*\\"
+)
+
+# Time growth, as the exponent k of n**k, above which a pattern is reported
+MAX_EXPONENT = 1.5
+
+# Input never matched by patterns, to make them fail after backtracking
+FAIL = "\x00"
+
+REPEATS = ("MAX_REPEAT", "MIN_REPEAT")
+ZERO_WIDTH = ("AT", "ASSERT", "ASSERT_NOT")
+
+
+class Finding(NamedTuple):
+    """A pattern whose search time grew as n**`exponent` on `prefix`,
+    then `pump` n times, then a character that doesn't match.
+    """
+
+    pattern: str
+    prefix: str
+    pump: str
+    exponent: float
+    reasons: Tuple[str, ...]
+
+    def __str__(self):
+        reasons = f" ({'; '.join(self.reasons)})" if self.reasons else ""
+        return (
+            f"{self.pattern!r} takes time ~n**{self.exponent:.1f} on "
+            f"{self.prefix!r} + {self.pump!r} * n{reasons}"
+        )
+
+
+def _name(op: Any) -> str:
+    return str(op).upper()
+
+
+def _category(category: Any, c: str) -> bool:
+    name = _name(category)
+    negate = "NOT_" in name
+    if "DIGIT" in name:
+        found = c.isdigit()
+    elif "SPACE" in name:
+        found = c.isspace()
+    elif "WORD" in name:
+        found = c.isalnum() or c == "_"
+    else:  # Line breaks
+        found = c == "\n"
+    return found != negate
+
+
+class Analysis:
+    """The quantifiers of one pattern, as parsed by the `re` parser."""
+
+    def __init__(self, pattern: retools.PatternOrStr) -> None:
+        self.pattern: Pattern = retools.escape(pattern)
+        self.ignorecase = bool(self.pattern.flags & re.IGNORECASE)
+        self.items = retools._parser().parse(
+            self.pattern.pattern, self.pattern.flags
+        )
+
+    def chars(self, op: Any, av: Any) -> FrozenSet[str]:
+        """Return the characters a single-character item matches."""
+        name = _name(op)
+        if name == "LITERAL":
+            c = chr(av)
+            return frozenset((c, c.swapcase()) if self.ignorecase else (c,))
+        if name == "NOT_LITERAL":
+            return frozenset(ALPHABET) - self.chars("LITERAL", av)
+        if name == "ANY":
+            return frozenset(ALPHABET) - {"\n"}
+        if name == "IN":
+            negate = False
+            found: Set[str] = set()
+            for o, a in av:
+                n = _name(o)
+                if n == "NEGATE":
+                    negate = True
+                elif n == "LITERAL":
+                    found |= self.chars(o, a)
+                elif n == "RANGE":
+                    low, high = a
+                    found.update(c for c in ALPHABET if low <= ord(c) <= high)
+                elif n == "CATEGORY":
+                    found.update(c for c in ALPHABET if _category(a, c))
+                else:
+                    found.update(ALPHABET)
+            return frozenset(ALPHABET) - found if negate else frozenset(found)
+        return frozenset()
+
+    def nullable(self, items: Sequence) -> bool:
+        """Return whether `items` may match the empty string."""
+        for op, av in items:
+            name = _name(op)
+            if name in ZERO_WIDTH:
+                continue
+            if name in REPEATS or name == "POSSESSIVE_REPEAT":
+                if av[0] == 0 or self.nullable(av[2]):
+                    continue
+            elif name == "SUBPATTERN":
+                if self.nullable(av[-1]):
+                    continue
+            elif name == "ATOMIC_GROUP":
+                if self.nullable(av):
+                    continue
+            elif name == "BRANCH":
+                if any(self.nullable(b) for b in av[1]):
+                    continue
+            elif name.startswith("GROUPREF"):
+                continue
+            return False
+        return True
+
+    def first(self, items: Sequence) -> FrozenSet[str]:
+        """Return the characters `items` may start with."""
+        found: FrozenSet[str] = frozenset()
+        for op, av in items:
+            name = _name(op)
+            if name in REPEATS or name == "POSSESSIVE_REPEAT":
+                found |= self.first(av[2])
+            elif name == "SUBPATTERN":
+                found |= self.first(av[-1])
+            elif name == "ATOMIC_GROUP":
+                found |= self.first(av)
+            elif name == "BRANCH":
+                for branch in av[1]:
+                    found |= self.first(branch)
+            elif name.startswith("GROUPREF"):
+                found |= frozenset(ALPHABET)
+            elif name not in ZERO_WIDTH:
+                found |= self.chars(op, av)
+            if not self.nullable([(op, av)]):
+                break
+        return found
+
+    def sample(self, items: Sequence) -> str:
+        """Return a short string that `items` match."""
+        out = []
+        for op, av in items:
+            name = _name(op)
+            if name in REPEATS or name == "POSSESSIVE_REPEAT":
+                out.append(self.sample(av[2]) * av[0])
+            elif name == "SUBPATTERN":
+                out.append(self.sample(av[-1]))
+            elif name == "ATOMIC_GROUP":
+                out.append(self.sample(av))
+            elif name == "BRANCH":
+                out.append(self.sample(av[1][0]))
+            elif name not in ZERO_WIDTH and not name.startswith("GROUPREF"):
+                chars = self.chars(op, av)
+                out.append(min(chars, key=ALPHABET.find) if chars else "")
+        return "".join(out)
+
+    def reasons(self) -> List[str]:
+        """Return why the pattern might backtrack badly, if it might."""
+        found: List[str] = []
+        self._check(self.items, frozenset(), repeated=False, found=found)
+        if self.items and _name(self.items[0][0]) in REPEATS:
+            if self.items[0][1][1] > 1:
+                found.append("leading quantifier is tried at every start")
+        return found
+
+    def _check(
+        self,
+        items: Sequence,
+        follow: FrozenSet[str],
+        *,
+        repeated: bool,
+        found: List[str],
+    ) -> None:
+        for i, (op, av) in enumerate(items):
+            rest = items[i + 1 :]
+            after = self.first(rest)
+            if self.nullable(rest):
+                after |= follow
+            name = _name(op)
+            if name in REPEATS:
+                low, high, body = av
+                if high > 1:
+                    chars = self.first(body)
+                    if repeated and chars & after:
+                        found.append("nested quantifiers overlap")
+                    nxt = self._next_repeat(rest)
+                    if nxt is not None and chars & self.first(nxt[2]):
+                        found.append("adjacent quantifiers overlap")
+                    # Another iteration may follow the body
+                    self._check(
+                        body,
+                        after | chars,
+                        repeated=True,
+                        found=found,
+                    )
+                else:
+                    self._check(body, after, repeated=repeated, found=found)
+            elif name == "SUBPATTERN":
+                self._check(av[-1], after, repeated=repeated, found=found)
+            elif name == "BRANCH":
+                branches = av[1]
+                if repeated:
+                    seen: FrozenSet[str] = frozenset()
+                    for branch in branches:
+                        chars = self.first(branch)
+                        if chars & seen:
+                            found.append("alternatives overlap")
+                            break
+                        seen |= chars
+                for branch in branches:
+                    self._check(branch, after, repeated=repeated, found=found)
+            elif name in ("ASSERT", "ASSERT_NOT"):
+                self._check(av[1], frozenset(), repeated=False, found=found)
+            # Possessive and atomic groups never backtrack
+
+    def _next_repeat(self, items: Sequence) -> Optional[Tuple]:
+        """Return the next unbounded quantifier, if only optional items
+        come before it.
+        """
+        for op, av in items:
+            if _name(op) in REPEATS and av[1] > 1:
+                return av
+            if not self.nullable([(op, av)]):
+                return None
+        return None
+
+    def attacks(self) -> List[Tuple[str, str]]:
+        """Return a (prefix, pump) to repeat for each quantifier."""
+        found: List[Tuple[str, str]] = []
+        self._attacks(self.items, "", found)
+        # Whole matches up to each quantifier, repeated
+        found += [("", prefix + pump) for prefix, pump in found if prefix]
+        unique = []
+        for attack in found:
+            if attack[1] and attack not in unique:
+                unique.append(attack)
+        return unique
+
+    def _attacks(
+        self, items: Sequence, prefix: str, found: List[Tuple[str, str]]
+    ) -> None:
+        for i, (op, av) in enumerate(items):
+            before = prefix + self.sample(items[:i])
+            name = _name(op)
+            if name in REPEATS or name == "POSSESSIVE_REPEAT":
+                body = av[2]
+                if av[1] > 1:
+                    pump = self.sample(body)
+                    chars = self.first(body)
+                    if not pump and chars:
+                        pump = min(chars, key=ALPHABET.find)
+                    found.append((before, pump))
+                    for c in sorted(chars, key=ALPHABET.find)[:2]:
+                        found.append((before, c))
+                self._attacks(body, before, found)
+            elif name == "SUBPATTERN":
+                self._attacks(av[-1], before, found)
+            elif name == "BRANCH":
+                for branch in av[1]:
+                    self._attacks(branch, before, found)
+
+
+def _time(pattern: Pattern, text: str, *, budget: float) -> float:
+    """Return the seconds one search of `text` takes, repeating quick
+    searches so they can be measured, and keeping the best of 3 so other
+    processes don't make a linear pattern look slower than it is.
+    """
+
+    def run(number: int) -> float:
+        start = time.process_time()
+        for _ in range(number):
+            pattern.search(text)
+        return time.process_time() - start
+
+    number = 1
+    elapsed = run(number)
+    while elapsed < 0.0002:
+        number *= 10
+        elapsed = run(number)
+    if elapsed < budget:
+        elapsed = min(elapsed, run(number), run(number))
+    return elapsed / number
+
+
+def growth(
+    pattern: Pattern,
+    prefix: str,
+    pump: str,
+    *,
+    budget: float = 0.05,
+    max_length: int = 1024,
+) -> float:
+    """Return the exponent k of n**k that best describes how the time to
+    search `prefix + pump * n`, followed by a non-match, grows with n.
+    The input grows until a search takes `budget` seconds, slowly once
+    searches are no longer quick, so exponential patterns stop early.
+    """
+    timings: List[Tuple[int, float]] = []
+    n = 8
+    while len(pump) * n <= max_length:
+        seconds = _time(pattern, prefix + pump * n + FAIL, budget=budget)
+        timings.append((n, seconds))
+        if seconds > budget:
+            break
+        n = n * 2 if seconds < budget / 1000 else n + max(1, n // 4)
+
+    if len(timings) < 2:
+        return 0.0
+
+    # Fit the larger inputs, whose times are least noisy
+    largest = timings[-1][0]
+    fitted = [(n, t) for n, t in timings if n * 4 >= largest]
+    if len(fitted) < 2:
+        fitted = timings[-2:]
+    (n1, t1), (n2, t2) = fitted[0], fitted[-1]
+    return math.log(max(t2, 1e-9) / max(t1, 1e-9)) / math.log(n2 / n1)
+
+
+def check(
+    pattern: retools.PatternOrStr, *, budget: float = 0.05
+) -> Optional[Finding]:
+    """Return the worst Finding for `pattern`, if it grows faster than
+    linearly on any input built for its quantifiers.
+    """
+    analysis = Analysis(pattern)
+    worst: Optional[Finding] = None
+    for prefix, pump in analysis.attacks():
+        exponent = growth(analysis.pattern, prefix, pump, budget=budget)
+        if exponent > MAX_EXPONENT:
+            # Confirm, in case something else was running
+            exponent = min(
+                exponent,
+                growth(analysis.pattern, prefix, pump, budget=budget),
+            )
+        if exponent > MAX_EXPONENT and (
+            worst is None or exponent > worst.exponent
+        ):
+            worst = Finding(
+                pattern=analysis.pattern.pattern,
+                prefix=prefix,
+                pump=pump,
+                exponent=exponent,
+                reasons=tuple(dict.fromkeys(analysis.reasons())),
+            )
+    return worst
+
+
+def patterns(
+    validator: Type[base.Validator],
+) -> Iterator[Tuple[str, retools.PatternOrStr]]:
+    """Return the name and value of each pattern of `validator`."""
+    for attribute in ("invalid", "suppress"):
+        value = getattr(validator, attribute, None)
+        if value is not None:
+            yield attribute, value
+
+
+def validators(
+    found: Iterable[Type[base.Validator]],
+    *,
+    budget: float = 0.05,
+    suspects: bool = False,
+) -> Iterator[Tuple[str, Finding]]:
+    """Return a Finding for each pattern of the `found` validators that
+    backtracks badly, named as "Validator.attribute". Patterns shared by
+    several validators are only timed once, and with `suspects`, only
+    those whose quantifiers overlap are timed at all.
+    """
+    checked: Dict[Tuple[str, int], Optional[Finding]] = {}
+    for v in found:
+        for attribute, value in patterns(v):
+            compiled = retools.escape(value)
+            key = (compiled.pattern, compiled.flags)
+            if key not in checked:
+                checked[key] = None
+                if not suspects or Analysis(compiled).reasons():
+                    checked[key] = check(compiled, budget=budget)
+            finding = checked[key]
+            if finding is not None:
+                yield f"{v.__name__}.{attribute}", finding
+
+
+def main(args: Sequence[str]) -> int:
+    from . import rules
+    from . import validators as library
+
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.executable)} -m apexlint.backtracking",
+        description="Time validator patterns on inputs made to backtrack",
+    )
+    parser.add_argument("--rules", type=pathlib.Path, metavar="FILE")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.05,
+        help="seconds a search may take before inputs stop growing",
+    )
+    config = parser.parse_args(args)
+    try:
+        loaded = rules.load(config.rules) if config.rules else ()
+    except rules.RuleError as e:
+        parser.error(str(e))
+
+    found = [v.load() for v in library.library(rules=loaded)]
+    status = 0
+    for name, finding in validators(found, budget=config.budget):
+        print(f"{name}: {finding}")
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -15,11 +15,15 @@
 # permissions and limitations under the License.
 #
 import abc
+import functools
 import os
 import pathlib
-import textwrap
+import re
 from typing import (
+    Dict,
+    FrozenSet,
     Iterable,
+    List,
     Match,
     NamedTuple,
     Optional,
@@ -27,35 +31,69 @@ from typing import (
     Sequence,
     Tuple,
     Type,
+    Union,
 )
 
-from . import pathtools, terminfo
+from . import classindex, lexer, pathtools, retools, sfdx, terminfo
+
+
+class Span:
+    """Stand in for the `Match` of an error found without a regexp.
+    Every group, including "cursor", spans the whole error.
+    """
+
+    __slots__ = ("_start", "_end")
+
+    def __init__(self, start: int, end: int) -> None:
+        self._start = start
+        self._end = end
+
+    def start(self, group: Union[int, str] = 0) -> int:
+        return self._start
+
+    def end(self, group: Union[int, str] = 0) -> int:
+        return self._end
+
+    def span(self, group: Union[int, str] = 0) -> Tuple[int, int]:
+        return self._start, self._end
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._start}, {self._end})"
 
 
 class Error(NamedTuple):
-    match: Match
+    match: Union[Match, Span]
     message: str
 
 
 class Location(NamedTuple):
+    """Where an error is: the "cursor" group of its match, or the start
+    of the match if there is none. It holds offsets, not the Match, so it
+    can be pickled without the line and pattern.
+    """
+
     line: int
-    match: Match
+    start: int
+    end: int
     path: pathlib.Path
 
-    @property
-    def len(self) -> int:
+    @classmethod
+    def of(
+        cls, *, line: int, match: Union[Match, Span], path: pathlib.Path
+    ) -> "Location":
         try:
-            start, end = self.match.span("cursor")
+            start, end = match.span("cursor")
         except IndexError:
-            return 0
-        return max(end - start, 0)
+            start = end = match.start()
+        return cls(line=line, start=start, end=max(end, start), path=path)
+
+    @property
+    def len(self) -> int:
+        return self.end - self.start
 
     @property
     def column(self) -> int:
-        try:
-            return self.match.start("cursor")
-        except IndexError:
-            return self.match.start()
+        return self.start
 
     @property
     def arrow(self) -> str:
@@ -72,6 +110,7 @@ class Message(NamedTuple):
     location: Location
     message: str
     source: str
+    validator: str = ""
 
     def split_message(self) -> Tuple[str, Optional[str]]:
         bits = self.message.split("\n", 1)
@@ -89,6 +128,8 @@ class Message(NamedTuple):
         if term is None:
             term = terminfo.TermInfo.get(color=False)
 
+        import textwrap  # Only needed to render messages
+
         summary, description = self.split_message()
 
         out = (
@@ -124,14 +165,21 @@ class Validator(abc.ABC):
     `invalid` is a regexp that matches errors in the file.
     `filenames` is a sequence of wildcard patterns for files to match.
     `suppress` is a regexp that silences an error if it matches.
+    Either regexp may be `retools.lazy`, to compile it on first use.
+    `enabled` may refine `filenames` with the facts in a class `index`.
     """
 
-    invalid: Pattern
+    invalid: Union[Pattern, retools.LazyPattern]
     filenames: Iterable[str] = ("*.cls", "*.trigger")
-    suppress: Optional[Pattern] = None
+    suppress: Optional[Union[Pattern, retools.LazyPattern]] = None
 
     @classmethod
-    def enabled(cls, *, path: pathlib.Path):
+    def enabled(
+        cls,
+        *,
+        path: pathlib.Path,
+        index: Optional["classindex.Index"] = None,
+    ):
         return (
             pathtools.StdIn.typeof(path)
             or bool(cls.filenames)
@@ -140,24 +188,41 @@ class Validator(abc.ABC):
 
     @staticmethod
     def filter(
-        validators: Iterable[Type["Validator"]], *, path: pathlib.Path
+        validators: Iterable[Type["Validator"]],
+        *,
+        path: pathlib.Path,
+        index: Optional["classindex.Index"] = None,
+        project: Optional["sfdx.Project"] = None,
     ) -> Sequence[Type["Validator"]]:
+        package = project.package(path) if project is not None else None
+        if package is not None:
+            validators = (v for v in validators if package.allows(v.__name__))
         return tuple(
-            v
+            v.load()
             for v in validators
-            if pathtools.StdIn.typeof(path) or v.enabled(path=path)
+            if pathtools.StdIn.typeof(path)
+            or v.enabled(path=path, index=index)
         )
 
     @classmethod
-    def errors(cls, line: str, *, suppress: bool) -> Iterable[Error]:
-        if suppress and cls.suppress is not None and cls.suppress.search(line):
-            return
+    def load(cls) -> Type["Validator"]:
+        """Return the validator; a `plugins.Spec` imports it instead."""
+        return cls
 
+    @classmethod
+    def errors(cls, line: str, *, suppress: bool) -> Iterable[Error]:
         for m in cls.invalid.finditer(line):
+            # Only lines with errors need the suppression regex
+            if suppress and cls.suppressed(line):
+                return
             yield Error(match=m, message=cls.message(match=m, source=line))
 
     @classmethod
-    def message(cls, *, match: Match, source: str) -> str:
+    def suppressed(cls, line: str) -> bool:
+        return cls.suppress is not None and bool(cls.suppress.search(line))
+
+    @classmethod
+    def message(cls, *, match: Union[Match, Span], source: str) -> str:
         if not cls.__doc__:
             return ""
 
@@ -165,6 +230,200 @@ class Validator(abc.ABC):
         bits = cls.__doc__.split("\n", 1)
         msg = bits[0]
         if len(bits) > 1:
+            import textwrap  # Only needed to render messages
+
             msg += "\n" + textwrap.dedent(bits[1])
 
         return msg.format(match=match, source=source).strip()
+
+
+@functools.lru_cache(maxsize=64)
+def prefilter(
+    validators: Tuple[Type[Validator], ...]
+) -> Tuple[Optional[Pattern], FrozenSet[Type[Validator]]]:
+    """Return one Pattern that finds any error of the `validators` that
+    find errors with `invalid` alone, and those validators; or None if
+    they are too few, or can't be combined.
+    A line it doesn't match has no errors from them.
+    """
+    screened = [
+        v
+        for v in validators
+        if not issubclass(v, TokenValidator)
+        and getattr(v.errors, "__func__", None) is Validator.errors.__func__
+    ]
+    if len(screened) < 2:
+        return None, frozenset()
+    combined = retools.union([v.invalid for v in screened])
+    if combined is None:
+        return None, frozenset()
+    return combined, frozenset(screened)
+
+
+class TokenValidator(Validator):
+    """Define a validator to run against the tokens of a source file:
+    `pattern` is a sequence of token keys, or `lexer.Kind`s, that starts
+    an error. Keys are case-folded, see `lexer.Token`.
+    `check` is called for each match of `pattern`, with the index of
+    its first token, and returns the first and last tokens of the error;
+    it may read ahead to the end of the statement, or of the parentheses
+    opened in it.
+    Comments are not passed to `check`.
+    `in_scope` is asked first, with the `lexer.Scope` of the match.
+    """
+
+    invalid = None
+    pattern: Sequence[Union[str, lexer.Kind]]
+
+    @classmethod
+    def check(
+        cls, tokens: Sequence[lexer.Token], i: int
+    ) -> Optional[Tuple[lexer.Token, lexer.Token]]:
+        return tokens[i], tokens[i + len(cls.pattern) - 1]
+
+    @classmethod
+    def in_scope(cls, scope: lexer.Scope) -> bool:
+        """Return whether to check a match in `scope`."""
+        return True
+
+    @classmethod
+    def errors(cls, line: str, *, suppress: bool) -> Iterable[Error]:
+        """Match a single `line`; see `token_errors` to match a file."""
+        for _, _, error in token_errors(
+            [line], suppress=suppress, validators=(cls,)
+        ):
+            yield error
+
+
+@functools.lru_cache(maxsize=64)
+def first_keys(
+    validators: Tuple[Type[TokenValidator], ...]
+) -> Optional[Pattern]:
+    """Return one Pattern that finds the first key of the pattern of any
+    of `validators` in a line, or None if one starts with a `lexer.Kind`
+    or they can't be combined. Keys are matched wherever they are, so
+    also in comments and strings.
+    """
+    keys = set()
+    for v in validators:
+        key = v.pattern[0]
+        if isinstance(key, lexer.Kind):
+            return None
+        keys.add(key)
+    if not keys:
+        return NOTHING
+    return retools.union([_key(k) for k in sorted(keys)])
+
+
+def _key(key: str) -> Pattern:
+    source = re.escape(key)
+    if key.startswith("@"):
+        # Annotations may have space after the @
+        source = r"@\s*" + re.escape(key[1:])
+    elif WORD.match(key):
+        source = r"\b" + source
+    if WORD.match(key[-1]):
+        source += r"\b"
+    return re.compile(source, flags=re.I)
+
+
+WORD = re.compile(r"\w")
+
+
+# Matches no line
+NOTHING = retools.lazy(re.compile, r"(?!)")
+
+# The tokens `lexer.Scopes` moves on, besides annotations
+SCOPES = frozenset(("{", "}", ";"))
+
+
+def token_errors(
+    lines: Sequence[str],
+    *,
+    suppress: bool,
+    validators: Sequence[Type[TokenValidator]],
+    tokens: Optional[Sequence[lexer.Token]] = None,
+    scopes: Optional[lexer.Scopes] = None,
+) -> Iterable[Tuple[Type[TokenValidator], int, Error]]:
+    """Return the errors of `validators` for `lines`, in token order.
+    Each token is looked up once against the first key of every pattern,
+    and the scope of each is tracked in the same pass, from `scopes` if
+    `lines` are part of a file. Only the lines that may start an error
+    are lexed in full, see `lexer.screened`, and scopes are only tracked
+    if a validator that asks for them may match.
+    """
+    if tokens is None:
+        wanted = first_keys(tuple(validators))
+        scoped = first_keys(
+            tuple(
+                v
+                for v in validators
+                if v.in_scope.__func__ is not TokenValidator.in_scope.__func__
+            )
+        )
+        tokens = list(
+            lexer.screened(
+                lines,
+                wanted=wanted,
+                scoped=scoped is None or bool(scoped.search("\n".join(lines))),
+            )
+        )
+
+    first: Dict[Union[str, lexer.Kind], List[Type[TokenValidator]]] = {}
+    for v in validators:
+        first.setdefault(v.pattern[0], []).append(v)
+
+    if scopes is None:
+        scopes = lexer.Scopes()
+    annotation = lexer.Kind.ANNOTATION
+    kinds = {k for k in first if isinstance(k, lexer.Kind)}
+    for i, t in enumerate(tokens):
+        if t.key in first or (kinds and t.kind in kinds):
+            yield from _token_errors(lines, tokens, i, first, scopes, suppress)
+        if t.kind is annotation or t.key in SCOPES:
+            scopes.advance(t)
+
+
+def _token_errors(
+    lines: Sequence[str],
+    tokens: Sequence[lexer.Token],
+    i: int,
+    first: Dict[Union[str, lexer.Kind], List[Type[TokenValidator]]],
+    scopes: lexer.Scopes,
+    suppress: bool,
+) -> Iterable[Tuple[Type[TokenValidator], int, Error]]:
+    t = tokens[i]
+    for candidates in (first.get(t.key), first.get(t.kind)):
+        for v in candidates or ():
+            if not _follows(tokens, i, v.pattern):
+                continue
+            if not v.in_scope(scopes.scope):
+                continue
+            found = v.check(tokens, i)
+            if found is None:
+                continue
+
+            start, last = found
+            source = lines[start.line - 1]
+            if suppress and v.suppressed(source):
+                continue
+
+            # Errors spanning lines are reported on their first line
+            end = last.end if last.line == start.line else len(source)
+            m = Span(start.column, end)
+            yield v, start.line, Error(
+                match=m, message=v.message(match=m, source=source)
+            )
+
+
+def _follows(
+    tokens: Sequence[lexer.Token],
+    i: int,
+    pattern: Sequence[Union[str, lexer.Kind]],
+) -> bool:
+    if i + len(pattern) > len(tokens):
+        return False
+    for p, t in zip(pattern, tokens[i : i + len(pattern)]):
+        if p != t.key and p is not t.kind:
+            return False
+    return True
@@ -0,0 +1,108 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import collections
+import functools
+import os
+import pathlib
+from typing import Counter, Iterable, Optional
+
+from . import base, gittree, pathtools
+
+
+class Baseline:
+    """Known errors, to be ignored.
+    Each error is a fingerprint of its validator, its path relative to the
+    baseline file, and a hash of its source line without whitespace.
+    Line numbers are left out, so fingerprints survive edits elsewhere in
+    the file. A fingerprint recorded N times ignores N identical errors.
+    Pickling a Baseline that has a file only pickles its path.
+    """
+
+    def __init__(self, path: Optional[pathlib.Path] = None) -> None:
+        self.path = path
+        self.fingerprints: Counter[str] = collections.Counter()
+
+    def __reduce__(self):
+        if self.path is None:
+            return object.__reduce__(self)
+        return (Baseline.open, (self.path,))
+
+    @classmethod
+    def open(cls, path: pathlib.Path) -> "Baseline":
+        """Return the Baseline saved at `path`, or an empty one."""
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return cls(path)
+        return _load(path, mtime)
+
+    def fingerprint(self, message: base.Message) -> str:
+        import hashlib  # Only needed with a baseline
+
+        path = message.location.path
+        if pathtools.StdIn.typeof(path):
+            filename = str(path)
+        elif gittree.Blob.typeof(path):
+            # As a file of the worktree, with the baseline at its root
+            filename = path.name
+        elif self.path is None:
+            filename = pathlib.Path(path).as_posix()
+        else:
+            filename = pathlib.Path(
+                os.path.relpath(
+                    os.path.abspath(path), start=self.path.parent.absolute()
+                )
+            ).as_posix()
+        source = "".join(message.source.split())
+        digest = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+        return f"{message.validator}\t{filename}\t{digest}"
+
+    def known(self, message: base.Message, seen: Counter[str]) -> bool:
+        """Return whether `message` is in the baseline.
+        `seen` counts the fingerprints already matched in the same file.
+        """
+        fingerprint = self.fingerprint(message)
+        allowed = self.fingerprints.get(fingerprint)
+        if not allowed or seen[fingerprint] >= allowed:
+            return False
+        seen[fingerprint] += 1
+        return True
+
+    def add(self, fingerprints: Iterable[str]) -> None:
+        self.fingerprints.update(fingerprints)
+
+    def save(self) -> None:
+        with self.path.open(mode="w") as f:
+            for fingerprint in sorted(self.fingerprints.elements()):
+                print(fingerprint, file=f)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "Baseline":
+        self = cls(path)
+        with path.open(mode="r") as f:
+            self.add(line.rstrip("\n") for line in f if line.strip())
+        return self
+
+    def __len__(self) -> int:
+        return sum(self.fingerprints.values())
+
+
+@functools.lru_cache(maxsize=4)
+def _load(path: pathlib.Path, mtime: int) -> Baseline:
+    """Load each version of a baseline only once per process."""
+    return Baseline.load(path)
+
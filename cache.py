@@ -0,0 +1,166 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import functools
+import json
+import logging
+import os
+import pathlib
+import sys
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple, Type
+
+from . import base
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+
+# The messages, lines and bytes of a file, or why it was skipped
+Found = Tuple[List[base.Message], int, int, Optional[str]]
+
+
+class Cache(NamedTuple):
+    """The messages of validated file contents, kept across runs in the
+    directory `path`, one file per entry, so each worker reads and writes
+    its own entries. Entries are keyed by a digest of the contents, such
+    as a blob id, with the validators, the code that defines them, and
+    the options of the run; so a change to any of them misses.
+    """
+
+    path: pathlib.Path
+
+    def key(self, digest: str, validators: Sequence[Type], *options) -> str:
+        import hashlib  # Only needed with a cache
+
+        data = json.dumps(
+            [VERSION, digest, _code(tuple(validators))] + list(options),
+            default=repr,
+        )
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def _filename(self, key: str) -> pathlib.Path:
+        return self.path / key[:2] / key[2:]
+
+    def get(self, key: str, *, path: pathlib.Path) -> Optional[Found]:
+        """Return what was found in the contents of `key`, now at `path`,
+        if they were validated before.
+        """
+        try:
+            with self._filename(key).open(mode="r") as f:
+                data = json.load(f)
+            return (
+                [
+                    base.Message(
+                        location=base.Location(line, start, end, path=path),
+                        message=message,
+                        source=source,
+                        validator=validator,
+                    )
+                    for line, start, end, message, source, validator in data[
+                        "messages"
+                    ]
+                ],
+                data["lines"],
+                data["bytes"],
+                data["skip"],
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.debug(f"Ignoring cached {key}: {e}")
+            return None
+
+    def put(self, key: str, found: Found) -> None:
+        """Keep what was found in the contents of `key`. Entries are
+        replaced whole, so concurrent workers never see part of one.
+        """
+        messages, lines, size, skip = found
+        data = {
+            "messages": [
+                [
+                    m.location.line,
+                    m.location.start,
+                    m.location.end,
+                    m.message,
+                    m.source,
+                    m.validator,
+                ]
+                for m in messages
+            ],
+            "lines": lines,
+            "bytes": size,
+            "skip": skip,
+        }
+        filename = self._filename(key)
+        tmp = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+        try:
+            filename.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open(mode="w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, filename)
+        except OSError as e:
+            log.debug(f"Can't cache {key}: {e}")
+
+
+@functools.lru_cache(maxsize=16)
+def _code(validators: Tuple[Type, ...]) -> List[Any]:
+    """Return what identifies `validators` and the code that runs them:
+    their names, and the size and time of the files that define them.
+    Rules are defined by their fields instead.
+    """
+    package = __name__.rpartition(".")[0]
+    modules = {package} | {v.__module__ for v in validators}
+    found: List[Any] = [
+        [v.__module__, v.__qualname__, _rule(v)] for v in validators
+    ]
+    for name in sorted(modules):
+        module = sys.modules.get(name)
+        filename = getattr(module, "__file__", None)
+        if filename is None:
+            continue
+        # The whole package, for the engine that runs validators
+        directory = os.path.dirname(filename)
+        if os.path.basename(filename) != "__init__.py":
+            directory = None
+        for f in [filename] if directory is None else _sources(directory):
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            found.append([f, st.st_size, st.st_mtime_ns])
+    return found
+
+
+def _sources(directory: str) -> List[str]:
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(".py")
+    )
+
+
+def _rule(v: Type) -> Optional[List[Any]]:
+    """Return the fields of a validator compiled from a rule, if it is."""
+    from . import rules
+
+    if v.__module__ != rules.__name__:
+        return None
+    return [
+        v.invalid.pattern,
+        list(v.filenames),
+        v.__doc__,
+        None if v.suppress is None else v.suppress.pattern,
+    ]
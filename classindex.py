@@ -0,0 +1,275 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import functools
+import json
+import logging
+import os
+import pathlib
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from . import PROGNAME, archives, lexer, pathtools
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+
+# Only classes are indexed
+FILENAMES = ("*.cls",)
+
+# Test classes, by name, whether or not they are annotated
+TEST_FILENAMES = ("*Test.cls", "TestUtils.cls", "UnitTestFactory.cls")
+
+
+class Class(NamedTuple):
+    name: str
+    line: int
+    depth: int
+    test: bool
+
+
+class Entry(NamedTuple):
+    digest: str
+    mtime: int
+    size: int
+    classes: Tuple[Class, ...]
+
+    @property
+    def test(self) -> bool:
+        """Return whether the top-level class is annotated with @isTest."""
+        return any(c.test for c in self.classes if c.depth == 0)
+
+
+def classes(lines: Iterable[str]) -> Iterator[Class]:
+    """Return a Class iterator for the declarations in `lines`."""
+    scopes = lexer.Scopes()
+
+    tokens = lexer.code(lexer.tokenize(lines))
+    for i, t in enumerate(tokens):
+        # Skip class literals such as `Foo.class`
+        if (
+            t.key == "class"
+            and i + 1 < len(tokens)
+            and (i == 0 or tokens[i - 1].key != ".")
+        ):
+            scope = scopes.scope
+            yield Class(
+                name=tokens[i + 1].text,
+                line=t.line,
+                depth=scope.depth,
+                test="@istest" in scope.pending,
+            )
+        scopes.advance(t)
+
+
+def is_test(path: pathlib.Path, *, index: Optional["Index"] = None) -> bool:
+    """Return whether `path` is a test class: as declared, if indexed,
+    or else by its name. Standard input may be anything.
+    """
+    if pathtools.StdIn.typeof(path):
+        return True
+    test = None if index is None else index.test(path)
+    if test is not None:
+        return test
+    return any(path.match(pattern) for pattern in TEST_FILENAMES)
+
+
+def digest(data: bytes) -> str:
+    import hashlib  # Only needed with an index
+
+    return hashlib.sha1(data).hexdigest()
+
+
+def scan(filename: str, known: Optional[str] = None) -> Optional[Entry]:
+    """Return the Entry for `filename`, or None if it can't be read.
+    The classes are only parsed if the content digest isn't `known`.
+    """
+    try:
+        with open(filename, mode="rb") as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+    except OSError as e:
+        log.debug(f"Can't index {filename}: {e}")
+        return None
+
+    d = digest(data)
+    found: Tuple[Class, ...] = ()
+    if d != known:
+        text = data.decode("utf-8", errors="replace")
+        found = tuple(classes(text.splitlines()))
+    return Entry(
+        digest=d, mtime=st.st_mtime_ns, size=st.st_size, classes=found
+    )
+
+
+class Index:
+    """Persistent index of the classes declared in each file.
+    Entries are keyed by path, relative to the directory of the index.
+    Pickling an Index that has a file only pickles its path.
+    """
+
+    def __init__(self, path: Optional[pathlib.Path] = None) -> None:
+        self.path = path
+        self.entries: Dict[str, Entry] = {}
+        self.dirty = False
+
+    def __reduce__(self):
+        if self.path is None:
+            return object.__reduce__(self)
+        return (Index.open, (self.path,))
+
+    @classmethod
+    def open(cls, path: pathlib.Path) -> "Index":
+        """Return the Index saved at `path`, or an empty one."""
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return cls(path)
+        return _load(path, mtime)
+
+    def key(self, path: pathlib.Path) -> str:
+        filename = os.path.abspath(path)
+        if self.path is None:
+            return filename
+        return os.path.relpath(filename, start=self.path.parent.absolute())
+
+    def get(self, path: pathlib.Path) -> Optional[Entry]:
+        if pathtools.StdIn.typeof(path) or archives.Member.typeof(path):
+            return None
+        return self.entries.get(self.key(path))
+
+    def test(self, path: pathlib.Path) -> Optional[bool]:
+        """Return whether `path` declares a test class, if it's indexed."""
+        entry = self.get(path)
+        return None if entry is None else entry.test
+
+    def update(self, paths: Iterable[pathlib.Path], *, pool=None) -> int:
+        """Index `paths` whose content changed, in parallel if `pool`.
+        Drop entries for files that no longer exist.
+        Return the number of files whose content changed.
+        """
+        stale: List[Tuple[str, str, Optional[str]]] = []
+        seen = set()
+        for path in paths:
+            if pathtools.StdIn.typeof(path) or archives.Member.typeof(path):
+                continue
+            if not any(path.match(pattern) for pattern in FILENAMES):
+                continue
+            key = self.key(path)
+            seen.add(key)
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entry = self.entries.get(key)
+            if entry and (entry.mtime, entry.size) == (
+                st.st_mtime_ns,
+                st.st_size,
+            ):
+                continue
+            stale.append((key, os.fspath(path), entry and entry.digest))
+
+        mapper = pool.starmap if pool is not None else _starmap
+        scanned = mapper(scan, [(filename, d) for _, filename, d in stale])
+        changed = 0
+        for (key, _, known), entry in zip(stale, scanned):
+            if isinstance(entry, Exception):
+                # Given up on by a worker; indexed again next time
+                log.error(f"{PROGNAME}: {entry}")
+                continue
+            self.dirty = True
+            if entry is None:
+                self.entries.pop(key, None)
+                continue
+            if entry.digest == known:
+                # Only the timestamp changed
+                entry = entry._replace(classes=self.entries[key].classes)
+            else:
+                changed += 1
+            self.entries[key] = entry
+
+        for key in [k for k in self.entries if k not in seen]:
+            if not os.path.exists(self._filename(key)):
+                self.dirty = True
+                del self.entries[key]
+
+        return changed
+
+    def _filename(self, key: str) -> str:
+        if self.path is None:
+            return key
+        return os.path.join(self.path.parent, key)
+
+    def save(self) -> None:
+        if self.path is None or not self.dirty:
+            return
+        data = {
+            "version": VERSION,
+            "files": {
+                key: {
+                    "digest": e.digest,
+                    "mtime": e.mtime,
+                    "size": e.size,
+                    "classes": [list(c) for c in e.classes],
+                }
+                for key, e in sorted(self.entries.items())
+            },
+        }
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open(mode="w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "Index":
+        self = cls(path)
+        with path.open(mode="r") as f:
+            data = json.load(f)
+        if data.get("version") != VERSION:
+            log.debug(f"Ignoring {path}: version {data.get('version')}")
+            return self
+        for key, e in data["files"].items():
+            self.entries[key] = Entry(
+                digest=e["digest"],
+                mtime=e["mtime"],
+                size=e["size"],
+                classes=tuple(Class(*c) for c in e["classes"]),
+            )
+        return self
+
+
+@functools.lru_cache(maxsize=4)
+def _load(path: pathlib.Path, mtime: int) -> Index:
+    """Load each version of an index only once per process."""
+    try:
+        return Index.load(path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log.warning(f"Ignoring class index {path}: {e}")
+        return Index(path)
+
+
+def _starmap(fn, iterable: Iterable[Sequence]) -> List:
+    return [fn(*args) for args in iterable]
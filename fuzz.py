@@ -0,0 +1,311 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+"""Compare the messages of the reference engine, match.lines, with those
+of another engine, on random Apex-like files:
+
+    python -m apexlint.fuzz --engine files --iterations 1000
+
+Files whose messages differ are minimised, and printed with both outputs.
+"""
+import argparse
+import io
+import os
+import pathlib
+import pickle
+import random
+import sys
+import tempfile
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Type,
+)
+
+from . import base, limits, match, pathtools, results
+from . import validators as library
+
+Engine = Callable[[Sequence[str], Sequence[Type[base.Validator]]], List]
+
+# Fragments chosen for the cases engines get wrong
+FRAGMENTS = (
+    # Quotes and escapes
+    "'",
+    "''",
+    "'a'",
+    r"'\''",
+    r"'\\'",
+    r"'\\\''",
+    "'//'",
+    "'/*'",
+    "'*/'",
+    "'@isTest'",
+    "'new Map<Object, String>()'",
+    # Comments
+    "//",
+    "// noqa",
+    "// NOQA: NoTestMethod",
+    "// apexlint: disable=NoObjectMapKeys",
+    "// apexlint: enable=NoObjectMapKeys",
+    "// apexlint: disable",
+    "// apexlint: enable",
+    "/*",
+    "*/",
+    "/* */",
+    "/* '*/'",
+    "/**/",
+    "// https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md",
+    # Annotations
+    "@isTest",
+    "@IsTest(SeeAllData=true)",
+    "@isTest(isParallel=true, SeeAllData = false)",
+    "@ isTest(",
+    "SeeAllData=true)",
+    "@future",
+    "@Future(callout=true)",
+    "testMethod",
+    "static testmethod void t()",
+    # Generics
+    "new Map<Object, String>()",
+    "new Map<String, Object>()",
+    "new map<Id, List<Object>>()",
+    "new Map<Map<String, Id>, Id>()",
+    "new Set<Object>()",
+    "new Set<System.String>{}",
+    "new Set<Schema.SObjectType>()",
+    "new Map<",
+    "Object,",
+    "Id>()",
+    "<",
+    ">",
+    ">>",
+    # Everything else
+    "class FooTest {",
+    "}",
+    "{",
+    ";",
+    "(",
+    ")",
+    "foo",
+    "x = 1.5;",
+    "\t",
+)
+
+
+def line(rng: random.Random, *, fragments: int = 4) -> str:
+    """Return a random line of up to `fragments` fragments."""
+    parts = rng.choices(FRAGMENTS, k=rng.randint(0, fragments))
+    return "".join(p + rng.choice(("", " ", "  ")) for p in parts)
+
+
+def generate(rng: random.Random, *, lines: int = 8) -> List[str]:
+    """Return the random lines of a file of up to `lines` lines."""
+    return [line(rng) for _ in range(rng.randint(1, lines))]
+
+
+class Key(NamedTuple):
+    """The parts of a Message that engines must agree on."""
+
+    line: int
+    column: int
+    len: int
+    message: str
+    source: str
+    validator: str
+
+    @classmethod
+    def of(cls, message: base.Message) -> "Key":
+        return cls(
+            line=message.location.line,
+            column=message.location.column,
+            len=message.location.len,
+            message=message.message,
+            source=message.source,
+            validator=message.validator,
+        )
+
+
+def reference(lines, validators) -> List[Key]:
+    found = match.lines(lines, path=pathtools.stdin, validators=validators)
+    return [Key.of(m) for m in found]
+
+
+def files(lines, validators) -> List[Key]:
+    """Validate `lines` written to a file, as the command line does."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = pathlib.Path(tmpdir) / "FuzzTest.cls"
+        with path.open(mode="w") as f:
+            f.write("\n".join(lines))
+        return [
+            Key.of(m)
+            for m in match.files([path], validators=validators)
+            if isinstance(m, base.Message)
+        ]
+
+
+def pickled(lines, validators) -> List[Key]:
+    """Validate `lines`, as a worker would send the messages back."""
+    found = results.Results(
+        match.lines(lines, path=pathtools.stdin, validators=validators)
+    )
+    return [Key.of(m) for m in pickle.loads(pickle.dumps(found))]
+
+
+def windowed(lines, validators) -> List[Key]:
+    """Validate `lines` cut into windows, as if they were overlong."""
+    stream = io.StringIO("\n".join(lines))
+    found = match.lines(
+        limits.Limits(max_line=WINDOW).lines(stream),
+        path=pathtools.stdin,
+        validators=validators,
+    )
+    return [Key.of(m) for m in found]
+
+
+# Shorter than most lines, so they are cut into a few windows
+WINDOW = 16
+
+# Alternative engines, by name
+ENGINES: Dict[str, Engine] = {
+    "files": files,
+    "pickled": pickled,
+    "windowed": windowed,
+}
+
+
+class Counterexample(NamedTuple):
+    lines: List[str]
+    expected: List[Key]
+    actual: List[Key]
+
+    def __str__(self):
+        out = ["Lines:"]
+        out += [f"  {i:3}: {l!r}" for i, l in enumerate(self.lines, start=1)]
+        for title, keys in (
+            ("Expected", self.expected),
+            ("Actual", self.actual),
+        ):
+            out.append(f"{title}:")
+            out += [f"  {k}" for k in keys] or ["  (none)"]
+        return "\n".join(out)
+
+
+def differs(
+    lines: Sequence[str],
+    candidate: Engine,
+    validators: Sequence[Type[base.Validator]],
+) -> Optional[Counterexample]:
+    expected = reference(lines, validators)
+    try:
+        actual = candidate(lines, validators)
+    except Exception as e:
+        actual = [e]
+    if expected == actual:
+        return None
+    return Counterexample(list(lines), expected, actual)
+
+
+def _shorter(lines: List[str]) -> Iterator[List[str]]:
+    """Return the variants of `lines` one step simpler, largest first."""
+    n = len(lines)
+    size = n // 2
+    while size >= 1:
+        for start in range(0, n, size):
+            yield lines[:start] + lines[start + size :]
+        size //= 2
+    for i, l in enumerate(lines):
+        before, after = lines[:i], lines[i + 1 :]
+        words = l.split(" ")
+        for j in range(len(words)):
+            yield before + [" ".join(words[:j] + words[j + 1 :])] + after
+        for j in range(len(l)):
+            yield before + [l[:j] + l[j + 1 :]] + after
+
+
+def minimise(
+    example: Counterexample,
+    candidate: Engine,
+    validators: Sequence[Type[base.Validator]],
+) -> Counterexample:
+    """Return the smallest counterexample found by removing lines, words
+    and characters from `example` while the engines still differ.
+    """
+    while True:
+        for lines in _shorter(example.lines):
+            smaller = differs(lines, candidate, validators)
+            if smaller is not None:
+                example = smaller
+                break
+        else:
+            return example
+
+
+def fuzz(
+    candidate: Engine,
+    *,
+    iterations: int = 100,
+    lines: int = 8,
+    seed: Optional[int] = None,
+    validators: Optional[Sequence[Type[base.Validator]]] = None,
+) -> Iterator[Counterexample]:
+    """Return a minimised Counterexample for each random file on which
+    `candidate` and the reference engine differ.
+    """
+    rng = random.Random(seed)
+    if validators is None:
+        validators = [v.load() for v in library.library()]
+    for _ in range(iterations):
+        example = differs(generate(rng, lines=lines), candidate, validators)
+        if example is not None:
+            yield minimise(example, candidate, validators)
+
+
+def main(args: Sequence[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.executable)} -m apexlint.fuzz",
+        description="Compare the messages of match.lines and another engine",
+    )
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="files")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--lines", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--stop", action="store_true", help="stop at the first difference"
+    )
+    config = parser.parse_args(args)
+
+    found: List[Counterexample] = []
+    for example in fuzz(
+        ENGINES[config.engine],
+        iterations=config.iterations,
+        lines=config.lines,
+        seed=config.seed,
+    ):
+        print(example, end="\n\n")
+        found.append(example)
+        if config.stop:
+            break
+    print(f"{len(found)} counterexamples", file=sys.stderr)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
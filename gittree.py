@@ -0,0 +1,210 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import functools
+import io
+import os
+import pathlib
+import stat
+import threading
+from typing import IO, Iterator, List, NamedTuple, Optional, Sequence
+
+from . import pathtools
+
+# Modes of files, not symbolic links or submodules
+FILE_MODES = ("100644", "100755")
+
+
+class Blob(NamedTuple):
+    """A file in a git tree or the index, usable in place of a
+    pathlib.Path. `rev` is the tree-ish it was listed from, or "" for the
+    index, so it is reported as `rev:name`, as git names it. Its contents
+    are read from `git_dir` by object id.
+    """
+
+    git_dir: str
+    rev: str
+    name: str
+    oid: str
+    size: int
+
+    def __fspath__(self) -> str:
+        return f"{self.rev}:{self.name}"
+
+    def __str__(self) -> str:
+        return self.__fspath__()
+
+    def is_dir(self) -> bool:
+        return False
+
+    def is_file(self) -> bool:
+        return True
+
+    def match(self, pattern: str) -> bool:
+        return pathlib.PurePosixPath(self.name).match(pattern)
+
+    def open(self, mode: str = "r") -> IO:
+        data = read(self.git_dir, self.oid)
+        if "b" in mode:
+            return io.BytesIO(data)
+        return io.StringIO(data.decode("utf-8"), newline=None)
+
+    def resolve(self, *args, **kwargs) -> "Blob":
+        return self
+
+    def stat(self) -> os.stat_result:
+        """Return a read-only file of the size of the blob."""
+        return os.stat_result(
+            (stat.S_IFREG | 0o444, 0, 0, 1, 0, 0, self.size, 0, 0, 0)
+        )
+
+    @classmethod
+    def typeof(cls, instance) -> bool:
+        return isinstance(instance, cls)
+
+
+def _git(*args: str) -> bytes:
+    """Return the output of a git command, raising OSError if it fails."""
+    import subprocess  # Only needed with git
+
+    done = subprocess.run(
+        ["git"] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if done.returncode:
+        error = os.fsdecode(done.stderr).strip().splitlines()
+        raise OSError(
+            f"git {args[0]} failed: {error[-1] if error else done.returncode}"
+        )
+    return done.stdout
+
+
+def blobs(
+    rev: Optional[str], *, pathspecs: Sequence[str] = ()
+) -> Iterator[Blob]:
+    """Return the files of tree-ish `rev`, or those staged in the index if
+    it is None, limited to `pathspecs`, if any. The repository is found
+    from the current directory, and may be bare for a tree-ish. Raise
+    OSError at once if it or `rev` can't be found; files are listed as
+    they are read.
+    """
+    git_dir = os.fsdecode(_git("rev-parse", "--absolute-git-dir").strip())
+    if rev is None:
+        return _staged(git_dir, pathspecs)
+    try:
+        tree = _git("rev-parse", "--verify", "--quiet", f"{rev}^{{tree}}")
+    except OSError:
+        raise OSError(f"{rev}: not a commit or tree") from None
+    return _listed(
+        ["ls-tree", "-r", "-z", "-l", "--full-name", tree.decode().strip()],
+        pathspecs,
+        parse=lambda mode, _, oid, size, name: (
+            Blob(git_dir, rev, name, oid, int(size))
+            if mode in FILE_MODES
+            else None
+        ),
+    )
+
+
+def _staged(git_dir: str, pathspecs: Sequence[str]) -> Iterator[Blob]:
+    """Return the files in the index, which are only listed with their
+    sizes once it has been read.
+    """
+    staged: List[Blob] = list(
+        _listed(
+            ["ls-files", "-s", "-z", "--full-name"],
+            pathspecs,
+            # Files with conflicts are in stages 1 to 3
+            parse=lambda mode, oid, stage, name: (
+                Blob(git_dir, "", name, oid, 0)
+                if mode in FILE_MODES and stage == "0"
+                else None
+            ),
+        )
+    )
+    import subprocess  # Only needed with git
+
+    checked = subprocess.run(
+        ["git", f"--git-dir={git_dir}", "cat-file", "--batch-check"],
+        input=b"".join(f"{b.oid}\n".encode() for b in staged),
+        stdout=subprocess.PIPE,
+    ).stdout.splitlines()
+    for blob, line in zip(staged, checked):
+        fields = line.split()
+        size = int(fields[2]) if len(fields) == 3 else 0
+        yield blob._replace(size=size)
+
+
+def _listed(args, pathspecs, *, parse) -> Iterator[Blob]:
+    """Return the Blob that `parse` makes of each record git lists, as
+    the fields before a tab, then the name.
+    """
+    import subprocess  # Only needed with git
+
+    with subprocess.Popen(
+        ["git"] + args + ["--"] + list(pathspecs),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as process:
+        assert process.stdout is not None
+        for record in pathtools.names(process.stdout, separator=b"\0"):
+            fields, _, name = record.partition("\t")
+            blob = parse(*fields.split(), name)
+            if blob is not None:
+                yield blob
+        error = process.stderr.read() if process.stderr else b""
+    if process.returncode:
+        raise OSError(f"git {args[0]} failed: {os.fsdecode(error).strip()}")
+
+
+class _Batch:
+    """A `git cat-file --batch` process, reading objects by id."""
+
+    def __init__(self, git_dir: str) -> None:
+        import subprocess  # Only needed with git
+
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(
+            ["git", f"--git-dir={git_dir}", "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def read(self, oid: str) -> bytes:
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin is not None and stdout is not None
+        with self.lock:
+            stdin.write(f"{oid}\n".encode())
+            stdin.flush()
+            header = stdout.readline().split()
+            if len(header) != 3:
+                reason = b" ".join(header[1:]).decode() or "git exited"
+                raise OSError(f"Can't read {oid}: {reason}")
+            data = stdout.read(int(header[2]))
+            stdout.read(1)  # The newline after the contents
+        return data
+
+
+# Each process starts its own, so forked workers never share its pipes
+@functools.lru_cache(maxsize=4)
+def _batch(git_dir: str, pid: int) -> _Batch:
+    return _Batch(git_dir)
+
+
+def read(git_dir: str, oid: str) -> bytes:
+    """Return the contents of object `oid`, from the single cat-file
+    process of this process.
+    """
+    return _batch(git_dir, os.getpid()).read(oid)
@@ -0,0 +1,374 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import enum
+import re
+from typing import (
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+)
+
+from . import retools
+
+KEYWORDS = frozenset(
+    """
+    abstract break catch class continue do else enum extends false final
+    finally for global if implements instanceof interface new null override
+    private protected public return static super switch testmethod this
+    throw transient true try virtual void webservice when while with
+    without
+    """.split()
+)
+
+# Every character but whitespace is part of a token, so the tokens of a
+# line are found by a single `finditer`
+TOKEN = retools.lazy(
+    re.compile,
+    r"""
+        (?P<comment>//.*)
+    |
+        (?P<block>/\*.*?\*/)
+    |
+        (?P<open>/\*.*)  # A block comment that runs past the line
+    |
+        (?P<string>'(?:[^'\\]|\\.)*(?:'|\\?$))  # Unterminated runs to EOL
+    |
+        (?P<annotation>@\s*[A-Za-z_]\w*)
+    |
+        (?P<number>\d+(?:\.\d+)?[A-Za-z]?)
+    |
+        (?P<word>[A-Za-z_]\w*)
+    |
+        (?P<operator>\S)
+    """,
+    flags=re.VERBOSE,
+)
+
+# A statement ends with the last code token of a line
+TERMINATORS = frozenset((";", "{", "}"))
+
+# The tokens that `Scopes` follows, and what may hide them; the text
+# between them is skipped
+SCOPED = retools.lazy(
+    re.compile,
+    r"""
+        (?P<comment>//.*)
+    |
+        (?P<block>/\*.*?\*/)
+    |
+        (?P<open>/\*.*)
+    |
+        (?P<string>'(?:[^'\\]|\\.)*(?:'|\\?$))
+    |
+        (?P<annotation>@\s*[A-Za-z_]\w*)
+    |
+        (?P<operator>[{};])
+    """,
+    flags=re.VERBOSE,
+)
+
+
+class Kind(enum.Enum):
+    ANNOTATION = "annotation"
+    COMMENT = "comment"
+    IDENTIFIER = "identifier"
+    KEYWORD = "keyword"
+    NUMBER = "number"
+    OPERATOR = "operator"
+    STRING = "string"
+
+
+# The Kind of the other groups of TOKEN, once lexed
+KINDS = {
+    "string": Kind.STRING,
+    "number": Kind.NUMBER,
+    "operator": Kind.OPERATOR,
+}
+
+
+class Token(NamedTuple):
+    """A token on a single line; block comments yield one token per line.
+    `key` is the case-folded text used for matching, so `@ IsTest` is
+    `@istest`.
+    """
+
+    kind: Kind
+    key: str
+    text: str
+    line: int
+    column: int
+
+    @property
+    def end(self) -> int:
+        return self.column + len(self.text)
+
+
+class Lexer:
+    """Tokenize Apex source a line at a time.
+    The only state carried between lines is an open block comment.
+    """
+
+    def __init__(self) -> None:
+        self.comment = False
+
+    def _comment(self, text: str, lineno: int, column: int) -> Token:
+        return Token(Kind.COMMENT, text, text, lineno, column)
+
+    def line(self, line: str, lineno: int) -> List[Token]:
+        """Return the tokens of `line`, the `lineno`th line of the source."""
+        tokens = []
+        pos = 0
+
+        if self.comment:
+            end = line.find("*/")
+            if end < 0:
+                if line:
+                    tokens.append(self._comment(line, lineno, 0))
+                return tokens
+            pos = end + 2
+            self.comment = False
+            tokens.append(self._comment(line[:pos], lineno, 0))
+
+        append = tokens.append
+        for m in TOKEN.finditer(line, pos):
+            kind, text = m.lastgroup, m.group()
+            if kind == "word":
+                key = text.lower()
+                append(
+                    Token(
+                        Kind.KEYWORD if key in KEYWORDS else Kind.IDENTIFIER,
+                        key,
+                        text,
+                        lineno,
+                        m.start(),
+                    )
+                )
+            elif kind == "annotation":
+                key = "@" + text[1:].lstrip().lower()
+                append(Token(Kind.ANNOTATION, key, text, lineno, m.start()))
+            elif kind in ("comment", "block", "open"):
+                self.comment = kind == "open"
+                append(self._comment(text, lineno, m.start()))
+            else:
+                key = text.lower()
+                append(Token(KINDS[kind], key, text, lineno, m.start()))
+
+        return tokens
+
+    def scoped(self, line: str, lineno: int) -> List[Token]:
+        """Return the annotations, braces and semicolons of `line`, the
+        tokens that `Scopes` follows, and skip the rest.
+        """
+        tokens = []
+        pos = 0
+
+        if self.comment:
+            pos = line.find("*/") + 2
+            if pos < 2:
+                return tokens
+            self.comment = False
+
+        for m in SCOPED.finditer(line, pos):
+            kind, text = m.lastgroup, m.group()
+            if kind == "operator":
+                tokens.append(
+                    Token(Kind.OPERATOR, text, text, lineno, m.start())
+                )
+            elif kind == "annotation":
+                key = "@" + text[1:].lstrip().lower()
+                tokens.append(
+                    Token(Kind.ANNOTATION, key, text, lineno, m.start())
+                )
+            elif kind == "open":
+                self.comment = True
+
+        return tokens
+
+
+def tokenize(lines: Iterable[str], *, start: int = 1) -> Iterator[Token]:
+    """Return a Token iterator for `lines`, in a single pass."""
+    lexer = Lexer()
+    for lineno, line in enumerate(lines, start=start):
+        yield from lexer.line(line, lineno)
+
+
+def screened(
+    lines: Iterable[str],
+    *,
+    wanted: Optional[Pattern],
+    scoped: bool = True,
+    start: int = 1,
+) -> Iterator[Token]:
+    """Return the code tokens of `lines`, as `code(tokenize(lines))` does,
+    but only for the lines that `wanted`, if not None, finds a match in,
+    and the rest of the statements they start, up to the parenthesis that
+    closes any opened in them. Other lines return only the tokens that
+    `Scopes` follows, see `Lexer.scoped`, or none unless `scoped`.
+    """
+    lexer = Lexer()
+    statement = False
+    depth = 0
+    for lineno, line in enumerate(lines, start=start):
+        if wanted is None or statement or wanted.search(line) is not None:
+            found = code(lexer.line(line, lineno))
+            for t in found:
+                if t.key == "(":
+                    depth += 1
+                elif t.key == ")" and depth:
+                    depth -= 1
+            if found:
+                # Checks read ahead to the end of their statement
+                statement = found[-1].key not in TERMINATORS
+            statement = statement or depth > 0
+            yield from found
+        elif scoped:
+            yield from lexer.scoped(line, lineno)
+        elif lexer.comment or "/*" in line:
+            # Only to know if the next line starts in a comment
+            lexer.scoped(line, lineno)
+
+
+def code(tokens: Iterable[Token]) -> List[Token]:
+    """Return `tokens` without comments."""
+    return [t for t in tokens if t.kind is not Kind.COMMENT]
+
+
+def join(tokens: Iterable[Token]) -> str:
+    """Return the case-folded text of `tokens`, ignoring whitespace."""
+    return "".join(t.key for t in tokens)
+
+
+# Tokens that may appear inside a type argument list
+GENERIC = frozenset((".", ",", "<", ">", "[", "]"))
+
+
+def type_arguments(
+    tokens: Sequence[Token], i: int
+) -> Optional[List[Sequence[Token]]]:
+    """Return the type arguments of the generic opened by `tokens[i]`.
+    Each argument is a slice of `tokens`, nested generics included.
+    Return None unless `tokens[i]` opens a well-formed generic.
+    """
+    if i >= len(tokens) or tokens[i].key != "<":
+        return None
+
+    args = []
+    depth = 0
+    first = i + 1
+    for j in range(i, len(tokens)):
+        t = tokens[j]
+        if t.kind is Kind.OPERATOR and t.key not in GENERIC:
+            return None
+        if t.kind in (Kind.ANNOTATION, Kind.NUMBER, Kind.STRING):
+            return None
+        if t.key == "<":
+            depth += 1
+        elif t.key == ">":
+            depth -= 1
+            if depth == 0:
+                args.append(tokens[first:j])
+                return args if all(args) else None
+        elif t.key == "," and depth == 1:
+            args.append(tokens[first:j])
+            first = j + 1
+    return None
+
+
+class Scope(NamedTuple):
+    """Where a token is: its brace `depth`, the annotations of the
+    declarations `enclosing` it, and the `pending` annotations of the
+    declaration it is part of, all case-folded. `test_file` is whether
+    the whole file is known to be a test class.
+    """
+
+    depth: int
+    enclosing: FrozenSet[str]
+    pending: Tuple[str, ...]
+    test_file: bool = False
+
+    @property
+    def annotations(self) -> FrozenSet[str]:
+        return self.enclosing.union(self.pending)
+
+    @property
+    def test(self) -> bool:
+        """Return whether the token is in test code."""
+        return (
+            self.test_file
+            or "@istest" in self.enclosing
+            or "@istest" in self.pending
+        )
+
+
+class Scopes:
+    """The Scope of each token of a file in turn, tracked as the tokens
+    are read, so every validator can share one pass.
+    """
+
+    def __init__(
+        self,
+        stack: Sequence[FrozenSet[str]] = (frozenset(),),
+        pending: Sequence[str] = (),
+        test_file: bool = False,
+    ) -> None:
+        # The annotations in scope at each open brace, outermost first
+        self.stack: List[FrozenSet[str]] = list(stack)
+        self.pending: List[str] = list(pending)
+        self.test_file = test_file
+        self._scope: Optional[Scope] = None
+
+    def state(
+        self,
+    ) -> Tuple[Tuple[FrozenSet[str], ...], Tuple[str, ...], bool]:
+        """Return the arguments to resume tracking from here."""
+        return tuple(self.stack), tuple(self.pending), self.test_file
+
+    @property
+    def scope(self) -> Scope:
+        """Return the Scope of the next token."""
+        if self._scope is None:
+            self._scope = Scope(
+                depth=len(self.stack) - 1,
+                enclosing=self.stack[-1],
+                pending=tuple(self.pending),
+                test_file=self.test_file,
+            )
+        return self._scope
+
+    def advance(self, token: Token) -> None:
+        """Move past `token`, a code token."""
+        if token.kind is Kind.ANNOTATION:
+            self.pending.append(token.key)
+        elif token.key == "{":
+            self.stack.append(self.stack[-1].union(self.pending))
+            self.pending = []
+        elif token.key == "}":
+            # Unbalanced braces stay at the top level
+            if len(self.stack) > 1:
+                self.stack.pop()
+            self.pending = []
+        elif token.key == ";":
+            self.pending = []
+        else:
+            return
+        self._scope = None
@@ -0,0 +1,179 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import itertools
+import pathlib
+from typing import IO, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from . import lexer, pathtools
+
+# Comments near the top of a file that mark it as generated: only tags
+# that generators add, not phrases that license banners also use
+MARKERS = ("@generated",)
+HEADER_LINES = 10
+
+# Overlong lines are validated in windows of at most the line length cap,
+# each overlapping the last by at least this many characters, or by half
+# the cap
+OVERLAP = 1024
+
+
+class Skip(NamedTuple):
+    path: pathlib.Path
+    reason: str
+
+    def __str__(self):
+        return f"{self.path}: {self.reason}"
+
+
+class Window(str):
+    """Part of an overlong line, from `column` of the line. Errors whose
+    match starts in its first `owned` characters are its own, and the
+    others are those of the next window, which starts there, between two
+    tokens, and overlaps it. The last window of the line has no `owned`,
+    and owns all of its errors.
+    """
+
+    column: int
+    owned: Optional[int]
+
+    def __new__(
+        cls, text: str, column: int = 0, owned: Optional[int] = None
+    ) -> "Window":
+        self = super().__new__(cls, text)  # type: ignore
+        self.column = column
+        self.owned = owned
+        return self
+
+
+class Counted:
+    """Iterate over `rows`, as read by `Limits.lines`, counting the lines
+    among them in `count`.
+    """
+
+    def __init__(self, rows: Iterable[str]) -> None:
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self) -> Iterator[str]:
+        for row in self.rows:
+            if not getattr(row, "column", 0):
+                self.count += 1
+            yield row
+
+
+def cut(window: str, end: int) -> int:
+    """Return where to start the window after `window`, at or before
+    `end`, and past half of it: the last place that isn't inside a word or
+    number, or `end` if there is none.
+    """
+    for i in range(end, end // 2, -1):
+        if not (_word(window[i - 1]) and _word(window[i])):
+            return i
+    return end
+
+
+def _word(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+class Limits(NamedTuple):
+    """Which files are worth validating, and how much of each line to
+    validate at once. A cap of 0 or None is no cap, and there are none
+    unless they are set.
+    """
+
+    max_bytes: Optional[int] = None
+    max_line: Optional[int] = None
+    generated: Tuple[str, ...] = ()
+    markers: Tuple[str, ...] = ()
+
+    def skip(self, path: pathlib.Path) -> Optional[str]:
+        """Return why `path` shouldn't be read, if its name or size say."""
+        if pathtools.StdIn.typeof(path):
+            return None
+        for pattern in self.generated:
+            if path.match(pattern):
+                return f"generated, matches {pattern}"
+        if self.max_bytes:
+            try:
+                size = path.stat().st_size
+            except OSError:
+                # Reported when it's validated
+                return None
+            if size > self.max_bytes:
+                return f"larger than {self.max_bytes} bytes"
+        return None
+
+    def marker(self, header: Iterable[str]) -> Optional[str]:
+        """Return the generated-code marker in the comments of `header`."""
+        for token in lexer.tokenize(header):
+            if token.kind is not lexer.Kind.COMMENT:
+                continue
+            comment = token.text.lower()
+            for marker in self.markers:
+                if marker.lower() in comment:
+                    return marker
+        return None
+
+    def read(
+        self, stream: IO[str], *, path: pathlib.Path
+    ) -> Tuple[Iterator[str], Optional[str]]:
+        """Return the lines of `stream`, as `lines` does, and why `path`
+        shouldn't be validated, if its header comments mark it as
+        generated; only the header has been read then.
+        """
+        rows: Iterator[str] = self.lines(stream)
+        if not self.markers or pathtools.StdIn.typeof(path):
+            return rows, None
+        header = list(itertools.islice(rows, HEADER_LINES))
+        marker = self.marker(header)
+        if marker is not None:
+            return iter(()), f"generated, marked {marker!r}"
+        return itertools.chain(header, rows), None
+
+    def lines(self, stream: IO[str]) -> Iterator[str]:
+        """Return the lines of `stream`. Lines longer than `max_line` are
+        read in chunks, and returned as overlapping Windows of at most
+        `max_line` characters, so no line is read whole.
+        """
+        if not self.max_line:
+            yield from stream
+            return
+
+        overlap = min(OVERLAP, self.max_line // 2)
+        while True:
+            line = stream.readline(self.max_line)
+            if not line:
+                return
+            if line.endswith("\n") or len(line) < self.max_line:
+                yield line
+                continue
+
+            window, column = line, 0
+            while True:
+                owned = cut(window, len(window) - overlap)
+                more = stream.readline(self.max_line - len(window) + owned)
+                if not more or more == "\n":
+                    window += more
+                    yield Window(window, column) if column else window
+                    break
+                yield Window(window, column, owned=owned)
+                column += owned
+                window = window[owned:] + more
+                if window.endswith("\n"):
+                    yield Window(window, column)
+                    break
@@ -0,0 +1,476 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import argparse
+import json
+import logging
+import os
+import pathlib
+import queue
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from . import PROGNAME, base, classindex, lexer, match, rules, validators
+
+log = logging.getLogger(__name__)
+
+EOL = re.compile(r"\r\n|\r|\n")
+
+# Diagnostics and the server are named for the linter, not the command
+NAME = "apexlint"
+
+# LSP error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+
+class ParseError(ValueError):
+    """A message that isn't JSON, read in its place."""
+
+
+class Diagnostic(NamedTuple):
+    """A Message without its line, which a Document keeps per line."""
+
+    column: int
+    len: int
+    message: str
+    validator: str
+
+    @classmethod
+    def of(cls, message: base.Message) -> "Diagnostic":
+        return cls(
+            column=message.location.column,
+            len=message.location.len,
+            message=message.message,
+            validator=message.validator,
+        )
+
+
+def utf16(line: str, column: int) -> int:
+    """Return the LSP character offset of `column` in `line`."""
+    return len(line[:column].encode("utf-16-le")) // 2
+
+
+def column(line: str, character: int) -> int:
+    """Return the column in `line` of the LSP character offset."""
+    units = 0
+    for i, c in enumerate(line):
+        if units >= character:
+            return i
+        units += 2 if ord(c) > 0xFFFF else 1
+    return len(line)
+
+
+def path(uri: str) -> pathlib.Path:
+    """Return the path of a document, to select validators by filename."""
+    parsed = urllib.parse.urlparse(uri)
+    return pathlib.Path(urllib.parse.unquote(parsed.path) or uri)
+
+
+class Document:
+    """An open document, and the diagnostics of each of its lines.
+    Edits mark lines dirty; `relint` validates the dirty lines again,
+    widened to whole statements and comments.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        text: str,
+        *,
+        validators: Sequence[Type[base.Validator]],
+        version: int = 0,
+    ) -> None:
+        self.uri = uri
+        self.version = version
+        self.validators = base.Validator.filter(validators, path=path(uri))
+        self.lines = EOL.split(text)
+        self.diagnostics: List[List[Diagnostic]] = [[] for _ in self.lines]
+        # Whether each line, and the end, starts inside a block comment
+        self.comments: List[Optional[bool]] = [None] * (len(self.lines) + 1)
+        self.comments[0] = False
+        # The `lexer.Scopes` state at the start of each line, and the end
+        self.scopes: List[Optional[Tuple]] = [None] * (len(self.lines) + 1)
+        self.scopes[0] = lexer.Scopes(
+            test_file=classindex.is_test(path(uri))
+        ).state()
+        self.dirty: Optional[Tuple[int, int]] = (0, len(self.lines))
+
+    def edit(self, change: Dict[str, Any]) -> None:
+        """Apply a TextDocumentContentChangeEvent."""
+        if "range" not in change:
+            self.__init__(  # type: ignore
+                self.uri,
+                change["text"],
+                validators=self.validators,
+                version=self.version,
+            )
+            return
+
+        start, end = change["range"]["start"], change["range"]["end"]
+        s, e = start["line"], end["line"]
+        if s >= len(self.lines):
+            s = e = len(self.lines) - 1
+            start = end = {"line": s, "character": len(self.lines[s])}
+        e = min(e, len(self.lines) - 1)
+        prefix = self.lines[s][: column(self.lines[s], start["character"])]
+        suffix = self.lines[e][column(self.lines[e], end["character"]) :]
+        new = EOL.split(prefix + change["text"] + suffix)
+
+        self.lines[s : e + 1] = new
+        self.diagnostics[s : e + 1] = [[] for _ in new]
+        self.comments[s + 1 : e + 1] = [None] * (len(new) - 1)
+        self.scopes[s + 1 : e + 1] = [None] * (len(new) - 1)
+
+        # Shift the lines still dirty from earlier edits, and add these
+        delta = len(new) - (e - s + 1)
+        a, b = self.dirty or (s, s)
+        a = a + delta if a > e else min(a, s)
+        b = b + delta if b > e else min(b, s)
+        self.dirty = (min(a, s), max(b, s + len(new)))
+
+    def _terminates(self, i: int) -> bool:
+        """Return whether line `i` ends a statement."""
+        scanner = lexer.Lexer()
+        scanner.comment = bool(self.comments[i])
+        code = lexer.code(scanner.line(self.lines[i], i + 1))
+        return bool(code) and code[-1].key in lexer.TERMINATORS
+
+    def relint(self) -> bool:
+        """Validate the dirty lines again; return whether any were."""
+        if self.dirty is None:
+            return False
+        a, b = self.dirty
+        self.dirty = None
+        n = len(self.lines)
+
+        if any("apexlint:" in line.lower() for line in self.lines):
+            # Block directives apply to the rest of the file
+            a, b = 0, n
+        # Widen to whole statements, which don't start in a comment
+        while a > 0 and (self.comments[a] or not self._terminates(a - 1)):
+            a -= 1
+        while b < n and not self._terminates(b - 1):
+            b += 1
+
+        while True:
+            scanner = lexer.Lexer()
+            scanner.comment = bool(self.comments[a])
+            scopes = lexer.Scopes(*self.scopes[a])
+            comments, states = [], []
+            for i in range(a, b):
+                comments.append(scanner.comment)
+                states.append(scopes.state())
+                for t in lexer.code(scanner.line(self.lines[i], i + 1)):
+                    scopes.advance(t)
+            if b == n or (
+                scanner.comment == self.comments[b]
+                and scopes.state() == self.scopes[b]
+            ):
+                break
+            # A comment or brace opened or closed: the rest of the file
+            # changed
+            b = n
+        self.comments[a:b] = comments
+        self.comments[b] = scanner.comment
+        self.scopes[a:b] = states
+        self.scopes[b] = scopes.state()
+
+        found: List[List[Diagnostic]] = [[] for _ in range(a, b)]
+        for message in match.lines(
+            self.lines[a:b],
+            path=path(self.uri),
+            scopes=lexer.Scopes(*self.scopes[a]),
+            validators=self.validators,
+        ):
+            found[message.location.line - 1].append(Diagnostic.of(message))
+        self.diagnostics[a:b] = found
+        log.debug(f"Validated lines {a + 1}-{b} of {self.uri}")
+        return True
+
+    def publish(self) -> Dict[str, Any]:
+        """Return the params of a publishDiagnostics notification."""
+        diagnostics = []
+        for i, line in enumerate(self.lines):
+            for d in self.diagnostics[i]:
+                summary = d.message.split("\n", 1)[0]
+                diagnostics.append(
+                    {
+                        "range": {
+                            "start": {
+                                "line": i,
+                                "character": utf16(line, d.column),
+                            },
+                            "end": {
+                                "line": i,
+                                "character": utf16(
+                                    line, d.column + max(d.len, 1)
+                                ),
+                            },
+                        },
+                        "severity": 1,
+                        "source": NAME,
+                        "code": d.validator,
+                        "message": summary,
+                    }
+                )
+        return {
+            "uri": self.uri,
+            "version": self.version,
+            "diagnostics": diagnostics,
+        }
+
+
+def read(stream: IO[bytes]) -> Iterator[Any]:
+    """Return the JSON-RPC messages framed in `stream`, or a ParseError for
+    each that isn't JSON, so the next is read after it.
+    """
+    while True:
+        length = None
+        while True:
+            header = stream.readline()
+            if not header:
+                return
+            header = header.strip()
+            if not header:
+                break
+            name, _, value = header.decode("ascii").partition(":")
+            if name.strip().lower() == "content-length":
+                try:
+                    length = int(value)
+                except ValueError:
+                    pass
+        if length is None:
+            log.warning(f"{PROGNAME}: message without Content-Length")
+            continue
+        try:
+            yield json.loads(stream.read(length).decode("utf-8"))
+        except ValueError as e:
+            log.error(f"{PROGNAME}: can't parse message: {e}")
+            yield ParseError(str(e))
+
+
+def is_exit(message: Any) -> bool:
+    return isinstance(message, dict) and message.get("method") == "exit"
+
+
+def write(stream: IO[bytes], message: Dict[str, Any]) -> None:
+    body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    stream.write(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii"))
+    stream.write(body)
+    stream.flush()
+
+
+class Server:
+    """Validate open documents, `delay` seconds after a burst of edits."""
+
+    def __init__(
+        self,
+        output: IO[bytes],
+        *,
+        delay: float = 0.2,
+        validators: Sequence[Type[base.Validator]],
+    ) -> None:
+        self.output = output
+        self.delay = delay
+        self.validators = validators
+        self.documents: Dict[str, Document] = {}
+        # When each edited document is due to be validated
+        self.pending: Dict[str, float] = {}
+        self.shutdown = False
+
+    def run(self, messages: "queue.Queue[Any]") -> int:
+        """Handle `messages` until exit, or None; return the exit status."""
+        while True:
+            # Documents due are published before later messages are read
+            self.flush()
+            timeout = None
+            if self.pending:
+                timeout = max(min(self.pending.values()) - time.monotonic(), 0)
+            try:
+                message = messages.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if message is None or is_exit(message):
+                return 0 if self.shutdown else 1
+            self.handle(message)
+
+    def flush(self, *, now: Optional[float] = None) -> None:
+        """Validate and publish the documents that are due."""
+        now = time.monotonic() if now is None else now
+        for uri, due in list(self.pending.items()):
+            if due > now:
+                continue
+            del self.pending[uri]
+            document = self.documents.get(uri)
+            try:
+                if document is not None and document.relint():
+                    self.publish(document.publish())
+            except Exception as e:
+                log.exception(f"{PROGNAME}: {uri}: {e}")
+
+    def handle(self, message: Any) -> None:
+        """Reply to `message`, if it is a request, with its result or an
+        error; errors in notifications are only logged.
+        """
+        if isinstance(message, ParseError):
+            self.error(None, PARSE_ERROR, str(message))
+            return
+        if not isinstance(message, dict):
+            self.error(None, INVALID_REQUEST, "not an object")
+            return
+        method = message.get("method")
+        params = message.get("params") or {}
+        handler = getattr(self, "on_" + str(method).replace("/", "_"), None)
+        if handler is None:
+            if "id" in message:
+                self.error(message["id"], METHOD_NOT_FOUND, f"{method}")
+            return
+        try:
+            result = handler(params)
+        except (KeyError, TypeError, ValueError) as e:
+            log.error(f"{PROGNAME}: {method}: {e}")
+            if "id" in message:
+                self.error(message["id"], INVALID_REQUEST, str(e))
+            return
+        except Exception as e:
+            # A bug validating one document shouldn't stop the server
+            log.exception(f"{PROGNAME}: {method}: {e}")
+            if "id" in message:
+                self.error(message["id"], INTERNAL_ERROR, repr(e))
+            return
+        if "id" in message:
+            self.send({"id": message["id"], "result": result})
+
+    def send(self, message: Dict[str, Any]) -> None:
+        write(self.output, dict(message, jsonrpc="2.0"))
+
+    def publish(self, params: Dict[str, Any]) -> None:
+        self.send(
+            {"method": "textDocument/publishDiagnostics", "params": params}
+        )
+
+    def error(self, id: Any, code: int, message: str) -> None:
+        self.send({"id": id, "error": {"code": code, "message": message}})
+
+    def on_initialize(self, params):
+        return {
+            "capabilities": {
+                # Incremental
+                "textDocumentSync": {"openClose": True, "change": 2}
+            },
+            "serverInfo": {"name": NAME},
+        }
+
+    def on_initialized(self, params):
+        pass
+
+    def on_shutdown(self, params):
+        self.shutdown = True
+
+    def on_textDocument_didOpen(self, params):
+        item = params["textDocument"]
+        document = Document(
+            item["uri"],
+            item["text"],
+            validators=self.validators,
+            version=item.get("version", 0),
+        )
+        self.documents[document.uri] = document
+        document.relint()
+        self.publish(document.publish())
+
+    def on_textDocument_didChange(self, params):
+        document = self.documents[params["textDocument"]["uri"]]
+        document.version = params["textDocument"].get("version", 0)
+        for change in params["contentChanges"]:
+            document.edit(change)
+        self.pending[document.uri] = time.monotonic() + self.delay
+
+    def on_textDocument_didClose(self, params):
+        uri = params["textDocument"]["uri"]
+        self.documents.pop(uri, None)
+        self.pending.pop(uri, None)
+        self.publish({"uri": uri, "diagnostics": []})
+
+
+def main(args: Sequence[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.executable)} -m apexlint.lsp",
+        description="Serve the Language Server Protocol over stdio",
+    )
+    parser.add_argument(
+        "--delay",
+        default=0.2,
+        type=float,
+        help="seconds to wait after an edit (default: %(default)s)",
+    )
+    parser.add_argument("--ignore", action="append", default=[])
+    parser.add_argument("--select", action="append", default=[])
+    parser.add_argument("--rules", type=pathlib.Path)
+    parser.add_argument("--debug", action="store_true")
+    config = parser.parse_args(args)
+    try:
+        found = rules.load(config.rules) if config.rules else ()
+        enabled = validators.library(
+            select=frozenset(config.select),
+            ignore=frozenset(config.ignore),
+            rules=found,
+        )
+    except rules.RuleError as e:
+        parser.error(f"argument --rules: {e}")
+
+    logging.basicConfig(
+        level=logging.DEBUG if config.debug else logging.INFO,
+        handlers=(logging.StreamHandler(sys.stderr),),
+    )
+
+    # Messages are read while documents are validated, so edits that
+    # arrive during validation are debounced together
+    messages: "queue.Queue[Any]" = queue.Queue()
+
+    def reader():
+        for message in read(sys.stdin.buffer):
+            messages.put(message)
+            # Stop reading, so the interpreter can exit
+            if is_exit(message):
+                return
+        messages.put(None)
+
+    threading.Thread(target=reader).start()
+    server = Server(sys.stdout.buffer, delay=config.delay, validators=enabled)
+    return server.run(messages)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
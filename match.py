@@ -14,90 +14,627 @@
 # implied. See the License for the specific language governing
 # permissions and limitations under the License.
 #
+import collections
 import contextlib
 import logging
 import os
 import pathlib
-import re
-from typing import Iterable, Iterator, Optional, Sequence, Type, Union
+import time
+from typing import (
+    IO,
+    Counter,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
-from . import PROGNAME, base, pathtools, retools, terminfo
+from . import (
+    PROGNAME,
+    archives,
+    base,
+    classindex,
+    gittree,
+    lexer,
+    pathtools,
+    sfdx,
+    suppression,
+    terminfo,
+    tracing,
+)
+from .baseline import Baseline
+from .cache import Cache, Found
+from .limits import Counted, Limits, Skip, Window
+from .metrics import Metrics
+from .results import Results
 
 log = logging.getLogger(__name__)
 
-NOQA = retools.comment(re.compile("noqa", flags=re.IGNORECASE))
-
 
 def files(
     paths: Iterable[pathlib.Path],
     *,
+    baseline: Optional[Baseline] = None,
+    cache: Optional[Cache] = None,
+    dedup: bool = False,
+    hooks: Optional[tracing.Hooks] = None,
+    index: Optional[classindex.Index] = None,
+    limits: Optional[Limits] = None,
+    project: Optional[sfdx.Project] = None,
     suppress: bool = True,
     validators: Sequence[Type[base.Validator]],
-) -> Iterator[Union[Exception, base.Message]]:
-    """Return a Message iterator, as returned by `validators` for `paths`."""
+) -> Iterator[Union[Exception, Skip, base.Message]]:
+    """Return a Message iterator, as returned by `validators` for `paths`.
+    Files that the `limits`, if any, say are generated or too big return a
+    Skip instead, and are read no further than their header; overlong
+    lines are validated in windows. The progress of each file is reported
+    to `hooks`, if any. With `dedup`, files with the same contents as one
+    already validated by this process, or kept in the `cache` by an
+    earlier run, reuse its messages, and are only read for their header
+    and digest.
+    """
     for path in paths:
         filename = os.fspath(path)
         log.debug(f"Validating: {filename}")
 
-        enabled = base.Validator.filter(validators, path=path)
+        enabled = base.Validator.filter(
+            validators, path=path, index=index, project=project
+        )
         if not enabled:
             continue
 
+        reason = None if limits is None else limits.skip(path)
+        if reason is not None:
+            log.debug(f"Skipping {filename}: {reason}")
+            yield Skip(path, reason)
+            continue
+
         with contextlib.ExitStack() as stack:
+            key = kept = sized = None
             try:
                 f = path.open(mode="r")
                 if not pathtools.StdIn.typeof(path):
                     stack.enter_context(f)
+
+                # Generated files are skipped by their header alone
+                stream: Iterable[str] = f
+                if limits is not None:
+                    stream, reason = limits.read(f, path=path)
+
+                if reason is None and dedup and not pathtools.StdIn.typeof(
+                    path
+                ):
+                    # The validators enabled, like the limits, may differ
+                    # between runs, and their scope depends on whether the
+                    # file is a test
+                    options = (
+                        limits,
+                        suppress,
+                        classindex.is_test(path, index=index),
+                    )
+                    key, sized = contents.key(
+                        path,
+                        (tuple(enabled),) + options,
+                        always=cache is not None,
+                    )
+                    found = None if key is None else contents.get(key)
+                    if found is None and cache is not None:
+                        kept = cache.key(key[0], enabled, *options)
+                        found = cache.get(kept, path=path)
+                        if found is not None:
+                            contents.put(key, found)
+                    if found is not None:
+                        log.debug(f"Validated the same contents: {filename}")
+                        yield from _reported(
+                            found, baseline=baseline, hooks=hooks, path=path
+                        )
+                        continue
             except IOError as e:
                 log.error(f"{PROGNAME}: {e}")
+                if hooks is not None:
+                    hooks.on_error(path, e)
                 yield e
                 continue
 
-            yield from lines(
-                f, path=path, suppress=suppress, validators=enabled
+            if reason is not None:
+                found = ([], 0, _size(f, path), reason)
+            elif sized is None and hooks is None:
+                yield from lines(
+                    stream,
+                    baseline=baseline,
+                    path=path,
+                    index=index,
+                    suppress=suppress,
+                    validators=enabled,
+                )
+                continue
+            else:
+                # The baseline applies to each path with the same contents
+                read = Counted(stream)
+                kwargs = dict(
+                    baseline=None if sized is not None else baseline,
+                    index=index,
+                    path=path,
+                    suppress=suppress,
+                    validators=enabled,
+                )
+                if hooks is None:
+                    messages = list(lines(read, **kwargs))
+                else:
+                    hooks.on_file_start(path)
+                    messages = list(_traced(read, hooks=hooks, **kwargs))
+                found = (messages, read.count, _size(f, path), None)
+            if key is not None:
+                contents.put(key, found)
+            elif sized is not None:
+                contents.put_sized(sized, path, found)
+            if kept is not None:
+                cache.put(kept, found)
+            yield from _reported(
+                found,
+                baseline=None if sized is None else baseline,
+                hooks=hooks,
+                path=path,
+                started=True,
             )
 
 
+def _traced(
+    read: Iterable[str],
+    *,
+    hooks: tracing.Hooks,
+    path: pathlib.Path,
+    validators: Sequence[Type[base.Validator]],
+    **kwargs,
+) -> Iterator[base.Message]:
+    """Return the messages of `lines`, timing each validator separately
+    if `hooks` wants to know.
+    """
+    if not hooks.wants("on_validator_time"):
+        yield from lines(read, path=path, validators=validators, **kwargs)
+        return
+
+    # Each validator is timed on its own pass over the lines
+    read = list(read)
+    found = []
+    for order, v in enumerate(validators):
+        start = time.perf_counter()
+        for message in lines(read, path=path, validators=(v,), **kwargs):
+            found.append((message.location.line, order, message))
+        hooks.on_validator_time(path, v.__name__, time.perf_counter() - start)
+    # Stable, in the order of validating every validator on each line
+    found.sort(key=lambda f: f[:2])
+    for _, _, message in found:
+        yield message
+
+
+class Contents:
+    """The messages of recently validated file contents, by digest, with
+    the paths rewritten on reuse. Contents are only digested once another
+    file of their size is validated, so a file of a size of its own is
+    read once; until then, what was found in it is kept by its size.
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = maxsize
+        self.found: Dict[Tuple, Found] = collections.OrderedDict()
+        self.sized: Dict[
+            Tuple, Tuple[pathlib.Path, Found]
+        ] = collections.OrderedDict()
+        self.digested: Set[Tuple] = set()
+
+    def key(
+        self, path: pathlib.Path, options: Tuple, *, always: bool = False
+    ) -> Tuple[Optional[Tuple], Tuple]:
+        """Return the key of the contents of `path`, validated with
+        `options`, or None if no other file of its size was, unless
+        `always`; and its key by size.
+        """
+        sized = (size(path),) + options
+        if sized[0] is not None and sized not in self.digested:
+            first = self.sized.pop(sized, None)
+            if first is None and not always:
+                return None, sized
+            if first is not None:
+                other, found = first
+                with contextlib.suppress(OSError):
+                    self.put((digest(other),) + options, found)
+            self.digested.add(sized)
+        return (digest(path),) + options, sized
+
+    def put_sized(
+        self, sized: Tuple, path: pathlib.Path, found: Found
+    ) -> None:
+        """Keep what was `found` in `path`, until a file of its size is."""
+        self.sized[sized] = (path, found)
+        if len(self.sized) > self.maxsize:
+            self.sized.popitem(last=False)  # type: ignore
+
+    def get(self, key: Tuple) -> Optional[Found]:
+        found = self.found.get(key)
+        if found is not None:
+            self.found.move_to_end(key)  # type: ignore
+        return found
+
+    def put(self, key: Tuple, found: Found) -> None:
+        self.found[key] = found
+        if len(self.found) > self.maxsize:
+            self.found.popitem(last=False)  # type: ignore
+
+    def clear(self) -> None:
+        self.found.clear()
+        self.sized.clear()
+        self.digested.clear()
+
+
+# Each process, such as a worker, validates its own files
+contents = Contents()
+
+# Files are digested in chunks of this many bytes
+CHUNK = 64 * 1024
+
+
+def duplicates(
+    paths: Sequence[pathlib.Path], *, limits: Optional[Limits] = None
+) -> List[List[int]]:
+    """Return the positions of `paths` in groups with the same contents, in
+    the order of the first of each group, so each group can be validated
+    by one process. Only files of the same size as another are digested,
+    and not if the `limits` skip them, by their name, size or header.
+    """
+    sizes = [size(p) for p in paths]
+    seen = collections.Counter(sizes)
+    groups: Dict[object, List[int]] = {}
+    for i, (path, n) in enumerate(zip(paths, sizes)):
+        key: object = i
+        if gittree.Blob.typeof(path) or n is not None and seen[n] > 1:
+            try:
+                if not _skipped(path, limits=limits):
+                    key = digest(path)
+            except (OSError, ValueError):
+                pass  # Reported when it's validated
+        groups.setdefault(key, []).append(i)
+    return list(groups.values())
+
+
+def _skipped(path: pathlib.Path, *, limits: Optional[Limits]) -> bool:
+    if limits is None:
+        return False
+    if limits.skip(path) is not None:
+        return True
+    with path.open(mode="r") as f:
+        return limits.read(f, path=path)[1] is not None
+
+
+def size(path: pathlib.Path) -> Optional[int]:
+    """Return the size of `path`, or None for blobs, archive members and
+    files that can't say.
+    """
+    if not isinstance(path, pathlib.Path):
+        return None
+    try:
+        return path.stat().st_size
+    except OSError:
+        return None
+
+
+def digest(path: pathlib.Path) -> str:
+    """Return a digest of the contents of `path`, read in chunks.
+    Blobs are already named by one, and aren't read.
+    """
+    if gittree.Blob.typeof(path):
+        return path.oid
+
+    import hashlib  # Only needed to deduplicate
+
+    found = hashlib.sha1()
+    with path.open(mode="rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            found.update(chunk)
+    return found.hexdigest()
+
+
+def _reported(
+    found: Found,
+    *,
+    baseline: Optional[Baseline],
+    hooks: Optional[tracing.Hooks],
+    path: pathlib.Path,
+    started: bool = False,
+) -> Iterator[Union[Skip, base.Message]]:
+    """Return the messages `found` in a file, at `path`, unless they are
+    in the `baseline`, or why it was skipped. `hooks` are told of the
+    file, unless it was `started` already.
+    """
+    messages, n, size, reason = found
+    if reason is not None:
+        log.debug(f"Skipping {os.fspath(path)}: {reason}")
+        yield Skip(path, reason)
+        return
+
+    if hooks is not None and not started:
+        hooks.on_file_start(path)
+    seen: Counter[str] = collections.Counter()
+    for message in messages:
+        if message.location.path is not path:
+            message = message._replace(
+                location=message.location._replace(path=path)
+            )
+        if baseline is not None and baseline.known(message, seen):
+            continue
+        if hooks is not None:
+            hooks.on_message(message)
+        yield message
+    if hooks is not None:
+        hooks.on_file_end(path, lines=n, bytes=size)
+
+
+def _size(f: IO, path: pathlib.Path) -> int:
+    """Return the bytes read from `f`, now at its end, or the size of
+    `path` if `f` doesn't say.
+    """
+    try:
+        return f.buffer.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    try:
+        return path.stat().st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+# The column, length and `Window.owned` of a window of a line
+Part = Tuple[int, int, Optional[int]]
+
+# A line that isn't cut into windows is validated whole
+WHOLE: Tuple[Part, ...] = ((0, 0, None),)
+
+
 def lines(
     lines: Iterable[str],
     *,
+    baseline: Optional[Baseline] = None,
     path: pathlib.Path,
+    index: Optional[classindex.Index] = None,
+    scopes: Optional[lexer.Scopes] = None,
     suppress: bool = True,
     validators: Sequence[Type[base.Validator]],
 ) -> Iterator[base.Message]:
-    """Return a Message iterator, as returned by `validators` for `lines`."""
+    """Return a Message iterator, as returned by `validators` for `lines`.
+    If `lines` are part of a file, `scopes` tracks their scope from its
+    state at the first line. Lines cut into `limits.Window`s are put back
+    together as they are read, and validated whole by token validators,
+    but a window at a time by regexps, so a string or comment that a
+    window starts inside of may be misread by them.
+    """
 
-    enabled = base.Validator.filter(validators, path=path)
+    enabled = base.Validator.filter(validators, path=path, index=index)
     if not enabled:
         return
 
-    lines = (l.rstrip("\n") for l in lines)
+    # The windows of an overlong line are only kept as their columns and
+    # lengths, and cut from the line again to be validated
+    windows: Dict[int, List[Part]] = {}
+    lines = list(_joined(lines, windows))
+    seen: Counter[str] = collections.Counter()
+    suppressions = suppression.Suppressions.parse(lines) if suppress else None
+    if not suppressions:
+        suppressions = None
+
+    # Token validators see the whole file, so errors may span lines
+    found: Dict[Tuple[Type[base.Validator], int], List[base.Error]] = {}
+    tokenized = [v for v in enabled if issubclass(v, base.TokenValidator)]
+    if tokenized:
+        if scopes is None:
+            scopes = lexer.Scopes(
+                test_file=classindex.is_test(path, index=index)
+            )
+        for v, lineno, error in base.token_errors(
+            lines, scopes=scopes, suppress=suppress, validators=tokenized
+        ):
+            found.setdefault((v, lineno), []).append(error)
+
+    # Regexp validators are matched together first, once per window
+    combined, screened = base.prefilter(tuple(enabled))
+    kinds = [
+        (v, issubclass(v, base.TokenValidator), v in screened)
+        for v in enabled
+    ]
 
     for lineno, line in enumerate(lines, start=1):
-        if suppress and NOQA.search(line):
+        if suppressions is not None and suppressions.all(lineno):
             continue
+        # Each window of the line, and whether the regexps screened by
+        # `combined` have no errors in it
+        cut = []
+        for column, length, owned in windows.get(lineno, WHOLE):
+            window = line[column : column + length] if length else line
+            clean = combined is not None and combined.search(window) is None
+            cut.append((window, column, owned, clean))
 
-        for v in validators:
-            for error in v.errors(line, suppress=suppress):
-                yield base.Message(
-                    location=base.Location(
-                        path=path, line=lineno, match=error.match
-                    ),
+        for v, tokens, combines in kinds:
+            if tokens and (v, lineno) not in found:
+                continue
+            if suppressions is not None and suppressions.suppressed(
+                lineno, v.__name__
+            ):
+                continue
+            if tokens:
+                # Found in the whole line
+                errors = [(e, 0) for e in found[v, lineno]]
+            else:
+                errors = [
+                    (e, column)
+                    for window, column, owned, clean in cut
+                    if not (clean and combines)
+                    for e in v.errors(window, suppress=suppress)
+                    # Or the next window's, which starts there
+                    if owned is None or e.match.start() < owned
+                ]
+            for error, column in errors:
+                location = base.Location.of(
+                    path=path, line=lineno, match=error.match
+                )
+                if column:
+                    location = location._replace(
+                        start=location.start + column,
+                        end=location.end + column,
+                    )
+                message = base.Message(
+                    location=location,
                     message=error.message,
                     source=line,
+                    validator=v.__name__,
                 )
+                if baseline is not None and baseline.known(message, seen):
+                    continue
+                yield message
+
+
+def _joined(
+    rows: Iterable[str], windows: Dict[int, List[Part]]
+) -> Iterator[str]:
+    """Return the lines of `rows`, as read by `Limits.lines`, without their
+    line endings, and add the column, length and `Window.owned` of each
+    window of the overlong ones to `windows`, by line number.
+    """
+    parts: List[str] = []
+    lineno = 0
+    for row in rows:
+        if not isinstance(row, Window):
+            lineno += 1
+            yield row.rstrip("\n")
+            continue
+        if not row.column:
+            lineno += 1
+            windows[lineno] = []
+        windows[lineno].append((row.column, len(row), row.owned))
+        if row.owned is not None:
+            parts.append(row[: row.owned])
+            continue
+        parts.append(row)
+        yield "".join(parts).rstrip("\n")
+        parts = []
+
+
+def directory(
+    path: pathlib.Path, *, project: Optional[sfdx.Project] = None
+) -> str:
+    """Return the sfdx package of `path`, or its top-level directory.
+    Blobs and archive members are named relative to their tree or archive,
+    as files are to the current directory.
+    """
+    package = project.package(path) if project is not None else None
+    if package is not None:
+        return os.path.relpath(package.path)
+    if gittree.Blob.typeof(path) or archives.Member.typeof(path):
+        parts = pathlib.PurePosixPath(path.name).parts
+        return parts[0] if len(parts) > 1 else os.curdir
+    filename = os.fspath(path)
+    if os.path.isabs(filename):
+        filename = os.path.relpath(filename)
+        if filename.startswith(os.pardir + os.sep):
+            return os.path.dirname(os.path.abspath(filename))
+    parts = pathlib.PurePath(filename).parts
+    return parts[0] if len(parts) > 1 else os.curdir
+
+
+def statistics(
+    paths: Iterable[pathlib.Path],
+    *,
+    project: Optional[sfdx.Project] = None,
+    **kwargs,
+) -> Tuple[Counter[Tuple[str, str]], List[Exception], List[Skip]]:
+    """Return how many messages each validator found in each directory,
+    as named by `directory`, the errors reading `paths`, and those skipped.
+    """
+    counts: Counter[Tuple[str, str]] = collections.Counter()
+    errors = []
+    skipped = []
+    for path in paths:
+        parent = directory(path, project=project)
+        for message in files((path,), project=project, **kwargs):
+            if isinstance(message, Exception):
+                errors.append(message)
+            elif isinstance(message, Skip):
+                skipped.append(message)
+            else:
+                counts[message.validator, parent] += 1
+    return counts, errors, skipped
+
+
+def collect(
+    paths: Iterable[pathlib.Path],
+    *,
+    hooks: Optional[tracing.Hooks] = None,
+    metrics: Optional[Metrics] = None,
+    **kwargs,
+) -> Tuple[Results, List[Union[Exception, Skip]]]:
+    """Return the messages of `paths` as Results, which workers send
+    compactly, and the errors and skipped files, timing the match stage
+    in `metrics`, if any.
+    """
+    found: Iterable[Union[Exception, Skip, base.Message]] = files(
+        paths, hooks=tracing.chain(hooks, metrics), **kwargs
+    )
+    if metrics is not None:
+        found = metrics.timed("match", found)
+    collected = Results()
+    others: List[Union[Exception, Skip]] = []
+    for message in found:
+        if isinstance(message, (Exception, Skip)):
+            others.append(message)
+        else:
+            collected.append(message)
+    return collected, others
 
 
 def render(
     paths: Iterable[pathlib.Path],
     *,
+    baseline: Optional[Baseline] = None,
+    cache: Optional[Cache] = None,
+    dedup: bool = False,
+    hooks: Optional[tracing.Hooks] = None,
+    index: Optional[classindex.Index] = None,
+    limits: Optional[Limits] = None,
+    metrics: Optional[Metrics] = None,
+    project: Optional[sfdx.Project] = None,
     suppress: bool = True,
     term: Optional[Type[terminfo.TermInfo]] = None,
     validators: Sequence[Type[base.Validator]],
     verbose: int = 0,
-) -> Iterator[Union[Exception, str]]:
-    for message in files(paths, suppress=suppress, validators=validators):
-        if isinstance(message, Exception):
+) -> Iterator[Union[Exception, Skip, str]]:
+    """Return the rendered messages of `paths`, timing the match and render
+    stages in `metrics`, if any. Errors and skipped files are returned as
+    they are.
+    """
+    found: Iterable[Union[Exception, Skip, base.Message]] = files(
+        paths,
+        baseline=baseline,
+        cache=cache,
+        dedup=dedup,
+        hooks=tracing.chain(hooks, metrics),
+        index=index,
+        limits=limits,
+        project=project,
+        suppress=suppress,
+        validators=validators,
+    )
+    if metrics is not None:
+        found = metrics.timed("match", found)
+    for message in found:
+        if isinstance(message, (Exception, Skip)):
             yield message
-            continue
-        yield message.render(term=term, verbose=verbose)
+        elif metrics is None:
+            yield message.render(term=term, verbose=verbose)
+        else:
+            with metrics.timer("render"):
+                rendered = message.render(term=term, verbose=verbose)
+            yield rendered
@@ -0,0 +1,190 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import collections
+import contextlib
+import os
+import pathlib
+import threading
+import tracemalloc
+from typing import IO, Counter, Dict, Iterator, List, NamedTuple
+
+from . import PROGNAME
+from .metrics import STAGES, Metrics
+
+# Allocation sites reported for each process
+TOP = 10
+
+# Memory in use at the last snapshot of this process, so workers only
+# take another when they use more
+_snapshot_size = 0
+
+# The traced peak is the process's, so stages timed at once in different
+# threads, such as the walk in the pool's task thread and the render,
+# only reset it when no other is running, and only record a stage peak
+# if none started meanwhile
+_lock = threading.Lock()
+_running = 0
+_started = 0
+
+
+class Site(NamedTuple):
+    """Memory in use that was allocated at one line."""
+
+    location: str
+    size: int
+    count: int
+
+
+def _size(size: int) -> str:
+    if abs(size) < 1024 * 1024:
+        return f"{size / 1024:.1f} KiB"
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+
+class MemProfile(Metrics):
+    """Metrics that also trace the memory of the process with tracemalloc,
+    once created: its peak, the memory kept and the peak reached by each
+    stage, and the lines that allocated the most memory in use at its
+    fullest. Workers return theirs to the parent, which keeps them by
+    process.
+    """
+
+    def __init__(self, *, trace: bool = True) -> None:
+        super().__init__()
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.pid = os.getpid()
+        self.peak = 0
+        # Bytes allocated and not freed during each stage
+        self.kept: Counter[str] = collections.Counter()
+        # Highest memory use in each stage, above its use at the start
+        self.peaks: Counter[str] = collections.Counter()
+        # Memory in use at the snapshot of `sites`
+        self.size = 0
+        self.sites: List[Site] = []
+        self.processes: Dict[int, MemProfile] = {}
+
+    def update(self, other: Metrics) -> None:
+        """Add the counts, timings and memory of `other`, such as a
+        worker's. Peaks are the highest of either, and sites are those of
+        the fuller snapshot.
+        """
+        super().update(other)
+        if not isinstance(other, MemProfile):
+            return
+        if other.pid == self.pid:
+            profile = self
+        else:
+            profile = self.processes.get(other.pid)
+            if profile is None:
+                profile = self.processes[other.pid] = MemProfile(trace=False)
+                profile.pid = other.pid
+        profile.peak = max(profile.peak, other.peak)
+        profile.kept.update(other.kept)
+        for stage, peak in other.peaks.items():
+            profile.peaks[stage] = max(profile.peaks[stage], peak)
+        if other.size > profile.size:
+            profile.size, profile.sites = other.size, other.sites
+
+    @contextlib.contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Add the time of the block to `stage`, with the memory it kept,
+        and its peak above the memory in use when it started, if no other
+        block was timed meanwhile; the peak of the process counts them
+        all. Stage peaks need Python 3.9, which can reset the traced peak.
+        """
+        global _running, _started
+
+        reset = getattr(tracemalloc, "reset_peak", None)
+        with _lock:
+            before, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            alone = reset is not None and not _running
+            if alone:
+                reset()
+            _running += 1
+            _started += 1
+            started = _started
+        try:
+            with super().timer(stage):
+                yield
+        finally:
+            with _lock:
+                _running -= 1
+                current, peak = tracemalloc.get_traced_memory()
+                self.peak = max(self.peak, peak)
+                self.kept[stage] += current - before
+                if alone and _started == started:
+                    self.peaks[stage] = max(self.peaks[stage], peak - before)
+
+    def on_file_end(
+        self, path: pathlib.Path, *, lines: int, bytes: int
+    ) -> None:
+        super().on_file_end(path, lines=lines, bytes=bytes)
+        self.snapshot()
+
+    def snapshot(self, *, always: bool = False, top: int = TOP) -> None:
+        """Record the `top` allocation sites of the memory in use, if the
+        process uses more than at its last snapshot, or `always`.
+        """
+        global _snapshot_size
+
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        if current <= _snapshot_size and not always:
+            return
+        _snapshot_size = current
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+        self.size = current
+        self.sites = [
+            Site(str(s.traceback[0]), size=s.size, count=s.count)
+            for s in snapshot.statistics("lineno")[:top]
+        ]
+
+    def report(self, stream: IO[str]) -> None:
+        """Write the memory of this process, then of each worker."""
+        if self.size < tracemalloc.get_traced_memory()[0]:
+            self.snapshot(always=True)
+        profiles = [("parent", self)] + [
+            ("worker", w) for _, w in sorted(self.processes.items())
+        ]
+        for role, profile in profiles:
+            print(
+                f"{PROGNAME}: {role} {profile.pid}: "
+                f"peak {_size(profile.peak)}",
+                file=stream,
+            )
+            for stage in STAGES:
+                if stage not in profile.kept:
+                    continue
+                line = f"  {stage:<8} kept {_size(profile.kept[stage]):>10}"
+                if stage in profile.peaks:
+                    line += f", peak {_size(profile.peaks[stage]):>10}"
+                print(line, file=stream)
+            if profile.sites:
+                print(f"  in use at {_size(profile.size)}:", file=stream)
+            for site in profile.sites:
+                print(
+                    f"  {_size(site.size):>10} {site.count:>8} blocks  "
+                    f"{site.location}",
+                    file=stream,
+                )
@@ -0,0 +1,186 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import collections
+import contextlib
+import os
+import pathlib
+import time
+from typing import IO, Counter, Iterable, Iterator, TypeVar
+
+from . import base, tracing
+
+T = TypeVar("T")
+
+PREFIX = "apexlint"
+
+# Name, help, and unit of each count
+COUNTS = (
+    ("files_discovered", "Files found in the FILE arguments.", None),
+    ("files_linted", "Files validated.", None),
+    ("read_bytes", "Bytes read from validated files.", "bytes"),
+    ("lines_scanned", "Lines validated.", None),
+)
+
+# Stages of a run, in order
+STAGES = ("walk", "match", "render")
+
+
+def _label(value: str) -> str:
+    return (
+        value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+    )
+
+
+class Metrics(tracing.Hooks):
+    """Counts and timings of a run, added up across workers, and written
+    in the OpenMetrics text format. Files are counted as hooks.
+    """
+
+    def __init__(self) -> None:
+        self.counts: Counter[str] = collections.Counter()
+        # Seconds spent in each stage
+        self.wall: Counter[str] = collections.Counter()
+        self.cpu: Counter[str] = collections.Counter()
+        # Wall seconds spent in each stage by workers, summed over them
+        self.worker: Counter[str] = collections.Counter()
+        self.violations: Counter[str] = collections.Counter()
+        self.workers = 1
+
+    def update(self, other: "Metrics") -> None:
+        """Add the counts and timings of `other`, such as a worker's.
+        Workers run at once, so their wall time is added as worker time.
+        """
+        self.counts.update(other.counts)
+        self.worker.update(other.wall)
+        self.worker.update(other.worker)
+        self.cpu.update(other.cpu)
+        self.violations.update(other.violations)
+
+    def on_file_start(self, path: pathlib.Path) -> None:
+        self.counts["files_linted"] += 1
+
+    def on_file_end(
+        self, path: pathlib.Path, *, lines: int, bytes: int
+    ) -> None:
+        self.counts["lines_scanned"] += lines
+        self.counts["read_bytes"] += bytes
+
+    def on_message(self, message: base.Message) -> None:
+        self.violations[message.validator] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Add the wall and CPU time of the block to `stage`.
+        CPU time is that of the current thread.
+        """
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.wall[stage] += time.perf_counter() - wall
+            self.cpu[stage] += time.thread_time() - cpu
+
+    def timed(self, stage: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Return the items of `iterable`, adding the time taken to produce
+        each to `stage`.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def spanned(self, stage: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Return the items of `iterable`, adding the wall time from the
+        first to the last, whatever else runs between them, to `stage`.
+        """
+        start = time.perf_counter()
+        try:
+            yield from iterable
+        finally:
+            self.wall[stage] += time.perf_counter() - start
+
+    def counted(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Return the items of `iterable`, adding each to count `name`."""
+        for item in iterable:
+            self.counts[name] += 1
+            yield item
+
+    def write(self, stream: IO[str]) -> None:
+        """Write the metrics in the OpenMetrics text format."""
+
+        def family(name, kind, help, unit=None):
+            print(f"# TYPE {PREFIX}_{name} {kind}", file=stream)
+            if unit:
+                print(f"# UNIT {PREFIX}_{name} {unit}", file=stream)
+            print(f"# HELP {PREFIX}_{name} {help}", file=stream)
+
+        for name, help, unit in COUNTS:
+            family(name, "counter", help, unit)
+            print(f"{PREFIX}_{name}_total {self.counts[name]}", file=stream)
+
+        for clock, seconds, help in (
+            ("wall", self.wall, "Wall time of each stage."),
+            ("cpu", self.cpu, "CPU time of each stage."),
+            (
+                "worker",
+                self.worker,
+                "Wall time of each stage in workers, summed over them.",
+            ),
+        ):
+            name = f"stage_{clock}_seconds"
+            family(name, "counter", help, "seconds")
+            for stage in STAGES:
+                print(
+                    f'{PREFIX}_{name}_total{{stage="{stage}"}} '
+                    f"{seconds[stage]:.6f}",
+                    file=stream,
+                )
+
+        family("workers", "gauge", "Worker processes.")
+        print(f"{PREFIX}_workers {self.workers}", file=stream)
+
+        family("violations", "counter", "Errors found by each validator.")
+        for validator, n in sorted(self.violations.items()):
+            print(
+                f'{PREFIX}_violations_total{{validator="{_label(validator)}"}}'
+                f" {n}",
+                file=stream,
+            )
+        print("# EOF", file=stream)
+
+    def save(self, path: pathlib.Path) -> None:
+        """Write the metrics to `path`, replacing it at once, so that a
+        collector reading it never sees part of a run.
+        """
+        import tempfile  # Only needed with --metrics-file
+
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), prefix=f".{PREFIX}-"
+        )
+        try:
+            with open(fd, mode="w") as f:
+                self.write(f)
+            # Readable by collectors, as files not made by mkstemp are
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -15,11 +15,14 @@
 # permissions and limitations under the License.
 #
 import contextlib
+import heapq
 import logging
 import os
 import pathlib
 import sys
-from typing import IO, Iterable, Iterator, Set
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from . import PROGNAME, archives
 
 log = logging.getLogger(__name__)
 
@@ -76,6 +79,23 @@ def chdir(path):
         os.chdir(curdir)
 
 
+def names(
+    stream: IO[bytes], *, separator: bytes = b"\n", size: int = 64 * 1024
+) -> Iterator[str]:
+    """Return the file names in `stream`, as soon as each is read."""
+    read = getattr(stream, "read1", stream.read)
+    pending = b""
+    while True:
+        chunk = read(size)
+        if not chunk:
+            break
+        *complete, pending = (pending + chunk).split(separator)
+        yield from (os.fsdecode(n) for n in complete if n)
+
+    if pending:
+        yield os.fsdecode(pending)
+
+
 def paths(files: Iterable[str]) -> Iterator[pathlib.Path]:
     """Convert filenames into pathlib.Path instances."""
     yield from (pathlib.Path(f) if f != "-" else stdin for f in files)
@@ -92,10 +112,66 @@ def unique(paths: Iterable[pathlib.Path]) -> Iterator[pathlib.Path]:
 
 
 def walk(paths: Iterable[pathlib.Path]) -> Iterator[pathlib.Path]:
-    """Return an object that produces all recursive files in paths."""
+    """Return an object that produces all recursive files in paths.
+    Archives in `paths`, but not those found in directories, produce
+    their members.
+    """
     for path in paths:
         if path.is_dir():
             yield from (p for p in path.rglob("*") if not p.is_dir())
             continue
 
+        if (
+            not StdIn.typeof(path)
+            and archives.is_archive(path)
+            and path.is_file()
+        ):
+            try:
+                yield from archives.members(path)
+            except OSError as e:
+                log.error(f"{PROGNAME}: {path}: {e}")
+            continue
+
         yield path
+
+
+def shard(
+    paths: Iterable[pathlib.Path],
+    *,
+    index: int,
+    count: int,
+    order: Optional[Dict[str, int]] = None,
+) -> Iterator[pathlib.Path]:
+    """Return the paths in shard `index` (from 1) of `count` shards.
+    Shards are balanced by file size, and the same `paths` are always
+    split the same way, whatever order they are produced in. The position
+    of each returned path in `paths` is added to `order`, by name.
+    """
+    paths = list(paths)
+
+    def size(path: pathlib.Path) -> int:
+        if StdIn.typeof(path):
+            return 0
+        try:
+            return path.stat().st_size
+        except OSError:
+            return 0
+
+    # Assign the largest remaining file to the least loaded shard
+    sizes = sorted(
+        ((size(p), os.fspath(p), i) for i, p in enumerate(paths)),
+        key=lambda s: (-s[0], s[1]),
+    )
+    loads: List[Tuple[int, int]] = [(0, n) for n in range(1, count + 1)]
+    mine = set()
+    for s, _, i in sizes:
+        load, n = heapq.heappop(loads)
+        if n == index:
+            mine.add(i)
+        heapq.heappush(loads, (load + s, n))
+
+    for i, p in enumerate(paths):
+        if i in mine:
+            if order is not None:
+                order[os.fspath(p)] = i
+            yield p
@@ -0,0 +1,122 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import functools
+import importlib
+import logging
+from typing import Iterable, Iterator, Sequence, Tuple, Type, Union
+
+from . import PROGNAME, base
+
+log = logging.getLogger(__name__)
+
+# Packages register validators under this entry point group
+GROUP = "apexlint.validators"
+
+
+class Spec:
+    """A validator, described without importing it.
+    `target` names its class as "module:Class". Until a file matches
+    `filenames`, only the Spec is used, in place of the class.
+    A plugin's entry point names a sequence of Specs, in a module that
+    doesn't import its validators:
+
+        VALIDATORS = (Spec("NoFoo", "org.rules.foo:NoFoo"),)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        target: str,
+        *,
+        filenames: Sequence[str] = ("*.cls", "*.trigger"),
+    ) -> None:
+        # Validators are known by their class name, and so is a Spec
+        self.__name__ = name
+        self.target = target
+        self.filenames = tuple(filenames)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.__name__!r}, {self.target!r})"
+
+    def enabled(self, *, path, index=None) -> bool:
+        """Return whether the validator is enabled for `path`, but only
+        load it if `path` matches `filenames`.
+        """
+        if not any(path.match(pattern) for pattern in self.filenames):
+            return False
+        return self.load().enabled(path=path, index=index)
+
+    def load(self) -> Type[base.Validator]:
+        return _load(self.target)
+
+
+Validator = Union[Type[base.Validator], Spec]
+
+
+@functools.lru_cache(maxsize=None)
+def _load(target: str) -> Type[base.Validator]:
+    module, _, qualname = target.partition(":")
+    log.debug(f"Loading validator {target}")
+    obj = importlib.import_module(module)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    if not (isinstance(obj, type) and issubclass(obj, base.Validator)):
+        raise TypeError(f"{target} is not a Validator")
+    return obj
+
+
+def _entry_points() -> Iterable:
+    try:
+        from importlib import metadata
+    except ImportError:  # Python 3.7
+        try:
+            import importlib_metadata as metadata  # type: ignore
+        except ImportError:
+            log.debug("Plugins need importlib.metadata or importlib_metadata")
+            return ()
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=GROUP)
+    return entry_points.get(GROUP, ())
+
+
+@functools.lru_cache(maxsize=None)
+def specs() -> Tuple[Validator, ...]:
+    """Return the validators registered by installed packages."""
+    return tuple(load(_entry_points()))
+
+
+def load(entry_points: Iterable) -> Iterator[Validator]:
+    """Return the validators named by `entry_points`.
+    An entry point may name a sequence of Specs, or a Validator, which is
+    then imported at once.
+    """
+    for entry_point in entry_points:
+        try:
+            found = entry_point.load()
+        except Exception as e:
+            log.warning(f"{PROGNAME}: can't load {entry_point.name}: {e}")
+            continue
+        if isinstance(found, type) and issubclass(found, base.Validator):
+            yield found
+            continue
+        for spec in found:
+            if isinstance(spec, Spec):
+                yield spec
+            else:
+                log.warning(f"{PROGNAME}: {entry_point.name}: {spec!r}")
@@ -0,0 +1,251 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import array
+import collections
+import os
+import pathlib
+from typing import (
+    Any,
+    Counter,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Sequence,
+    TypeVar,
+)
+
+from . import base
+
+T = TypeVar("T", bound=Hashable)
+
+
+class Table(Generic[T]):
+    """Distinct values, each known by its position."""
+
+    __slots__ = ("values", "ids")
+
+    def __init__(self, values: Iterable[T] = ()) -> None:
+        self.values: List[T] = []
+        self.ids: Dict[T, int] = {}
+        for value in values:
+            self.id(value)
+
+    def id(self, value: T) -> int:
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def __getitem__(self, i: int) -> T:
+        return self.values[i]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getstate__(self):
+        return self.values
+
+    def __setstate__(self, values):
+        self.__init__(values)
+
+
+class Result:
+    """A message as ids into the tables of its Results."""
+
+    __slots__ = ("path", "line", "start", "end", "validator", "message")
+
+    def __init__(
+        self,
+        path: int,
+        line: int,
+        start: int,
+        end: int,
+        validator: int,
+        message: int,
+    ) -> None:
+        self.path = path
+        self.line = line
+        self.start = start
+        self.end = end
+        self.validator = validator
+        self.message = message
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={getattr(self, k)}" for k in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
+
+# Columns of Results, and of each Result
+COLUMNS = Result.__slots__ + ("source",)
+
+# Array type codes, smallest first
+TYPECODES = "bBhHiIlLqQ"
+
+
+def _narrow(values: array.array) -> array.array:
+    """Return `values` in the smallest type that holds them all."""
+    low, high = min(values, default=0), max(values, default=0)
+    for typecode in TYPECODES:
+        bits = array.array(typecode).itemsize * 8
+        if typecode.islower():
+            fits = -(1 << (bits - 1)) <= low and high < 1 << (bits - 1)
+        else:
+            fits = 0 <= low and high < 1 << bits
+        if fits:
+            return array.array(typecode, values)
+    return values
+
+
+class Results:
+    """Messages stored by column, as arrays of integers and tables of the
+    distinct paths, validators, messages and source lines, so a large set
+    is small in memory and when pickled.
+    """
+
+    def __init__(self, messages: Iterable[base.Message] = ()) -> None:
+        self.columns = {c: array.array("l") for c in COLUMNS}
+        self.paths: Table[pathlib.Path] = Table()
+        self.validators: Table[str] = Table()
+        self.messages: Table[str] = Table()
+        self.sources: Table[str] = Table()
+        self.extend(messages)
+
+    def append(self, message: base.Message) -> None:
+        location = message.location
+        for column, value in (
+            ("path", self.paths.id(location.path)),
+            ("line", location.line),
+            ("start", location.start),
+            ("end", location.end),
+            ("validator", self.validators.id(message.validator)),
+            ("message", self.messages.id(message.message)),
+            ("source", self.sources.id(message.source)),
+        ):
+            self.columns[column].append(value)
+
+    def extend(self, messages: Iterable[base.Message]) -> None:
+        for message in messages:
+            self.append(message)
+
+    def __len__(self):
+        return len(self.columns["line"])
+
+    def result(self, i: int) -> Result:
+        return Result(*(self.columns[c][i] for c in Result.__slots__))
+
+    def __getitem__(self, i: int) -> base.Message:
+        c = self.columns
+        return base.Message(
+            location=base.Location(
+                line=c["line"][i],
+                start=c["start"][i],
+                end=c["end"][i],
+                path=self.paths[c["path"][i]],
+            ),
+            message=self.messages[c["message"][i]],
+            source=self.sources[c["source"][i]],
+            validator=self.validators[c["validator"][i]],
+        )
+
+    def __iter__(self) -> Iterator[base.Message]:
+        return (self[i] for i in range(len(self)))
+
+    def take(self, indices: Iterable[int]) -> "Results":
+        """Return the messages at `indices`, sharing their tables."""
+        taken = Results()
+        taken.paths, taken.validators = self.paths, self.validators
+        taken.messages, taken.sources = self.messages, self.sources
+        for i in indices:
+            for column, values in self.columns.items():
+                taken.columns[column].append(values[i])
+        return taken
+
+    def group_by(self, column: str) -> Dict[Any, "Results"]:
+        """Return the messages of each path or validator, in order."""
+        table = self._table(column)
+        groups: Dict[int, List[int]] = {}
+        for i, value in enumerate(self.columns[column]):
+            groups.setdefault(value, []).append(i)
+        return {table[v]: self.take(ids) for v, ids in groups.items()}
+
+    def counts(self, column: str) -> Counter[Any]:
+        """Return how many messages each path or validator has."""
+        table = self._table(column)
+        ids: Counter[int] = collections.Counter(self.columns[column])
+        return collections.Counter({table[v]: n for v, n in ids.items()})
+
+    def _table(self, column: str) -> Table:
+        tables = {"path": self.paths, "validator": self.validators}
+        try:
+            return tables[column]
+        except KeyError:
+            raise ValueError(f"can't group by {column!r}") from None
+
+    def json(self) -> Dict[str, Any]:
+        """Return the messages as JSON data, by column, for `from_json`."""
+        return {
+            "paths": [os.fspath(p) for p in self.paths.values],
+            "validators": self.validators.values,
+            "messages": self.messages.values,
+            "sources": self.sources.values,
+            "columns": {c: v.tolist() for c, v in self.columns.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Results":
+        """Return the messages of JSON `data` returned by `json`. Paths are
+        read back as they were reported, such as `rev:name`.
+        """
+        found = cls()
+        found.paths = Table(pathlib.Path(p) for p in data["paths"])
+        found.validators = Table(data["validators"])
+        found.messages = Table(data["messages"])
+        found.sources = Table(data["sources"])
+        for c in COLUMNS:
+            found.columns[c].extend(data["columns"][c])
+        return found
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["columns"] = {c: _narrow(v) for c, v in self.columns.items()}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.columns = {
+            c: array.array("l", v) for c, v in self.columns.items()
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Results):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)!r})"
+
+
+def concat(results: Sequence[Results]) -> Results:
+    """Return the messages of each of `results`, in order."""
+    joined = Results()
+    for r in results:
+        joined.extend(r)
+    return joined
@@ -15,15 +15,54 @@
 # permissions and limitations under the License.
 #
 import re
-from typing import Optional, Pattern, Union
+from typing import Any, Callable, Optional, Pattern, Sequence, Union
 
-PatternOrStr = Union[str, Pattern]
+
+class LazyPattern:
+    """A Pattern that is only compiled, by `compile(*args, **kwargs)`,
+    when one of its attributes is first used.
+    Attributes are then cached, so later uses cost nothing extra.
+    """
+
+    def __init__(self, compile: Callable[..., Pattern], *args, **kwargs):
+        self._compile = compile
+        self._args = args
+        self._kwargs = kwargs
+        self._compiled: Optional[Pattern] = None
+
+    @property
+    def compiled(self) -> Pattern:
+        if self._compiled is None:
+            self._compiled = self._compile(*self._args, **self._kwargs)
+        return self._compiled
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        value = getattr(self.compiled, name)
+        setattr(self, name, value)
+        return value
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.compiled!r})"
+
+
+def lazy(compile: Callable[..., Pattern], *args, **kwargs) -> LazyPattern:
+    """Return a LazyPattern for `compile(*args, **kwargs)`, such as
+    `lazy(re.compile, r"FOO")` or `lazy(comment, "FOO")`.
+    """
+    return LazyPattern(compile, *args, **kwargs)
+
+
+PatternOrStr = Union[str, Pattern, LazyPattern]
 
 
 def escape(s: PatternOrStr, flags: Optional[int] = None) -> Pattern:
     """Return Pattern object for `s`, escaping it if necessary.
     If `flags` is not None, clobber any flags on `s`.
     """
+    if isinstance(s, LazyPattern):
+        s = s.compiled
     if isinstance(s, Pattern):
         if flags is not None:
             s = re.compile(s.pattern, flags=flags)
@@ -39,13 +78,17 @@ def comment(s: PatternOrStr) -> Pattern:
         fr"""
         (?x:                   # Match s inside a comment
             /\*                # C-style /* comment */
-            (\*(?!\/)|[^*])*?  # Ignore closing */
+            (?:                # Up to the closing */ or the next /*,
+                [^*/]          # which is tried on its own, so each
+            |                  # character is only scanned once
+                \*(?!/)
+            |
+                /(?!\*)
+            )*?
             (?-x:(?P<c>{pattern.pattern}))
-            .*?
-            \*/
         |
             //                 # C++-style // comment
-            .*?
+            (?:[^/]|/(?!/))*?  # Up to the next //
             (?-x:(?P<cpp>{pattern.pattern}))
         )
         """.strip(),
@@ -55,6 +98,8 @@ def comment(s: PatternOrStr) -> Pattern:
 
 def not_string(s: PatternOrStr, flags: int = 0) -> Pattern:
     """Return Pattern object that matches `s` outside quoted strings."""
+    if isinstance(s, LazyPattern):
+        s = s.compiled
     if isinstance(s, Pattern):
         flags = s.flags
         s = str(s.pattern)
@@ -81,3 +126,54 @@ def not_string(s: PatternOrStr, flags: int = 0) -> Pattern:
         + s,
         flags=flags,
     )
+
+
+def _parser():
+    try:
+        from re import _parser as parser  # type: ignore  # Python 3.11
+    except ImportError:
+        import sre_parse as parser  # type: ignore
+    return parser
+
+
+# Named groups, which may not repeat in a union, and leading global flags
+NAMED_GROUP = re.compile(r"(?<!\\)\(\?P<[A-Za-z_]\w*>")
+GLOBAL_FLAGS = re.compile(r"^(?:\(\?[aiLmsux]+\))+")
+
+# Flags that apply to part of a pattern
+SCOPED_FLAGS = (
+    (re.A, "a"),
+    (re.I, "i"),
+    (re.M, "m"),
+    (re.S, "s"),
+    (re.X, "x"),
+)
+
+
+def union(patterns: Sequence[PatternOrStr]) -> Optional[Pattern]:
+    """Return one Pattern that matches wherever any of `patterns` would,
+    or None if they can't be combined, such as if one refers to a group.
+    Group names are dropped, so only the whole match is meaningful.
+    """
+    parser = _parser()
+    parts = []
+    for p in patterns:
+        p = escape(p)
+        if not isinstance(p.pattern, str):
+            return None
+        source = GLOBAL_FLAGS.sub("", p.pattern)
+        unnamed = NAMED_GROUP.sub("(", source)
+        try:
+            parsed = repr(parser.parse(source, p.flags))
+            same = parsed == repr(parser.parse(unnamed, p.flags))
+        except re.error:
+            return None
+        if not same or "GROUPREF" in parsed:
+            return None
+        flags = "".join(f for flag, f in SCOPED_FLAGS if p.flags & flag)
+        end = "\n)" if p.flags & re.X else ")"
+        parts.append(f"(?{flags}:{unnamed}{end}")
+    try:
+        return re.compile("|".join(parts))
+    except re.error:
+        return None
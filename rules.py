@@ -0,0 +1,235 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import functools
+import logging
+import pathlib
+import re
+import string
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from . import PROGNAME, base
+
+log = logging.getLogger(__name__)
+
+# Each rule is a table, or an INI section, named for its validator:
+#
+#     [NoSystemDebug]
+#     pattern = 'System\.debug\s*\('
+#     filenames = ["*.cls"]
+#     suppress = 'apexlint-debug'
+#     message = "System.debug left in code"
+#
+FIELDS = frozenset(("pattern", "filenames", "suppress", "message"))
+
+# Fields a message may format, as in a validator's docstring
+MESSAGE_FIELDS = frozenset(("match", "source"))
+
+
+class RuleError(ValueError):
+    """A rules file that can't be read, or a rule that isn't valid."""
+
+
+class Rule:
+    """A validator described in a rules file: `pattern` and `suppress` are
+    regexps for `base.Validator.invalid` and `suppress`, and `message` is
+    its docstring. Like a `plugins.Spec`, a Rule stands in for its class,
+    which each process compiles once, when it is first loaded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pattern: str,
+        *,
+        filenames: Sequence[str] = ("*.cls", "*.trigger"),
+        message: str,
+        suppress: Optional[str] = None,
+    ) -> None:
+        self.__name__ = name
+        self.pattern = pattern
+        self.filenames = tuple(filenames)
+        self.message = message
+        self.suppress = suppress
+
+    def __repr__(self):
+        name, pattern = self.__name__, self.pattern
+        return f"{self.__class__.__name__}({name!r}, {pattern!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Rule):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self) -> Tuple:
+        return (
+            self.__name__,
+            self.pattern,
+            self.filenames,
+            self.message,
+            self.suppress,
+        )
+
+    def enabled(self, *, path, index=None) -> bool:
+        return self.load().enabled(path=path, index=index)
+
+    def load(self) -> Type[base.Validator]:
+        return _compile(*self._key())
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(
+    name: str,
+    pattern: str,
+    filenames: Tuple[str, ...],
+    message: str,
+    suppress: Optional[str],
+) -> Type[base.Validator]:
+    return type(
+        name,
+        (base.Validator,),
+        {
+            "__doc__": message,
+            "__module__": __name__,
+            "filenames": filenames,
+            "invalid": re.compile(pattern),
+            "suppress": None if suppress is None else re.compile(suppress),
+        },
+    )
+
+
+def parse(name: str, fields: Mapping[str, Any]) -> Rule:
+    """Return the Rule `name` described by `fields`, once checked."""
+    if not name.isidentifier():
+        raise RuleError(f"[{name}]: not a valid validator name")
+    unknown = ", ".join(sorted(set(fields) - FIELDS))
+    if unknown:
+        raise RuleError(f"[{name}]: unknown fields {unknown}")
+
+    def regexp(field: str) -> Optional[str]:
+        value = fields.get(field)
+        if value is None:
+            return None
+        if not isinstance(value, str):
+            raise RuleError(f"[{name}]: {field} must be a string")
+        try:
+            re.compile(value)
+        except re.error as e:
+            raise RuleError(f"[{name}]: {field}: {e}") from None
+        return value
+
+    pattern = regexp("pattern")
+    if pattern is None:
+        raise RuleError(f"[{name}]: missing pattern")
+
+    filenames = fields.get("filenames", ("*.cls", "*.trigger"))
+    if isinstance(filenames, str):
+        filenames = filenames.split()
+    if not isinstance(filenames, (list, tuple)) or not all(
+        isinstance(f, str) for f in filenames
+    ):
+        raise RuleError(f"[{name}]: filenames must be a list of strings")
+
+    message = fields.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise RuleError(f"[{name}]: missing message")
+    try:
+        formatted = [f for _, f, _, _ in string.Formatter().parse(message)]
+    except ValueError as e:
+        raise RuleError(f"[{name}]: message: {e}") from None
+    for field in filter(None, formatted):
+        if re.split(r"[.\[]", field, 1)[0] not in MESSAGE_FIELDS:
+            raise RuleError(
+                f"[{name}]: message may only format {{match}} or {{source}}"
+            )
+
+    return Rule(
+        name,
+        pattern,
+        filenames=filenames,
+        message=message,
+        suppress=regexp("suppress"),
+    )
+
+
+def _tables(path: pathlib.Path) -> Dict[str, Mapping[str, Any]]:
+    """Return the table of each rule in a TOML or INI file."""
+    if path.suffix == ".toml":
+        try:
+            import tomllib  # type: ignore  # Python 3.11
+        except ImportError:
+            raise RuleError(
+                f"{path}: reading TOML needs Python 3.11; use an INI file"
+            ) from None
+        with path.open(mode="rb") as f:
+            try:
+                data = tomllib.load(f)
+            except tomllib.TOMLDecodeError as e:
+                raise RuleError(f"{path}: {e}") from None
+        for name, table in data.items():
+            if not isinstance(table, dict):
+                raise RuleError(f"{path}: [{name}]: not a table")
+        return data
+
+    import configparser  # Only needed with rules
+
+    # Regexps are taken as written, without %-interpolation
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str  # type: ignore
+    with path.open(mode="r") as f:
+        try:
+            parser.read_file(f)
+        except configparser.Error as e:
+            raise RuleError(f"{path}: {e}") from None
+    return {name: dict(parser[name]) for name in parser.sections()}
+
+
+def load(path: pathlib.Path) -> Tuple[Rule, ...]:
+    """Return the rules in the TOML or INI file at `path`."""
+    try:
+        tables = _tables(path)
+    except OSError as e:
+        raise RuleError(str(e)) from None
+
+    def rules() -> Iterator[Rule]:
+        for name, fields in tables.items():
+            try:
+                yield parse(name, fields)
+            except RuleError as e:
+                raise RuleError(f"{path}: {e}") from None
+
+    loaded = tuple(rules())
+
+    # Time the rules whose quantifiers overlap, before a line hangs on one
+    from . import backtracking
+
+    for name, finding in backtracking.validators(
+        (rule.load() for rule in loaded), suspects=True
+    ):
+        log.warning(f"{PROGNAME}: {path}: {name} backtracks: {finding}")
+    return loaded
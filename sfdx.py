@@ -0,0 +1,156 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import json
+import logging
+import os
+import pathlib
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+)
+
+from . import PROGNAME, pathtools
+
+log = logging.getLogger(__name__)
+
+FILENAME = "sfdx-project.json"
+
+
+class Package(NamedTuple):
+    """A package directory, and the validators it selects or ignores."""
+
+    path: pathlib.Path
+    select: FrozenSet[str] = frozenset()
+    ignore: FrozenSet[str] = frozenset()
+
+    def allows(self, name: str) -> bool:
+        if self.select and name not in self.select:
+            return False
+        return name not in self.ignore
+
+
+class Project:
+    """The package directories of Salesforce DX projects.
+    Validators are configured per package in sfdx-project.json:
+
+        "plugins": {
+            "apexlint": {
+                "packages": {
+                    "force-app": {"select": [...], "ignore": [...]}
+                }
+            }
+        }
+    """
+
+    def __init__(self) -> None:
+        self.roots: Dict[str, List[Package]] = {}
+        # Absolute package directories, deepest first
+        self.packages: List[Package] = []
+
+    @classmethod
+    def discover(cls, paths: Iterable[pathlib.Path]) -> Optional["Project"]:
+        """Return the projects containing any of `paths`, rooted at the
+        nearest directory with a project file, from the path itself if it
+        is a directory, or else from its parent.
+        """
+        self = cls()
+        searched: Set[str] = set()
+        for path in paths:
+            if pathtools.StdIn.typeof(path):
+                continue
+            root = _root(path if path.is_dir() else path.parent, searched)
+            if root is not None and root not in self.roots:
+                self.load(pathlib.Path(root))
+        return self if self.roots else None
+
+    def load(self, root: pathlib.Path) -> None:
+        filename = root / FILENAME
+        try:
+            with filename.open(mode="r") as f:
+                data = json.load(f)
+            directories = [d["path"] for d in data["packageDirectories"]]
+            options = data.get("plugins", {}).get("apexlint", {})
+            options = options.get("packages", {})
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.warning(f"{PROGNAME}: ignoring {filename}: {e}")
+            return
+
+        packages = []
+        for directory in directories:
+            selection = options.get(directory, {})
+            packages.append(
+                Package(
+                    path=root / directory,
+                    select=frozenset(selection.get("select", ())),
+                    ignore=frozenset(selection.get("ignore", ())),
+                )
+            )
+        self.roots[os.path.abspath(root)] = packages
+        self.packages = sorted(
+            (
+                p._replace(path=pathlib.Path(os.path.abspath(p.path)))
+                for packages in self.roots.values()
+                for p in packages
+            ),
+            key=lambda p: len(p.path.parts),
+            reverse=True,
+        )
+
+    def expand(self, paths: Iterable[pathlib.Path]) -> Iterator[pathlib.Path]:
+        """Replace the project roots in `paths` by their package directories.
+        Package directories that don't exist are skipped.
+        """
+        for path in paths:
+            packages = self.roots.get(os.path.abspath(path))
+            if packages is None:
+                yield path
+                continue
+            for package in packages:
+                if package.path.is_dir():
+                    yield package.path
+                else:
+                    log.debug(f"Skipping missing package {package.path}")
+
+    def package(self, path: pathlib.Path) -> Optional[Package]:
+        """Return the innermost package containing `path`, if any."""
+        filename = os.path.abspath(path)
+        for package in self.packages:
+            if filename.startswith(os.path.join(package.path, "")):
+                return package
+        return None
+
+def _root(directory: pathlib.Path, searched: Set[str]) -> Optional[str]:
+    """Return the nearest of `directory` and its parents with a project
+    file, as an absolute path, if any. Directories `searched` already
+    aren't searched again, and those searched now are added to it.
+    """
+    path = os.path.abspath(directory)
+    while path not in searched:
+        searched.add(path)
+        if os.path.isfile(os.path.join(path, FILENAME)):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return None
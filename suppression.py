@@ -0,0 +1,135 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import bisect
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from . import retools
+
+# Locate a directive inside a comment; the directive itself is parsed below.
+DIRECTIVE = retools.lazy(
+    retools.comment,
+    retools.lazy(re.compile, r"noqa|apexlint:", flags=re.IGNORECASE),
+)
+
+NAMES = r"\w+(?:\s*,\s*\w+)*"
+
+NOQA = retools.lazy(
+    re.compile, fr"noqa(?:\s*:\s*(?P<names>{NAMES}))?", flags=re.IGNORECASE
+)
+
+BLOCK = retools.lazy(
+    re.compile,
+    fr"apexlint:\s*(?P<action>disable|enable)(?:\s*=\s*(?P<names>{NAMES}))?",
+    flags=re.IGNORECASE,
+)
+
+# Blocks and lines that apply to every validator are keyed by `ALL`.
+ALL = None
+
+Names = Optional[FrozenSet[str]]
+
+
+def _names(s: Optional[str]) -> Names:
+    if not s:
+        return ALL
+    return frozenset(n.strip().lower() for n in s.split(","))
+
+
+class Suppressions:
+    """Index the suppression comments of a file:
+    `// noqa` silences every validator on its line.
+    `// noqa: NoTestMethod, NoSeeAllData` silences only those validators.
+    `// apexlint: disable=NoObjectMapKeys` silences a validator until a
+    matching `// apexlint: enable=NoObjectMapKeys`, or the end of the file.
+    Omitting `=...` disables or enables every validator.
+    """
+
+    def __init__(self) -> None:
+        self.lines: Dict[int, Names] = {}
+        self.blocks: Dict[Optional[str], Tuple[List[int], List[float]]] = {}
+
+    @classmethod
+    def parse(cls, lines: Iterable[str], *, start: int = 1) -> "Suppressions":
+        """Return the index of suppression comments in `lines`."""
+        self = cls()
+        opened: Dict[Optional[str], int] = {}
+
+        for lineno, line in enumerate(lines, start=start):
+            # Cheap substring test avoids the regex on almost every line
+            lower = line.lower()
+            if "noqa" not in lower and "apexlint:" not in lower:
+                continue
+
+            m = DIRECTIVE.search(line)
+            if not m:
+                continue
+            pos = m.start("c") if m.group("c") is not None else m.start("cpp")
+
+            noqa = NOQA.match(line, pos)
+            if noqa:
+                self.lines[lineno] = _names(noqa.group("names"))
+                continue
+
+            block = BLOCK.match(line, pos)
+            if not block:
+                continue
+            names = _names(block.group("names"))
+            if block.group("action").lower() == "disable":
+                for name in names or (ALL,):
+                    opened.setdefault(name, lineno)
+                continue
+
+            for name in names or tuple(opened):
+                if name in opened:
+                    self._close(name, opened.pop(name), lineno)
+
+        for name, first in opened.items():
+            self._close(name, first, float("inf"))
+
+        return self
+
+    def _close(self, name: Optional[str], first: int, last: float) -> None:
+        starts, ends = self.blocks.setdefault(name, ([], []))
+        starts.append(first)
+        ends.append(last)
+
+    def _blocked(self, lineno: int, name: Optional[str]) -> bool:
+        try:
+            starts, ends = self.blocks[name]
+        except KeyError:
+            return False
+        i = bisect.bisect_right(starts, lineno) - 1
+        return i >= 0 and lineno < ends[i]
+
+    def all(self, lineno: int) -> bool:
+        """Return whether every validator is suppressed on `lineno`."""
+        return (
+            lineno in self.lines and self.lines[lineno] is ALL
+        ) or self._blocked(lineno, ALL)
+
+    def suppressed(self, lineno: int, name: str) -> bool:
+        """Return whether validator `name` is suppressed on `lineno`."""
+        name = name.lower()
+        if lineno in self.lines:
+            names = self.lines[lineno]
+            if names is ALL or name in names:
+                return True
+        return self._blocked(lineno, ALL) or self._blocked(lineno, name)
+
+    def __bool__(self) -> bool:
+        return bool(self.lines or self.blocks)
@@ -15,15 +15,38 @@
 # permissions and limitations under the License.
 #
 #!/usr/bin/env python3
+import argparse
 import io
+import json
 import logging
 import os
 import pathlib
+import pickle
+import queue
+import random
 import re
+import shutil
+import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
-from typing import Iterable, NamedTuple, Pattern, Union
+import unittest.mock
+import zipfile
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Tuple,
+    Type,
+    Union,
+)
 
 # Resolve local module
 sys.path.insert(
@@ -31,13 +54,34 @@ sys.path.insert(
 )  # noqa
 from apexlint import (  # isort:skip
     __main__,
+    archives,
+    backtracking,
     base,
+    classindex,
+    fuzz,
+    gittree,
+    lexer,
+    limits,
+    lsp,
+    match,
+    memprofile,
+    metrics,
     pathtools,
+    plugins,
+    results,
     retools,
+    rules,
+    sfdx,
+    suppression,
     terminfo,
+    tracing,
     unittesttools,
     validators,
+    watch,
+    workers,
 )
+from apexlint.baseline import Baseline  # isort:skip
+from apexlint.cache import Cache  # isort:skip
 
 
 # Validator tests #############################################################
@@ -126,6 +170,44 @@ class TestValidators(unittesttools.ValidatorTestCase):
                     """,
                 ),
             ),
+            # Nested generics
+            Case("new Map<Id, List<Object>>{}", ()),
+            Case(
+                "new Map<List<Id>, Object>{}",
+                (
+                    """\
+                    Foo.cls:1:8: error: Map key might be mutable
+                     new Map<List<Id>, Object>{}
+                             ^~~~~~~~
+                    """,
+                ),
+            ),
+            Case(
+                "new Map<Map<Id, Object>, Object>{}",
+                (
+                    """\
+                    Foo.cls:1:8: error: Map key might be mutable
+                     new Map<Map<Id, Object>, Object>{}
+                             ^~~~~~~~~~~~~~~
+                    """,
+                ),
+            ),
+            # Spanning lines
+            Case(
+                "new Map<\n    Account,\n    Id\n>()",
+                (
+                    """\
+                    Foo.cls:2:4: error: Map key might be mutable
+                         Account,
+                         ^~~~~~~
+                    """,
+                ),
+            ),
+            # Comments and strings
+            Case("// new Map<Object, Object>{}", ()),
+            Case("/* new Map<Object, Object>{} */", ()),
+            Case("/*\nnew Map<Object, Object>{}\n*/", ()),
+            Case("'new Map<Object, Object>{}'", ()),
             # Suppression
             Case(
                 "new Map<A, B>{} // https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md",
@@ -198,6 +280,17 @@ class TestValidators(unittesttools.ValidatorTestCase):
                     """,
                 ),
             ),
+            # Nested generics
+            Case(
+                "new Set<List<Id>>{}",
+                (
+                    """\
+                    Foo.cls:1:8: error: Set member might be mutable
+                     new Set<List<Id>>{}
+                             ^~~~~~~~
+                    """,
+                ),
+            ),
             # Suppression
             Case(
                 "new Set<A>{} // https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md",
@@ -277,6 +370,23 @@ class TestValidators(unittesttools.ValidatorTestCase):
             # Ignore non-test files
             Case("Foo.cls", "@future", ()),
             Case("FooTest.trigger", "@future", ()),
+            # Unless in an @isTest class or method
+            Case(
+                "Foo.cls",
+                "@isTest class Foo {\n  @future void f() {}\n}",
+                (
+                    """\
+                    Foo.cls:2:2: error: @future used in test class
+                       @future void f() {}
+                       ^~~~~~~
+                    """,
+                ),
+            ),
+            Case(
+                "Foo.cls",
+                "class Foo {\n  @isTest void t() {}\n  @future void f() {}\n}",
+                (),
+            ),
         ):
             with self.subTest(c):
                 self.assertMatchLines(
@@ -347,6 +457,17 @@ class TestValidators(unittesttools.ValidatorTestCase):
                     """,
                 ),
             ),
+            # Spanning lines
+            Case(
+                "@isTest(\n    isParallel=true,\n    SeeAllData=true\n)",
+                (
+                    """\
+                    Foo.cls:3:4: error: SeeAllData used in @isTest
+                         SeeAllData=true
+                         ^~~~~~~~~~~~~~~
+                    """,
+                ),
+            ),
             # Whitespace
             Case(
                 " @ isTest ( isParallel = true , SeeAllData = true )",
@@ -375,6 +496,8 @@ class TestValidators(unittesttools.ValidatorTestCase):
             Case("@isTest public static void test() {}", ()),
             Case("@isTest public static void testMethodCall() {}", ()),
             Case("@isTest public static void testTestMethod() {}", ()),
+            Case("// Replaced testMethod with @isTest", ()),
+            Case("String s = 'testMethod';", ()),
             Case(
                 "public static testMethod void test() {}",
                 (
@@ -552,6 +675,528 @@ class TestMatchFiles(unittesttools.ValidatorTestCase):
                     msg=output_count.getvalue(),
                 )
 
+    def test_merge(self):
+        """Validate that --results of shards merge into one report."""
+
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            for filename, contents in (("A.cls", "FOO"), ("B.cls", "FOO")):
+                d.joinpath(filename).write_text(contents)
+
+            paths = [d / "B.cls", d / "A.cls", d / "Missing.cls"]
+            unsharded = io.StringIO()
+            __main__.lint(
+                paths,
+                jobs=1,
+                output=unsharded,
+                validators=[Validator],
+                verbose=-1,
+            )
+
+            results = []
+            for i in (1, 2):
+                results.append(io.StringIO())
+                order: Dict[str, int] = {}
+                __main__.lint(
+                    pathtools.shard(paths, index=i, count=2, order=order),
+                    jobs=1,
+                    order=order,
+                    output=None,
+                    results=results[-1],
+                    validators=[Validator],
+                    verbose=-1,
+                )
+                results[-1].seek(0)
+
+            output, output_count = io.StringIO(), io.StringIO()
+            self.assertEqual(
+                __main__.merge(
+                    results,
+                    output=output,
+                    output_count=output_count,
+                    verbose=-1,
+                ),
+                1,
+            )
+            # In the order files were found, as without shards
+            self.assertEqual(
+                output.getvalue().splitlines(),
+                [
+                    f"{d / 'B.cls'}:1:0: error: Found FOO",
+                    f"{d / 'A.cls'}:1:0: error: Found FOO",
+                ],
+            )
+            self.assertEqual(output.getvalue(), unsharded.getvalue())
+            self.assertEqual(output_count.getvalue(), "2\n")
+
+    def test_statistics(self):
+        """Count errors by validator and top-level directory."""
+
+        class Foo(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+        class Bar(base.Validator):
+            """Found BAR"""
+
+            invalid = re.compile(r"BAR")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            for filename, contents in (
+                ("src/classes/A.cls", "FOO FOO\nBAR"),
+                ("src/B.cls", "FOO"),
+                ("lib/C.cls", "FOO"),
+            ):
+                d.joinpath(filename).parent.mkdir(parents=True, exist_ok=True)
+                d.joinpath(filename).write_text(contents)
+
+            cwd = os.getcwd()
+            os.chdir(d)
+            try:
+                paths = [
+                    pathlib.Path(p)
+                    for p in ("src/classes/A.cls", "src/B.cls", "lib/C.cls")
+                ]
+                output, output_count = io.StringIO(), io.StringIO()
+                counts, errors = __main__.statistics(
+                    paths + [pathlib.Path("Missing.cls")],
+                    jobs=1,
+                    output=output,
+                    output_count=output_count,
+                    validators=[Foo, Bar],
+                )
+            finally:
+                os.chdir(cwd)
+
+            self.assertEqual(
+                counts,
+                {("Foo", "src"): 3, ("Foo", "lib"): 1, ("Bar", "src"): 1},
+            )
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(
+                output.getvalue().splitlines(),
+                [
+                    "4 Foo",
+                    "3   src",
+                    "1   lib",
+                    "1 Bar",
+                    "1   src",
+                    "5 total",
+                ],
+            )
+            self.assertEqual(output_count.getvalue(), "5\n")
+
+    def test_dedup(self):
+        """Validate each distinct file once, reporting it at every path."""
+        validated = []
+
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+            @classmethod
+            def errors(cls, line, **kwargs):
+                validated.append(line)
+                return super().errors(line, **kwargs)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            a, b, c = (d / f"{name}.cls" for name in "ABC")
+            a.write_text("FOO;\nbar;")
+            b.write_text("FOO;\nbar;")
+            c.write_text("FOO;\nFOO;")
+
+            baseline = Baseline()
+            baseline.add([f"Validator\t{b.as_posix()}\t5558e8cd70713aa9"])
+
+            class Case(NamedTuple):
+                dedup: bool
+                validated: int
+
+            for case in (Case(dedup=False, validated=8), Case(True, 4)):
+                with self.subTest(case=case):
+                    match.contents.clear()
+                    validated.clear()
+                    found = list(
+                        match.files(
+                            [a, b, c, a],
+                            baseline=baseline,
+                            dedup=case.dedup,
+                            validators=(Validator,),
+                        )
+                    )
+                    self.assertEqual(
+                        [(m.location.path, m.location.line) for m in found],
+                        [(a, 1), (c, 1), (c, 2), (a, 1)],
+                    )
+                    self.assertEqual(len(validated), case.validated)
+
+            # Files are only digested once another of their size is seen,
+            # and after their header, so generated files never are, nor
+            # read past it
+            generated = d / "Generated.cls"
+            generated.write_text("// @generated\n")
+            match.contents.clear()
+            opened = []
+            open_ = pathlib.Path.open
+
+            def recorded(self, mode="r", *args, **kwargs):
+                opened.append((self, mode))
+                return open_(self, mode, *args, **kwargs)
+
+            with unittest.mock.patch.object(pathlib.Path, "open", recorded):
+                list(
+                    match.files(
+                        [a, generated, generated, c, b],
+                        dedup=True,
+                        limits=limits.Limits(markers=limits.MARKERS),
+                        validators=(Validator,),
+                    )
+                )
+            self.assertEqual(
+                opened,
+                [
+                    (a, "r"),
+                    (generated, "r"),
+                    (generated, "r"),
+                    (c, "r"),
+                    (a, "rb"),
+                    (c, "rb"),
+                    (b, "r"),
+                    (b, "rb"),
+                ],
+            )
+
+    class Foo(base.Validator):
+        """Found FOO"""
+
+        invalid = re.compile(r"FOO")
+
+    def test_dedup_jobs(self):
+        """Workers are sent every path with the same contents at once."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            a, b, c, e = (d / f"{name}.cls" for name in "ABCE")
+            for path in (a, b, e):
+                path.write_text("FOO;\nbar;")
+            c.write_text("FOO;\nFOO;")
+            paths = [a, b, c, e]
+            self.assertEqual(match.duplicates(paths), [[0, 1, 3], [2]])
+
+            for jobs in (1, 2):
+                with self.subTest(jobs=jobs):
+                    match.contents.clear()
+                    hooks = TestTracing.Events()
+                    messages, errors = __main__.lint(
+                        paths,
+                        dedup=True,
+                        hooks=hooks,
+                        jobs=jobs,
+                        output=None,
+                        validators=(self.Foo,),
+                    )
+                    self.assertEqual(
+                        [str(m.location) for m in messages],
+                        [f"{a}:1:0", f"{b}:1:0", f"{c}:1:0", f"{c}:2:0"]
+                        + [f"{e}:1:0"],
+                    )
+                    self.assertEqual(errors, [])
+                    # Each of the contents was validated once
+                    self.assertEqual(
+                        [x[1] for x in hooks.events if x[0] == "time"],
+                        ["A.cls", "C.cls"],
+                    )
+
+    def test_cache(self):
+        """Keep the messages of each file's contents across runs."""
+        validated = []
+
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+            @classmethod
+            def errors(cls, line, **kwargs):
+                validated.append(line)
+                return super().errors(line, **kwargs)
+
+        class Other(Validator):
+            """Found BAR"""
+
+            invalid = re.compile(r"BAR")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            a, b = d / "A.cls", d / "B.cls"
+            a.write_text("FOO;\nBAR;")
+            b.write_text("FOO;\nBAR;")
+            cache = pickle.loads(pickle.dumps(Cache(d / "cache")))
+
+            class Case(NamedTuple):
+                paths: List[pathlib.Path]
+                validators: Tuple[Type[base.Validator], ...]
+                validated: int
+                found: List[Tuple[pathlib.Path, int, str]]
+
+            for case in (
+                Case([a], (Validator,), 2, [(a, 1, "Validator")]),
+                # Another run, with the same contents at another path
+                Case([b], (Validator,), 0, [(b, 1, "Validator")]),
+                Case([b], (Other,), 2, [(b, 2, "Other")]),
+            ):
+                with self.subTest(case=case):
+                    match.contents.clear()
+                    validated.clear()
+                    found = list(
+                        match.files(
+                            case.paths,
+                            cache=cache,
+                            dedup=True,
+                            validators=case.validators,
+                        )
+                    )
+                    self.assertEqual(
+                        [
+                            (m.location.path, m.location.line, m.validator)
+                            for m in found
+                        ],
+                        case.found,
+                    )
+                    self.assertEqual(len(validated), case.validated)
+
+        with self.assertRaises(SystemExit):
+            __main__.parse_args(["--cache", "dir", "--no-dedup"])
+
+    def test_metrics(self):
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            d.joinpath("A.cls").write_text("FOO\nFOO FOO\n")
+            d.joinpath("B.cls").write_text("BAR\n")
+
+            found = metrics.Metrics()
+            __main__.lint(
+                [d / "A.cls", d / "B.cls"],
+                jobs=1,
+                metrics=found,
+                output=None,
+                validators=[Validator],
+            )
+            self.assertEqual(
+                found.counts,
+                {"files_linted": 2, "lines_scanned": 3, "read_bytes": 16},
+            )
+            self.assertEqual(found.violations, {"Validator": 3})
+            self.assertEqual(found.workers, 1)
+            self.assertEqual(set(found.wall), {"match", "render"})
+            self.assertEqual(set(found.worker), {"match"})
+            self.assertGreaterEqual(found.wall["match"], found.worker["match"])
+
+            filename = d / "metrics.prom"
+            found.save(filename)
+            written = filename.read_text().splitlines()
+            self.assertIn("apexlint_files_linted_total 2", written)
+            self.assertIn(
+                'apexlint_violations_total{validator="Validator"} 3', written
+            )
+            self.assertIn(
+                'apexlint_stage_worker_seconds_total{stage="walk"} 0.000000',
+                written,
+            )
+            self.assertEqual(written[-1], "# EOF")
+
+    class Sleepy(base.Validator):
+        """Found SLEEP"""
+
+        invalid = re.compile(r"SLEEP")
+
+        @classmethod
+        def errors(cls, line, **kwargs):
+            if "SLEEP" in line:
+                time.sleep(0.25)
+            return super().errors(line, **kwargs)
+
+    def test_metrics_jobs(self):
+        """The wall time of the match is the parent's, and the time of each
+        worker is added up separately.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            paths = [d / f"{name}.cls" for name in "ABCD"]
+            for path in paths:
+                path.write_text(f"SLEEP {path.name}\n")
+
+            found = metrics.Metrics()
+            __main__.lint(
+                paths,
+                jobs=4,
+                metrics=found,
+                output=None,
+                validators=(self.Sleepy,),
+            )
+            self.assertEqual(found.violations, {"Sleepy": 4})
+            self.assertGreaterEqual(found.worker["match"], 4 * 0.25)
+            self.assertLess(found.wall["match"], found.worker["match"])
+
+    def test_memprofile(self):
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+        if not tracemalloc.is_tracing():
+            self.addCleanup(tracemalloc.stop)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            d.joinpath("A.cls").write_text("FOO\nFOO FOO\n")
+            d.joinpath("B.cls").write_text("BAR\n")
+
+            found = memprofile.MemProfile()
+            self.assertTrue(tracemalloc.is_tracing())
+            __main__.lint(
+                [d / "A.cls", d / "B.cls"],
+                jobs=1,
+                metrics=found,
+                output=None,
+                validators=[Validator],
+            )
+        self.assertEqual(found.violations, {"Validator": 3})
+        self.assertEqual(set(found.kept), {"match", "render"})
+        self.assertGreater(found.peak, 0)
+
+        # Workers return theirs, which are kept by process
+        worker = pickle.loads(pickle.dumps(found))
+        worker.pid = -1
+        worker.processes = {}
+        found.update(worker)
+        found.update(worker)
+        self.assertEqual(list(found.processes), [-1])
+        self.assertEqual(found.processes[-1].peak, found.peak)
+        self.assertEqual(
+            found.processes[-1].kept["match"], 2 * found.kept["match"]
+        )
+        self.assertEqual(found.violations, {"Validator": 9})
+
+        output = io.StringIO()
+        found.report(output)
+        report = output.getvalue().splitlines()
+        self.assertRegex(report[0], r"parent \d+: peak ")
+        self.assertTrue(any(line.startswith("  match ") for line in report))
+        self.assertTrue(any(" worker -1: " in line for line in report))
+        self.assertTrue(any(" blocks " in line for line in report))
+
+    def test_memprofile_threads(self):
+        """Stages timed at once in two threads don't record the peaks of
+        each other, only the process's.
+        """
+        if not hasattr(tracemalloc, "reset_peak"):
+            self.skipTest("stage peaks need Python 3.9")
+        if not tracemalloc.is_tracing():
+            self.addCleanup(tracemalloc.stop)
+
+        found = memprofile.MemProfile()
+        started, rendered = threading.Event(), threading.Event()
+
+        def walk():
+            with found.timer("walk"):
+                data = bytearray(10 * 1024 * 1024)
+                started.set()
+                rendered.wait(60)
+                del data
+
+        thread = threading.Thread(target=walk)
+        thread.start()
+        started.wait(60)
+        with found.timer("render"):
+            pass
+        rendered.set()
+        thread.join()
+        self.assertEqual(dict(found.peaks), {})
+        self.assertGreaterEqual(found.peak, 10 * 1024 * 1024)
+
+        # Alone, a stage records its peak
+        with found.timer("match"):
+            bytearray(1024 * 1024)
+        self.assertGreaterEqual(found.peaks["match"], 1024 * 1024)
+        self.assertLess(found.peaks["match"], 10 * 1024 * 1024)
+
+        # With workers, the walk runs in the pool's task thread
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            for name in "ABCD":
+                d.joinpath(f"{name}.cls").write_text("FOO\n")
+            found = memprofile.MemProfile()
+            __main__.lint(
+                found.timed("walk", pathtools.walk([d])),
+                jobs=2,
+                metrics=found,
+                output=None,
+                validators=(TestMatchFiles.Foo,),
+            )
+        self.assertEqual(found.violations, {"Foo": 4})
+        self.assertTrue(found.processes)
+        self.assertTrue(all(p >= 0 for p in found.peaks.values()))
+
+    def test_parse_args(self):
+        class Case(NamedTuple):
+            args: Iterable[str]
+            command: str
+
+        for c in (
+            Case([], "lint"),
+            Case(["--shard", "2/3", "src"], "lint"),
+            Case(["merge", "1.json", "2.json"], "merge"),
+            Case(["./merge"], "lint"),
+        ):
+            with self.subTest(c):
+                self.assertEqual(
+                    __main__.parse_args(c.args).command, c.command
+                )
+
+        config = __main__.parse_args(["--files-from", "-"])
+        self.assertEqual(config.files, [])
+        self.assertEqual(__main__.parse_args([]).files, ["-"])
+
+        self.assertEqual(__main__.parse_shard("2/3"), (2, 3))
+        for value in ("0/3", "4/3", "3", "a/b"):
+            with self.subTest(value):
+                with self.assertRaises(argparse.ArgumentTypeError):
+                    __main__.parse_shard(value)
+
+        for args in (
+            ["--watch", "--results", "results.json", "src"],
+            ["--watch", "--shard", "1/2", "src"],
+        ):
+            with self.subTest(args), self.assertRaises(SystemExit):
+                __main__.parse_args(args)
+
+
+    def test_files_from(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "files")
+            with open(filename, mode="wb") as f:
+                f.write(b"B.cls\0C.cls\0")
+            config = __main__.parse_args(
+                ["A.cls", "--files-from", filename, "-0"]
+            )
+            self.assertEqual(
+                list(__main__.filenames(config)), ["A.cls", "B.cls", "C.cls"]
+            )
+
 
 class TestMatchLines(unittesttools.ValidatorTestCase):
     def test_no_context(self):
@@ -893,93 +1538,1988 @@ class TestMatchLines(unittesttools.ValidatorTestCase):
                     verbose=-1,
                 )
 
+    def test_noqa(self):
+        """`noqa` comments silence all or the named validators."""
+
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
 
-class TestPathtools(unittesttools.PathLikeTestCase):
-    def test_paths(self):
         class Case(NamedTuple):
-            filename: str
-            expected: os.PathLike
+            contents: str
+            suppress: bool
+            expected: Iterable[str]
 
         for c in (
-            Case("-", pathtools.stdin),
-            Case("./-", pathlib.Path("-")),
-            Case("Foo.cls", pathlib.Path("Foo.cls")),
+            Case("FOO // noqa", True, ()),
+            Case("FOO /* NOQA */", True, ()),
+            Case("FOO // noqa: Validator", True, ()),
+            Case("FOO // noqa: Other, validator", True, ()),
+            Case(
+                "FOO // noqa: Other",
+                True,
+                ("Foo.cls:1:0: error: Found FOO",),
+            ),
+            Case("FOO '// noqa'", True, ("Foo.cls:1:0: error: Found FOO",)),
+            Case("FOO // noqa", False, ("Foo.cls:1:0: error: Found FOO",)),
+            Case(
+                "FOO\n// apexlint: disable=Validator\nFOO\n"
+                "// apexlint: enable=Validator\nFOO",
+                True,
+                (
+                    "Foo.cls:1:0: error: Found FOO",
+                    "Foo.cls:5:0: error: Found FOO",
+                ),
+            ),
+            Case(
+                "// apexlint: disable\nFOO\nFOO",
+                True,
+                (),
+            ),
         ):
             with self.subTest(c):
-                self.assertSamePaths(
-                    pathtools.paths([c.filename]), [c.expected]
+                self.assertMatchLines(
+                    validator=Validator,
+                    contents=c.contents,
+                    expected=c.expected,
+                    suppress=c.suppress,
+                    verbose=-1,
                 )
 
-    def test_unique(self):
+    def test_token_validator(self):
+        """`TokenValidator.pattern` and `check` are respected."""
+
+        class Validator(base.TokenValidator):
+            """Found FOO"""
+
+            pattern = ("foo", "(")
+
+            @classmethod
+            def check(cls, tokens, i):
+                if tokens[i + 2].kind is lexer.Kind.STRING:
+                    return None
+                return tokens[i], tokens[i + 1]
+
         class Case(NamedTuple):
-            filenames: Iterable[str]
+            contents: str
             expected: Iterable[str]
 
         for c in (
-            Case([], []),
-            Case(["Foo.cls"], ["Foo.cls"]),
-            Case(["Foo.cls", "Bar.cls", "Foo.cls"], ["Foo.cls", "Bar.cls"]),
+            Case("foo", ()),
+            Case("foo('x')", ()),
+            Case("Foo(x)", ("Foo.cls:1:0: error: Found FOO",)),
+            Case("foo /* bar */ (x)", ("Foo.cls:1:0: error: Found FOO",)),
+            Case("foo\n(x)", ("Foo.cls:1:0: error: Found FOO",)),
+            Case("foo(x) // noqa: Validator", ()),
         ):
             with self.subTest(c):
-                self.assertSamePaths(
-                    pathtools.unique(pathlib.Path(n) for n in c.filenames),
-                    c.expected,
+                self.assertMatchLines(
+                    validator=Validator,
+                    contents=c.contents,
+                    expected=c.expected,
+                    verbose=-1,
                 )
 
-    def test_walk(self):
-        with tempfile.TemporaryDirectory() as dname:
-            d = pathlib.Path(dname)
 
-            # Populate test directory
-            for filename in ("-", "Foo.cls", "src/classes/Bar.cls"):
-                path = d.joinpath(filename)
-                path.parent.mkdir(parents=True, exist_ok=True)
-                path.touch(exist_ok=True)
+class TestTokens(unittest.TestCase):
+    # Generous, since the token validators take about three times as long
+    # as regexps on this source, which has a key every few lines
+    BUDGET = 6
+
+    def test_screened(self):
+        """Lexing only the lines that may start an error finds the same
+        errors as lexing every line.
+        """
+        rng = random.Random(0)
+        path = pathlib.Path("FooTest.cls")
+        for _ in range(500):
+            lines = fuzz.generate(rng)
+            with unittest.mock.patch.object(
+                base, "first_keys", return_value=None
+            ):
+                expected = list(
+                    match.lines(
+                        lines, path=path, validators=validators.library()
+                    )
+                )
+            with self.subTest(lines=lines):
+                self.assertEqual(
+                    list(
+                        match.lines(
+                            lines, path=path, validators=validators.library()
+                        )
+                    ),
+                    expected,
+                )
 
-            class Case(NamedTuple):
-                paths: Iterable[Union[pathlib.Path, str]]
-                expected: Iterable[Union[pathlib.Path, str]]
+    def test_speed(self):
+        """The token validators run within a budget of regexps that look
+        for the same keys.
+        """
+        tokenized = (
+            validators.NoObjectMapKeys,
+            validators.NoObjectSetMembers,
+            validators.NoFutureInTest,
+            validators.NoSeeAllData,
+            validators.NoTestMethod,
+        )
+        regexps = [
+            type(
+                v.__name__,
+                (base.Validator,),
+                dict(
+                    __doc__="Found",
+                    invalid=re.compile(
+                        r"\s*".join(map(re.escape, v.pattern)), flags=re.I
+                    ),
+                ),
+            )
+            for v in tokenized
+        ]
+        source = """\
+@isTest
+private class FooTest {
+    // Count the accounts
+    static Integer count(List<Account> accounts) {
+        Map<Id, Account> byId = new Map<Id, Account>(accounts);
+        String s = 'a /* string */';
+        for (Account a : accounts) {
+            s += a.Name;
+        }
+        return byId.size();
+    }
+}
+"""
+        lines = source.splitlines() * 200
+        path = pathlib.Path("FooTest.cls")
+
+        def timed(enabled):
+            best = None
+            for _ in range(3):
+                start = time.perf_counter()
+                list(match.lines(lines, path=path, validators=enabled))
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+
+        self.assertLess(timed(tokenized), timed(regexps) * self.BUDGET)
+
+
+class TestArchives(unittest.TestCase):
+    def test_archives(self):
+        class Validator(base.Validator):
+            """Found FOO"""
 
-                @staticmethod
-                def testdir(p: Union[pathlib.Path, str]) -> pathlib.Path:
-                    return p if isinstance(p, pathlib.Path) else d.joinpath(p)
+            filenames = ("*.cls",)
+            invalid = re.compile(r"FOO")
 
-            for c in (
-                Case([], []),
-                # Files
-                Case(["Foo.cls"], ["Foo.cls"]),
-                Case(["-"], ["-"]),
-                Case(["Missing.cls"], ["Missing.cls"]),
-                # Directory
-                Case(["src"], ["src/classes/Bar.cls"]),
-                Case(["missing/"], ["missing"]),
-                # Standard input
-                Case([pathtools.stdin], [pathtools.stdin]),
-            ):
-                with self.subTest(c):
-                    self.assertSamePaths(
-                        pathtools.walk(c.testdir(p) for p in c.paths),
-                        [c.testdir(p) for p in c.expected],
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            contents = {"src/Foo.cls": "\nFOO;\r\n", "README": "FOO"}
+            with zipfile.ZipFile(d / "deploy.zip", mode="w") as zf:
+                for name, text in contents.items():
+                    zf.writestr(name, text)
+            for mode, name in (("w", "deploy.tar"), ("w:gz", "deploy.tgz")):
+                with tarfile.open(d / name, mode=mode) as tf:
+                    for name, text in contents.items():
+                        info = tarfile.TarInfo(name)
+                        info.size = len(text)
+                        tf.addfile(info, io.BytesIO(text.encode("utf-8")))
+
+            for name in ("deploy.zip", "deploy.tar", "deploy.tgz"):
+                with self.subTest(name):
+                    archive = d / name
+                    members = list(pathtools.walk([archive]))
+                    self.assertEqual(
+                        [str(m) for m in members],
+                        [f"{archive}!/src/Foo.cls", f"{archive}!/README"],
+                    )
+                    # Workers are sent the member, not the archive
+                    members = pickle.loads(pickle.dumps(members))
+                    self.assertEqual(members[0].stat().st_size, 7)
+                    self.assertEqual(
+                        [
+                            str(m.location)
+                            for m in match.files(
+                                members, validators=(Validator,)
+                            )
+                        ],
+                        [f"{archive}!/src/Foo.cls:2:0"],
                     )
 
+            bad = d / "bad.zip"
+            bad.write_bytes(b"FOO")
+            self.assertEqual(list(pathtools.walk([bad])), [])
+            # Archives found in directories are plain files
+            self.assertIn(bad, list(pathtools.walk([d])))
+
+            missing = archives.Member(d / "deploy.zip", "Bar.cls", -1, 0)
+            (error,) = match.files([missing], validators=(Validator,))
+            self.assertIsInstance(error, OSError)
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git")
+class TestGitTree(unittest.TestCase):
+    def git(self, *args: str) -> None:
+        subprocess.run(
+            ["git", "-c", "user.name=a", "-c", "user.email=a@example.com"]
+            + ["-c", "commit.gpgsign=false"]
+            + list(args),
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+    def test_git_tree(self):
+        class Validator(base.Validator):
+            """Found FOO"""
 
-class TestPathtoolsStdIn(unittest.TestCase):
-    def test_equal(self):
-        self.assertEqual(pathtools.stdin, pathtools.stdin)
-        self.assertEqual(pathtools.StdIn(), pathtools.StdIn())
+            filenames = ("*.cls",)
+            invalid = re.compile(r"FOO")
 
-    def test_str(self):
-        self.assertEqual(repr(pathtools.stdin), "StdIn()")
-        self.assertEqual(str(pathtools.stdin), "<stdin>")
+        with tempfile.TemporaryDirectory() as tmpdir, pathtools.chdir(tmpdir):
+            d = pathlib.Path("src")
+            d.mkdir()
+            d.joinpath("A.cls").write_text("\nFOO;\n")
+            d.joinpath("Copy.cls").write_text("\nFOO;\n")
+            d.joinpath("B.cls").write_text("BAR;\n")
+            self.git("init", "-q")
+            self.git("add", ".")
+            self.git("commit", "-q", "-m", "Add")
+            # Staged, then changed again in the worktree
+            d.joinpath("B.cls").write_text("testMethod FOO;\n")
+            self.git("add", "src/B.cls")
+            d.joinpath("B.cls").write_text("BAR;\n")
+            d.joinpath("A.cls").unlink()
+
+            committed = list(gittree.blobs("HEAD"))
+            self.assertEqual(
+                [str(b) for b in committed],
+                ["HEAD:src/A.cls", "HEAD:src/B.cls", "HEAD:src/Copy.cls"],
+            )
+            self.assertEqual(committed[0].stat().st_size, 6)
+            staged = list(gittree.blobs(None, pathspecs=["src/B.cls"]))
+            self.assertEqual([str(b) for b in staged], [":src/B.cls"])
+            self.assertEqual(staged[0].stat().st_size, 16)
+            with self.assertRaises(OSError):
+                gittree.blobs("nope")
+
+            # Grouped by their directory in the tree, as files are
+            self.assertEqual(
+                [match.directory(b) for b in committed + staged],
+                ["src", "src", "src", "src"],
+            )
+            self.assertEqual(
+                match.directory(archives.Member(d / "a.zip", "A.cls", 0, 1)),
+                os.curdir,
+            )
+
+            # Workers are sent the blob, and read it by id
+            committed = pickle.loads(pickle.dumps(committed))
+            with unittest.mock.patch.object(
+                match, "lines", wraps=match.lines
+            ) as lines:
+                found = list(
+                    match.files(
+                        committed + staged, dedup=True, validators=(Validator,)
+                    )
+                )
+            self.assertEqual(
+                [str(m.location) for m in found],
+                [
+                    "HEAD:src/A.cls:2:0",
+                    "HEAD:src/Copy.cls:2:0",
+                    ":src/B.cls:1:11",
+                ],
+            )
+            # The same blob is only validated once
+            self.assertEqual(lines.call_count, 3)
+
+            # Relative to the root, like worktree files in the baseline
+            baseline = Baseline(pathlib.Path("baseline"))
+            self.assertEqual(
+                baseline.fingerprint(found[2]),
+                baseline.fingerprint(
+                    found[2]._replace(
+                        location=found[2].location._replace(
+                            path=pathlib.Path("src/B.cls")
+                        )
+                    )
+                ),
+            )
+
+            output = io.StringIO()
+            config = __main__.parse_args(
+                ["--staged", "--select", "NoTestMethod", "-j", "1"]
+            )
+            self.assertEqual(__main__.main(config, output=output), 1)
+            self.assertEqual(
+                output.getvalue().splitlines()[0],
+                ":src/B.cls:1:0: error: testMethod used instead of @isTest",
+            )
+
+        for args in (
+            ["--git-tree", "HEAD", "--staged"],
+            ["--staged", "--watch", "src"],
+        ):
+            with self.subTest(args), self.assertRaises(SystemExit):
+                __main__.parse_args(args)
 
-    def test_pathtools(self):
-        self.assertEqual(pathtools.stdin.is_dir(), False)
-        self.assertEqual(pathtools.stdin.open(), sys.stdin)
-        self.assertEqual(pathtools.stdin.resolve(), pathtools.stdin)
 
-    def test_typeof(self):
-        self.assertTrue(pathtools.StdIn.typeof(pathtools.stdin))
-        self.assertFalse(pathtools.StdIn.typeof(pathlib.Path("")))
+class TestSfdx(unittest.TestCase):
+    def test_project(self):
+        class Foo(base.Validator):
+            """Found FOO"""
+
+            filenames = ("*.cls",)
+            invalid = re.compile(r"FOO")
+
+        class Bar(Foo):
+            """Found BAR"""
+
+            invalid = re.compile(r"BAR")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            d.joinpath(sfdx.FILENAME).write_text(
+                json.dumps(
+                    {
+                        "packageDirectories": [
+                            {"path": "force-app", "default": True},
+                            {"path": "force-app/legacy"},
+                            {"path": "missing"},
+                        ],
+                        "plugins": {
+                            "apexlint": {
+                                "packages": {
+                                    "force-app/legacy": {"ignore": ["Foo"]}
+                                }
+                            }
+                        },
+                    }
+                )
+            )
+            for filename in (
+                "force-app/A.cls",
+                "force-app/legacy/B.cls",
+                ".sfdx/tools/C.cls",
+                "node_modules/D.cls",
+            ):
+                d.joinpath(filename).parent.mkdir(parents=True, exist_ok=True)
+                d.joinpath(filename).write_text("FOO BAR")
+
+            project = sfdx.Project.discover([d / "force-app", d])
+            self.assertEqual(
+                list(project.expand([d, pathlib.Path("E.cls")])),
+                [
+                    d / "force-app",
+                    d / "force-app/legacy",
+                    pathlib.Path("E.cls"),
+                ],
+            )
+            paths = list(
+                pathtools.unique(pathtools.walk(project.expand([d])))
+            )
+            self.assertEqual(
+                sorted(p.name for p in paths), ["A.cls", "B.cls"]
+            )
+
+            self.assertEqual(
+                sorted(
+                    (m.location.path.name, m.validator)
+                    for m in match.files(
+                        paths, project=project, validators=(Foo, Bar)
+                    )
+                ),
+                [("A.cls", "Bar"), ("A.cls", "Foo"), ("B.cls", "Bar")],
+            )
+
+            # The project of a file, or of a directory in it, is found by
+            # walking up from it
+            for path in (d / "force-app", d / "force-app/legacy/B.cls"):
+                with self.subTest(path=path):
+                    project = sfdx.Project.discover([path])
+                    self.assertEqual(
+                        list(project.roots), [os.path.abspath(d)]
+                    )
+                    self.assertEqual(
+                        [
+                            m.validator
+                            for m in match.files(
+                                [d / "force-app/legacy/B.cls"],
+                                project=project,
+                                validators=(Foo, Bar),
+                            )
+                        ],
+                        ["Bar"],
+                    )
+            self.assertIsNone(sfdx.Project.discover([d.parent]))
+
+
+class TestImports(unittest.TestCase):
+    # Generous, since the import time of the package is a few milliseconds
+    BUDGET = 0.1
+
+    def test_import_time(self):
+        """Importing the command line doesn't import modules it might not
+        use, and its own modules import within a budget.
+        """
+        package = os.path.dirname(os.path.abspath(__main__.__file__))
+        process = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                "import apexlint.__main__",
+            ],
+            cwd=os.path.dirname(package),
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        # Lines are "import time: <self us> | <cumulative us> | <module>"
+        imported = {}
+        for line in process.stderr.splitlines():
+            m = re.match(r"import time:\s*(\d+) \|\s*\d+ \| *(\S+)", line)
+            if m:
+                imported[m.group(2)] = int(m.group(1)) / 1e6
+
+        for module in (
+            "apexlint.watch",
+            "ctypes",
+            "hashlib",
+            "multiprocessing",
+            "tarfile",
+            "tracemalloc",
+            "zipfile",
+        ):
+            with self.subTest(module):
+                self.assertNotIn(module, imported)
+
+        own = sum(t for m, t in imported.items() if m.startswith("apexlint"))
+        self.assertLess(own, self.BUDGET)
+
+    def test_lazy_patterns(self):
+        compiled = []
+
+        def compile(pattern):
+            compiled.append(pattern)
+            return re.compile(pattern)
+
+        pattern = retools.lazy(compile, r"FOO")
+        self.assertEqual(compiled, [])
+        self.assertTrue(pattern.search("FOO"))
+        self.assertTrue(pattern.search("FOO"))
+        self.assertEqual(compiled, ["FOO"])
+        self.assertTrue(retools.comment(pattern).search("// FOO"))
+        for v in validators.library():
+            with self.subTest(v):
+                self.assertIsInstance(
+                    v.suppress, (type(None), retools.LazyPattern)
+                )
+
+
+class TestPlugins(unittest.TestCase):
+    def test_plugins(self):
+        class EntryPoint(NamedTuple):
+            name: str
+            value: object
+
+            def load(self):
+                if isinstance(self.value, Exception):
+                    raise self.value
+                return self.value
+
+        missing = plugins.Spec(
+            "NoMissing", "apexlint_missing_plugin:NoMissing", filenames=["*.x"]
+        )
+        builtin = plugins.Spec(
+            "NoTestMethod", "apexlint.validators:NoTestMethod"
+        )
+        self.assertEqual(
+            list(
+                plugins.load(
+                    [
+                        EntryPoint("a", [missing, "junk"]),
+                        EntryPoint("b", ImportError("broken")),
+                        EntryPoint("c", validators.NoSeeAllData),
+                    ]
+                )
+            ),
+            [missing, validators.NoSeeAllData],
+        )
+
+        with unittest.mock.patch.object(
+            plugins, "specs", return_value=(missing,)
+        ):
+            self.assertIn("NoMissing", validators.names())
+            self.assertEqual(
+                validators.library(select={"NoMissing"}), (missing,)
+            )
+
+        # Specs are only loaded for files they apply to
+        path = pathlib.Path("Foo.cls")
+        self.assertEqual(base.Validator.filter([missing], path=path), ())
+        with self.assertRaises(ImportError):
+            base.Validator.filter([missing], path=pathlib.Path("Foo.x"))
+        self.assertEqual(
+            base.Validator.filter([builtin], path=path),
+            (validators.NoTestMethod,),
+        )
+        # Workers are sent the Spec
+        self.assertEqual(
+            pickle.loads(pickle.dumps(missing)).target, missing.target
+        )
+
+
+class TestRules(unittest.TestCase):
+    INI = """\
+[NoSystemDebug]
+pattern = System\\.debug\\s*\\(
+filenames = *.cls
+message = System.debug left in code
+    Remove it before merging.
+
+[NoHardcodedId]
+pattern = '(?P<cursor>[a-zA-Z0-9]{15}(?:[a-zA-Z0-9]{3})?)'
+suppress = noqa-id
+message = Hardcoded Id {match[cursor]}
+"""
+
+    TOML = """\
+[NoSystemDebug]
+pattern = 'System\\.debug\\s*\\('
+filenames = ["*.cls"]
+message = \"\"\"System.debug left in code
+    Remove it before merging.\"\"\"
+
+[NoHardcodedId]
+pattern = "'(?P<cursor>[a-zA-Z0-9]{15}(?:[a-zA-Z0-9]{3})?)'"
+suppress = "noqa-id"
+message = "Hardcoded Id {match[cursor]}"
+"""
+
+    def load(self, filename: str, contents: str) -> Tuple[rules.Rule, ...]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir, filename)
+            path.write_text(contents)
+            return rules.load(path)
+
+    def test_load(self):
+        formats = [("rules.ini", self.INI)]
+        if sys.version_info >= (3, 11):
+            formats.append(("rules.toml", self.TOML))
+        for filename, contents in formats:
+            with self.subTest(filename):
+                found = self.load(filename, contents)
+                self.assertEqual(
+                    [r.__name__ for r in found],
+                    ["NoSystemDebug", "NoHardcodedId"],
+                )
+                self.assertEqual(found[0].filenames, ("*.cls",))
+                self.assertEqual(
+                    [
+                        str(m).splitlines()[0]
+                        for m in match.lines(
+                            [
+                                "System.debug('x');",
+                                "Id i = '001000000000001AAA';",
+                                "Id i = '001000000000001'; // noqa-id",
+                            ],
+                            path=pathlib.Path("Foo.cls"),
+                            validators=validators.library(
+                                select={"NoSystemDebug", "NoHardcodedId"},
+                                rules=found,
+                            ),
+                        )
+                    ],
+                    [
+                        "Foo.cls:1:0: error: System.debug left in code",
+                        "Foo.cls:2:8: error: Hardcoded Id 001000000000001AAA",
+                    ],
+                )
+
+    def test_errors(self):
+        class Case(NamedTuple):
+            contents: str
+            error: str
+
+        for c in (
+            Case("[No Foo]\npattern = x\nmessage = m\n", "not a valid"),
+            Case("[NoFoo]\nmessage = m\n", "missing pattern"),
+            Case("[NoFoo]\npattern = (\nmessage = m\n", "pattern: missing"),
+            Case("[NoFoo]\npattern = x\n", "missing message"),
+            Case("[NoFoo]\npattern = x\nmessage = {x}\n", "only format"),
+            Case("[NoFoo]\npattern = x\nmessage = m\nflags = i\n", "flags"),
+            Case("pattern = x\n", "no section headers"),
+        ):
+            with self.subTest(c):
+                with self.assertRaisesRegex(rules.RuleError, c.error):
+                    self.load("rules.ini", c.contents)
+
+        # As TOML may give them
+        for filenames in (5, [1], {"*.cls": True}):
+            with self.subTest(filenames=filenames):
+                with self.assertRaisesRegex(
+                    rules.RuleError, r"\[NoFoo\]: filenames must be a list"
+                ):
+                    rules.parse(
+                        "NoFoo",
+                        dict(pattern="x", message="m", filenames=filenames),
+                    )
+
+        found = self.load(
+            "rules.ini", "[NoTestMethod]\npattern = x\nmessage = m"
+        )
+        with self.assertRaisesRegex(rules.RuleError, "same name"):
+            validators.library(rules=found)
+        with self.assertRaises(SystemExit), unittest.mock.patch.object(
+            argparse.ArgumentParser, "print_usage"
+        ):
+            __main__.parse_args(["--rules", "missing.ini"])
+
+    def test_pickle(self):
+        """Workers are sent the rule, and compile it once."""
+        (rule,) = self.load("rules.ini", self.INI.split("\n\n")[0])
+        copy = pickle.loads(pickle.dumps(rule))
+        self.assertEqual(copy, rule)
+        self.assertIs(copy.load(), rule.load())
+        self.assertTrue(issubclass(rule.load(), base.Validator))
+        self.assertNotIn(rule.load(), validators.library())
+
+    def test_prefilter(self):
+        """Rules are matched together, with the same results."""
+        found = self.load("rules.ini", self.INI)
+        enabled = tuple(r.load() for r in found)
+        combined, screened = base.prefilter(enabled)
+        self.assertIsNotNone(combined)
+        self.assertEqual(screened, frozenset(enabled))
+
+        rng = random.Random(0)
+        lines = [fuzz.line(rng) for _ in range(200)]
+        lines += ["System.debug(1);", "'001000000000001AAA'"]
+        path = pathlib.Path("Foo.cls")
+        with unittest.mock.patch.object(
+            base, "prefilter", return_value=(None, frozenset())
+        ):
+            expected = list(match.lines(lines, path=path, validators=enabled))
+        self.assertEqual(len(expected), 2)
+        self.assertEqual(
+            list(match.lines(lines, path=path, validators=enabled)), expected
+        )
+
+
+class TestBacktracking(unittest.TestCase):
+    def test_check(self):
+        class Case(NamedTuple):
+            pattern: Pattern
+            expected: bool
+
+        for c in (
+            # Exponential
+            Case(re.compile(r"(a+)+b"), expected=True),
+            Case(re.compile(r"^(\w+\s?)+$"), expected=True),
+            Case(re.compile(r"(?:a|ab)*c"), expected=True),
+            # Quadratic, from searching at every start
+            Case(re.compile(r"\s*\("), expected=True),
+            # Cubic, only when the whole prefix is repeated
+            Case(re.compile(r"x.*y.*z"), expected=True),
+            # Linear
+            Case(re.compile(r"^System\.debug\s*\("), expected=False),
+            Case(re.compile(r"System\.debug\s*\("), expected=False),
+            Case(retools.comment("FOO"), expected=False),
+            Case(retools.not_string(r"\bfoo\b"), expected=False),
+            # Literal strings are escaped
+            Case(r"(a+)+b", expected=False),
+        ):
+            with self.subTest(c):
+                finding = backtracking.check(c.pattern)
+                self.assertEqual(finding is not None, c.expected, finding)
+
+    def test_library(self):
+        """No validator backtracks worse than linearly."""
+        found = [v.load() for v in validators.library()]
+        self.assertEqual(list(backtracking.validators(found)), [])
+
+    def test_reasons(self):
+        class Case(NamedTuple):
+            pattern: str
+            expected: List[str]
+
+        for c in (
+            Case(r"x(a+)+b", expected=["nested quantifiers overlap"]),
+            Case(r"x(\d|\w\w)*c", expected=["alternatives overlap"]),
+            Case(r"x\d*\w*y", expected=["adjacent quantifiers overlap"]),
+            Case(r"\s*\(", ["leading quantifier is tried at every start"]),
+            Case(r"x([^']*'[^']*')*y", expected=[]),
+        ):
+            with self.subTest(c):
+                analysis = backtracking.Analysis(re.compile(c.pattern))
+                self.assertEqual(analysis.reasons(), c.expected)
+
+    def test_rules(self):
+        """Rules that backtrack are reported when they are loaded."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir, "rules.ini")
+            path.write_text(
+                "[Nested]\npattern = ^(\\w+\\s?)+$\nmessage = Nested\n"
+                "[Flat]\npattern = ^\\w+$\nmessage = Flat\n"
+            )
+            with unittest.mock.patch.object(rules.log, "warning") as warning:
+                found = rules.load(path)
+        self.assertEqual([r.__name__ for r in found], ["Nested", "Flat"])
+        self.assertEqual(warning.call_count, 1)
+        self.assertIn("Nested.invalid", warning.call_args[0][0])
+
+
+class TestFuzz(unittest.TestCase):
+    def test_fuzz(self):
+        for name, engine in fuzz.ENGINES.items():
+            with self.subTest(name):
+                self.assertEqual(
+                    list(fuzz.fuzz(engine, iterations=50, seed=0)), []
+                )
+
+    def test_minimise(self):
+        def broken(lines, validators):
+            """Miss the errors on lines with quotes."""
+            found = fuzz.reference(lines, validators)
+            return [k for k in found if "'" not in k.source]
+
+        examples = list(fuzz.fuzz(broken, iterations=50, seed=0))
+        self.assertTrue(examples)
+        for example in examples:
+            with self.subTest(example):
+                (line,) = example.lines
+                self.assertIn("'", line)
+                self.assertEqual(len(example.expected), 1)
+                self.assertEqual(example.actual, [])
+
+
+class TestLimits(unittest.TestCase):
+    def test_lines(self):
+        class Stream(io.StringIO):
+            def readline(self, size=-1):
+                self.sizes.append(size)
+                return super().readline(size)
+
+        class Case(NamedTuple):
+            contents: str
+            max_line: Optional[int]
+            expected: List[Tuple[str, int, Optional[int]]]
+
+        for c in (
+            Case("", 4, []),
+            Case("ab\ncd", 4, [("ab\n", 0, None), ("cd", 0, None)]),
+            Case(
+                "abcdef\ng\n",
+                4,
+                [("abcd", 0, 2), ("cdef\n", 2, None), ("g\n", 0, None)],
+            ),
+            Case("abcd\ng", 4, [("abcd\n", 0, None), ("g", 0, None)]),
+            Case(
+                "abcdefg",
+                4,
+                [("abcd", 0, 2), ("cdef", 2, 2), ("efg", 4, None)],
+            ),
+            Case("abcdef", None, [("abcdef", 0, None)]),
+            # Windows start between tokens
+            Case("a bcdefg", 6, [("a bcde", 0, 2), ("bcdefg", 2, None)]),
+        ):
+            with self.subTest(c):
+                stream = Stream(c.contents)
+                stream.sizes = []
+                self.assertEqual(
+                    [
+                        (r, getattr(r, "column", 0), getattr(r, "owned", None))
+                        for r in limits.Limits(max_line=c.max_line).lines(
+                            stream
+                        )
+                    ],
+                    c.expected,
+                )
+                # Overlong lines are never read whole
+                if c.max_line:
+                    self.assertNotIn(-1, stream.sizes)
+
+    def test_windows(self):
+        """Find errors past the line length cap, once each."""
+
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+        line = "x" * 12009 + "FOO " + "y" * 1000 + "FOO"
+        stream = io.StringIO(f"FOO\n{line}\nFOO\n")
+        found = list(
+            match.lines(
+                limits.Limits(max_line=4000).lines(stream),
+                path=pathlib.Path("Foo.cls"),
+                validators=(Validator,),
+            )
+        )
+        self.assertEqual(
+            [(m.location.line, m.location.column) for m in found],
+            [(1, 0), (2, 12009), (2, 13013), (3, 0)],
+        )
+
+        # Token validators too, such as Map<Object, ...>
+        text = "x" * 12000 + " new Map<Object, Integer>();\n"
+        found = list(
+            match.lines(
+                limits.Limits(max_line=10000).lines(io.StringIO(text)),
+                path=pathlib.Path("Foo.cls"),
+                validators=(validators.NoObjectMapKeys,),
+            )
+        )
+        self.assertEqual(
+            [(m.location.line, m.location.column) for m in found],
+            [(1, 12009)],
+        )
+
+        # Errors that start before the next window are found once, even
+        # if their cursor is in it
+        class Cursor(base.Validator):
+            """Found BAR"""
+
+            invalid = re.compile(r"FOO\.(?P<cursor>BAR)")
+
+        line = " ".join(f"x{i} FOO.BAR" for i in range(200)) + "\n"
+        for max_line in (None, 16, 50, 2048):
+            with self.subTest(max_line=max_line):
+                found = list(
+                    match.lines(
+                        limits.Limits(max_line=max_line).lines(
+                            io.StringIO(line)
+                        ),
+                        path=pathlib.Path("Foo.cls"),
+                        validators=(Cursor,),
+                    )
+                )
+                self.assertEqual(
+                    [m.location.column for m in found],
+                    [m.start("cursor") for m in Cursor.invalid.finditer(line)],
+                )
+                self.assertEqual({m.source for m in found}, {line[:-1]})
+
+    def test_skip(self):
+        class Case(NamedTuple):
+            filename: str
+            contents: str
+            expected: Optional[str]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            for c in (
+                Case("Foo.cls", "class Foo {}", None),
+                Case(
+                    "Foo_Gen.cls",
+                    "class Foo {}",
+                    "generated, matches *_Gen.cls",
+                ),
+                Case("Big.cls", "x" * 101, "larger than 100 bytes"),
+                Case(
+                    "Marked.cls",
+                    "/*\n * @generated\n */\nclass Marked {}",
+                    "generated, marked '@generated'",
+                ),
+                Case(
+                    "Wsdl.cls",
+                    "//Generated by wsdl2apex\nclass Wsdl {}",
+                    "generated, marked 'Generated by wsdl2apex'",
+                ),
+                Case(
+                    "License.cls",
+                    "// Copyright. Do not edit this banner.\nclass L {}",
+                    None,
+                ),
+                Case("Str.cls", "String s = '@generated';", None),
+                Case("Late.cls", "\n" * 10 + "// @generated", None),
+                Case("Foo.txt", "// @generated", None),
+            ):
+                with self.subTest(c):
+                    path = d / c.filename
+                    path.write_text(c.contents)
+                    found = list(
+                        match.files(
+                            [path],
+                            limits=limits.Limits(
+                                max_bytes=100,
+                                generated=("*_Gen.cls",),
+                                markers=limits.MARKERS
+                                + ("Generated by wsdl2apex",),
+                            ),
+                            validators=(validators.NoTestMethod,),
+                        )
+                    )
+                    self.assertEqual(
+                        found,
+                        [] if c.expected is None else [
+                            limits.Skip(path, c.expected)
+                        ],
+                    )
+
+            # Nothing is skipped unless asked
+            self.assertEqual(limits.Limits().skip(d / "Big.cls"), None)
+            self.assertEqual(limits.Limits().marker(["// @generated"]), None)
+
+    def test_fail_on_skip(self):
+        """Fail a run that skipped files, if asked."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "Foo.cls"
+            path.write_text("// @generated\nclass Foo { testMethod }")
+
+            class Case(NamedTuple):
+                args: List[str]
+                expected: int
+
+            for c in (
+                Case([], 0),
+                Case(["--fail-on-skip"], 2),
+                Case(["--include-generated"], 1),
+            ):
+                with self.subTest(c):
+                    config = __main__.parse_args(
+                        c.args + ["--select", "NoTestMethod", str(path)]
+                    )
+                    self.assertEqual(
+                        __main__.main(
+                            config,
+                            output=io.StringIO(),
+                            output_count=io.StringIO(),
+                        ),
+                        c.expected,
+                    )
+
+
+class TestLsp(unittest.TestCase):
+    VALIDATORS = [v.load() for v in validators.library()]
+
+    def test_edit(self):
+        class Case(NamedTuple):
+            text: str
+            start: Tuple[int, int]
+            end: Tuple[int, int]
+            new: str
+            expected: List[str]
+            dirty: Tuple[int, int]
+
+        for c in (
+            Case("ab\ncd", (0, 1), (0, 1), "x", ["axb", "cd"], (0, 1)),
+            Case("ab\ncd", (0, 1), (1, 1), "", ["ad"], (0, 1)),
+            Case(
+                "ab\ncd",
+                (1, 0),
+                (1, 0),
+                "x\ny\n",
+                ["ab", "x", "y", "cd"],
+                (1, 4),
+            ),
+            Case("ab\r\ncd", (1, 2), (1, 2), "\r\n", ["ab", "cd", ""], (1, 3)),
+            # Characters are counted in UTF-16 code units
+            Case("\U0001f600a", (0, 2), (0, 3), "b", ["\U0001f600b"], (0, 1)),
+        ):
+            with self.subTest(c):
+                document = lsp.Document(
+                    "file:///Foo.cls", c.text, validators=self.VALIDATORS
+                )
+                document.relint()
+                document.edit(
+                    {
+                        "range": {
+                            "start": dict(zip(("line", "character"), c.start)),
+                            "end": dict(zip(("line", "character"), c.end)),
+                        },
+                        "text": c.new,
+                    }
+                )
+                self.assertEqual(document.lines, c.expected)
+                self.assertEqual(document.dirty, c.dirty)
+
+    def test_relint(self):
+        """Incremental validation agrees with validating the whole file."""
+        rng = random.Random(0)
+        for _ in range(100):
+            text = "\n".join(fuzz.generate(rng, lines=12))
+            # Only classes not named as tests depend on their scope
+            uri = rng.choice(("file:///FooTest.cls", "file:///Foo.cls"))
+            document = lsp.Document(uri, text, validators=self.VALIDATORS)
+            document.relint()
+            for _ in range(rng.randint(1, 3)):
+                n = len(document.lines)
+                start = sorted(
+                    (rng.randrange(n), rng.randrange(n)) for _ in range(2)
+                )
+                positions = [
+                    {"line": l, "character": rng.randint(0, 5)}
+                    for l, _ in start
+                ]
+                edit = {
+                    "range": {"start": positions[0], "end": positions[1]},
+                    "text": rng.choice(("", "\n")).join(
+                        (fuzz.line(rng), fuzz.line(rng))
+                    ),
+                }
+                if positions[0]["character"] > positions[1]["character"]:
+                    positions[1]["line"] = positions[0]["line"]
+                    positions[1]["character"] = positions[0]["character"]
+                with self.subTest(text=text, edit=edit):
+                    document.edit(edit)
+                    document.relint()
+                    expected = lsp.Document(
+                        document.uri,
+                        "\n".join(document.lines),
+                        validators=self.VALIDATORS,
+                    )
+                    expected.relint()
+                    self.assertEqual(document.publish(), expected.publish())
+
+    def test_relint_statement(self):
+        lines = ["class FooTest {"]
+        lines += [f"    Object x{i} = new Set<Object>();" for i in range(50)]
+        lines += ["}"]
+        document = lsp.Document(
+            "file:///FooTest.cls", "\n".join(lines), validators=self.VALIDATORS
+        )
+        document.relint()
+        self.assertEqual(len(document.publish()["diagnostics"]), 50)
+
+        # An edit to one statement validates that statement again
+        document.edit(
+            {
+                "range": {
+                    "start": {"line": 10, "character": 4},
+                    "end": {"line": 10, "character": 4},
+                },
+                "text": "Set<Object> y = new Set<\nObject>();",
+            }
+        )
+        with unittest.mock.patch.object(
+            lsp.match, "lines", wraps=match.lines
+        ) as validate:
+            document.relint()
+        (validated,), _ = validate.call_args
+        self.assertEqual(len(validated), 2)
+        self.assertEqual(len(document.publish()["diagnostics"]), 51)
+
+    def test_relint_scope(self):
+        """Statements validated again keep the scope they are in."""
+        lines = ["@isTest class Foo {"]
+        lines += [f"    Integer x{i} = {i};" for i in range(20)]
+        lines += ["}"]
+        document = lsp.Document(
+            "file:///Foo.cls", "\n".join(lines), validators=self.VALIDATORS
+        )
+        document.relint()
+        document.edit(
+            {
+                "range": {
+                    "start": {"line": 10, "character": 0},
+                    "end": {"line": 10, "character": 0},
+                },
+                "text": "    @future static void f() {}\n",
+            }
+        )
+        with unittest.mock.patch.object(
+            lsp.match, "lines", wraps=match.lines
+        ) as validate:
+            document.relint()
+        (validated,), _ = validate.call_args
+        self.assertEqual(len(validated), 2)
+        self.assertEqual(
+            [d["code"] for d in document.publish()["diagnostics"]],
+            ["NoFutureInTest"],
+        )
+
+    def test_server(self):
+        def message(method, params, **kwargs):
+            return dict(kwargs, jsonrpc="2.0", method=method, params=params)
+
+        uri = "file:///FooTest.cls"
+        messages = queue.Queue()
+        for m in (
+            message("initialize", {}, id=1),
+            message("initialized", {}),
+            message(
+                "textDocument/didOpen",
+                {
+                    "textDocument": {
+                        "uri": uri,
+                        "version": 1,
+                        "text": "class FooTest {\n}",
+                    }
+                },
+            ),
+            message(
+                "textDocument/didChange",
+                {
+                    "textDocument": {"uri": uri, "version": 2},
+                    "contentChanges": [
+                        {
+                            "range": {
+                                "start": {"line": 0, "character": 15},
+                                "end": {"line": 0, "character": 15},
+                            },
+                            "text": "\n    Object x = new Set<Object>();",
+                        }
+                    ],
+                },
+            ),
+            message("foo/bar", {}, id=2),
+            message("shutdown", None, id=3),
+            message("exit", None),
+        ):
+            # Framed and read back, as the server reads them
+            stream = io.BytesIO()
+            lsp.write(stream, m)
+            stream.seek(0)
+            (read,) = lsp.read(stream)
+            messages.put(read)
+
+        output = io.BytesIO()
+        server = lsp.Server(output, delay=0, validators=self.VALIDATORS)
+        self.assertEqual(server.run(messages), 0)
+        output.seek(0)
+        replies = list(lsp.read(output))
+
+        self.assertEqual(
+            [r.get("id", r.get("method")) for r in replies],
+            [
+                1,
+                "textDocument/publishDiagnostics",
+                "textDocument/publishDiagnostics",
+                2,
+                3,
+            ],
+        )
+        self.assertEqual(replies[1]["params"]["diagnostics"], [])
+        (diagnostic,) = replies[2]["params"]["diagnostics"]
+        self.assertEqual(replies[2]["params"]["version"], 2)
+        self.assertEqual(replies[3]["error"]["code"], lsp.METHOD_NOT_FOUND)
+        self.assertEqual(diagnostic["code"], "NoObjectSetMembers")
+        self.assertEqual(
+            diagnostic["range"],
+            {
+                "start": {"line": 1, "character": 23},
+                "end": {"line": 1, "character": 29},
+            },
+        )
+
+
+    def test_server_errors(self):
+        """Bad messages and failed requests are answered, and the server
+        goes on.
+        """
+        stream = io.BytesIO()
+        for body in (b"{not json", b"[1]"):
+            stream.write(b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+        for m in (
+            {"jsonrpc": "2.0", "id": 1, "method": "initialize"},
+            {"jsonrpc": "2.0", "id": 2, "method": "shutdown"},
+            {"jsonrpc": "2.0", "method": "exit"},
+        ):
+            lsp.write(stream, m)
+        stream.seek(0)
+        messages = queue.Queue()
+        for read in lsp.read(stream):
+            messages.put(read)
+
+        output = io.BytesIO()
+        server = lsp.Server(output, delay=0, validators=self.VALIDATORS)
+        with unittest.mock.patch.object(
+            server, "on_initialize", side_effect=RuntimeError("bug")
+        ):
+            self.assertEqual(server.run(messages), 0)
+        output.seek(0)
+        replies = list(lsp.read(output))
+
+        self.assertEqual(
+            [(r["id"], r.get("error", {}).get("code")) for r in replies],
+            [
+                (None, lsp.PARSE_ERROR),
+                (None, lsp.INVALID_REQUEST),
+                (1, lsp.INTERNAL_ERROR),
+                (2, None),
+            ],
+        )
+
+class TestTracing(unittest.TestCase):
+    class Events(tracing.Hooks):
+        def __init__(self):
+            self.events = []
+
+        def on_file_start(self, path):
+            self.events.append(("start", path.name))
+
+        def on_file_end(self, path, *, lines, bytes):
+            self.events.append(("end", path.name, lines, bytes))
+
+        def on_validator_time(self, path, validator, seconds):
+            self.events.append(("time", path.name, validator, seconds >= 0))
+
+        def on_message(self, message):
+            self.events.append(("message", str(message.location)))
+
+        def on_error(self, path, error):
+            self.events.append(("error", path.name))
+
+    class Foo(base.Validator):
+        """Found FOO"""
+
+        invalid = re.compile(r"(?P<cursor>FOO)")
+
+    class Bar(base.Validator):
+        """Found BAR"""
+
+        invalid = re.compile(r"BAR")
+
+    def test_lint(self):
+        """Hooks see the events of each file, from workers too."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            d.joinpath("A.cls").write_text("BAR FOO\nFOO\n")
+            paths = [d / "A.cls", d / "Missing.cls"]
+
+            for jobs in (1, 2):
+                with self.subTest(jobs=jobs):
+                    hooks = self.Events()
+                    messages, _ = __main__.lint(
+                        paths,
+                        hooks=hooks,
+                        jobs=jobs,
+                        output=None,
+                        validators=[self.Foo, self.Bar],
+                    )
+                    self.assertEqual(len(messages), 3)
+                    a = d / "A.cls"
+                    self.assertEqual(
+                        hooks.events,
+                        [
+                            ("start", "A.cls"),
+                            ("time", "A.cls", "Foo", True),
+                            ("time", "A.cls", "Bar", True),
+                            ("message", f"{a}:1:4"),
+                            ("message", f"{a}:1:0"),
+                            ("message", f"{a}:2:0"),
+                            ("end", "A.cls", 2, 12),
+                            ("error", "Missing.cls"),
+                        ],
+                    )
+
+    def test_unused(self):
+        """Without hooks, or with hooks that don't want validator times,
+        files are validated once.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            d.joinpath("A.cls").write_text("BAR FOO\nFOO\n")
+
+            class Messages(tracing.Hooks):
+                def on_message(self, message):
+                    pass
+
+            for hooks in (None, Messages()):
+                with self.subTest(hooks=hooks):
+                    with unittest.mock.patch.object(
+                        match, "lines", wraps=match.lines
+                    ) as validate, unittest.mock.patch.object(
+                        match, "_traced", wraps=match._traced
+                    ) as traced:
+                        found = list(
+                            match.files(
+                                [d / "A.cls"],
+                                hooks=hooks,
+                                validators=[self.Foo, self.Bar],
+                            )
+                        )
+                    self.assertEqual(len(found), 3)
+                    self.assertEqual(validate.call_count, 1)
+                    self.assertEqual(traced.called, hooks is not None)
+
+    def test_chain(self):
+        first, second = self.Events(), self.Events()
+        hooks = tracing.chain(None, first, second)
+        hooks.on_error(pathlib.Path("A.cls"), OSError())
+        self.assertEqual(first.events, [("error", "A.cls")])
+        self.assertEqual(second.events, [("error", "A.cls")])
+        self.assertIs(tracing.chain(None, first), first)
+        self.assertIsNone(tracing.chain(None))
+
+
+class TestResults(unittest.TestCase):
+    def messages(self):
+        class Foo(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"F(?P<cursor>OO)")
+
+        class Bar(base.Validator):
+            """Found BAR"""
+
+            invalid = re.compile(r"BAR")
+
+        for filename in ("A.cls", "B.cls"):
+            yield from match.lines(
+                ["FOO BAR", "", "BAR FOO FOO"] * 100,
+                path=pathlib.Path(filename),
+                validators=[Foo, Bar],
+            )
+
+    def test_location(self):
+        class Case(NamedTuple):
+            pattern: str
+            column: int
+            len: int
+            arrow: str
+
+        for c in (
+            Case(r"FOO", 2, 0, "  ^"),
+            Case(r"F(?P<cursor>OO)", 3, 2, "   ^~"),
+            Case(r"(?P<cursor>x)?FOO", -1, 0, "^"),
+        ):
+            with self.subTest(c):
+                location = base.Location.of(
+                    line=1,
+                    match=re.search(c.pattern, "  FOO"),
+                    path=pathlib.Path("A.cls"),
+                )
+                self.assertEqual(location.column, c.column)
+                self.assertEqual(location.len, c.len)
+                self.assertEqual(location.arrow, c.arrow)
+
+    def test_results(self):
+        messages = list(self.messages())
+        found = results.Results(messages)
+        self.assertEqual(len(found), 1000)
+        self.assertEqual(list(found), messages)
+        self.assertEqual(found[1], messages[1])
+        self.assertEqual(found.result(1).line, messages[1].location.line)
+
+        pickled = pickle.dumps(found)
+        self.assertEqual(pickle.loads(pickled), found)
+        # Each path, message and source line is pickled once
+        self.assertLess(len(pickled), len(pickle.dumps(messages)) / 3)
+
+        # As written to --results and read back by merge
+        data = json.loads(json.dumps(found.json()))
+        self.assertEqual(results.Results.from_json(data), found)
+
+    def test_group_by(self):
+        messages = list(self.messages())
+        found = results.Results(messages)
+
+        by_validator = found.group_by("validator")
+        self.assertEqual(list(by_validator), ["Foo", "Bar"])
+        self.assertEqual(
+            list(by_validator["Foo"]),
+            [m for m in messages if m.validator == "Foo"],
+        )
+        self.assertEqual(
+            found.counts("path"),
+            {pathlib.Path("A.cls"): 500, pathlib.Path("B.cls"): 500},
+        )
+        with self.assertRaises(ValueError):
+            found.group_by("line")
+
+
+def _task(value):
+    """A task for worker pools, that misbehaves as asked."""
+    if value == "slow":
+        time.sleep(60)
+    if value == "exit":
+        os._exit(3)
+    if value == "raise":
+        raise ValueError(value)
+    return value, os.getpid()
+
+
+class TestWorkers(unittest.TestCase):
+    class Slow(base.Validator):
+        """Found SLOW"""
+
+        invalid = re.compile(r"SLOW")
+
+        @classmethod
+        def errors(cls, line, *, suppress):
+            if "SLOW" in line:
+                time.sleep(60)
+            return super().errors(line, suppress=suppress)
+
+    def test_pool(self):
+        with workers.Pool(2, timeout=1) as pool:
+            found = list(pool.imap(_task, ["a", "slow", "exit", "b"]))
+        self.assertEqual([f[0] for f in found[::3]], ["a", "b"])
+        self.assertIsInstance(found[1], workers.TaskError)
+        self.assertEqual(str(found[1]), "slow: took longer than 1 seconds")
+        self.assertIsInstance(found[2], workers.TaskError)
+        self.assertEqual(str(found[2]), "exit: worker exited with status 3")
+
+    def test_worker_pool(self):
+        """One job has a worker, if it's to be replaced or given up on."""
+        with __main__.worker_pool(1) as pool:
+            self.assertIsNone(pool)
+        for options in (
+            workers.Options(max_tasks=2),
+            workers.Options(max_rss=1),
+            workers.Options(timeout=30),
+        ):
+            with self.subTest(options):
+                with __main__.worker_pool(1, options) as pool:
+                    found = list(pool.imap(_task, "abcde"))
+                self.assertEqual([f[0] for f in found], list("abcde"))
+                self.assertNotIn(os.getpid(), {pid for _, pid in found})
+
+    def test_raise(self):
+        with workers.Pool(1) as pool:
+            with self.assertRaises(ValueError):
+                list(pool.imap(_task, ["a", "raise"]))
+
+    def test_recycle(self):
+        class Case(NamedTuple):
+            options: workers.Options
+            pids: int
+
+        for c in (
+            Case(workers.Options(), 1),
+            Case(workers.Options(max_tasks=2), 3),
+            # Every worker uses more than a byte
+            Case(workers.Options(max_rss=1), 5),
+        ):
+            with self.subTest(c):
+                with workers.Pool(1, **c.options._asdict()) as pool:
+                    found = list(pool.imap(_task, "abcde"))
+                self.assertEqual([f[0] for f in found], list("abcde"))
+                self.assertEqual(len({pid for _, pid in found}), c.pids)
+
+    def test_lint(self):
+        """A file that takes too long is an error, and others go on."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            d.joinpath("A.cls").write_text("SLOW")
+            d.joinpath("B.cls").write_text("FOO")
+
+            start = time.monotonic()
+            messages, errors = __main__.lint(
+                [d / "A.cls", d / "B.cls"],
+                jobs=1,
+                output=None,
+                validators=[self.Slow],
+                worker_options=workers.Options(timeout=0.5),
+            )
+            self.assertLess(time.monotonic() - start, 30)
+            self.assertEqual(list(messages), [])
+            (error,) = errors
+            self.assertEqual(
+                str(error), f"{d / 'A.cls'}: took longer than 0.5 seconds"
+            )
+
+
+class TestBaseline(unittest.TestCase):
+    class Foo(base.Validator):
+        """Found FOO"""
+
+        invalid = re.compile(r"FOO")
+
+    def test_baseline(self):
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            foo = d / "src" / "Foo.cls"
+            foo.parent.mkdir()
+            foo.write_text("FOO;\nFOO;")
+
+            baseline = Baseline(d / "baseline.txt")
+            self.assertEqual(
+                __main__.update_baseline(
+                    [foo], baseline=baseline, jobs=1, validators=(Validator,)
+                ),
+                (2, []),
+            )
+            self.assertEqual(
+                (d / "baseline.txt").read_text().splitlines(),
+                ["Validator\tsrc/Foo.cls\t5558e8cd70713aa9"] * 2,
+            )
+
+            class Case(NamedTuple):
+                contents: str
+                expected: Iterable[str]
+
+            for c in (
+                Case("FOO;\nFOO;", []),
+                # Line numbers and whitespace don't matter
+                Case("\n  FOO ;\nFOO ;", []),
+                # Only the known number of errors are ignored
+                Case("FOO;\nFOO;\nFOO;", [f"{foo}:3:0"]),
+                # Other lines aren't ignored
+                Case("FOO;\nFOO();", [f"{foo}:2:0"]),
+            ):
+                with self.subTest(c):
+                    foo.write_text(c.contents)
+                    self.assertEqual(
+                        [
+                            str(m.location)
+                            for m in match.files(
+                                [foo],
+                                baseline=Baseline.open(d / "baseline.txt"),
+                                validators=(Validator,),
+                            )
+                        ],
+                        c.expected,
+                    )
+
+    def test_errors(self):
+        """A file that can't be read fails the update, which isn't saved,
+        and skipped files are reported.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            foo, generated = d / "Foo.cls", d / "Generated.cls"
+            foo.write_text("FOO;")
+            generated.write_text("// @generated\nFOO;")
+            saved = d / "baseline.txt"
+            saved.write_text("TestBaseline.Foo\tFoo.cls\t0123456789abcdef\n")
+
+            for jobs in (1, 2):
+                with self.subTest(jobs=jobs):
+                    skipped: List[limits.Skip] = []
+                    n, errors = __main__.update_baseline(
+                        [foo, d / "Missing.cls", generated],
+                        baseline=Baseline.open(saved),
+                        jobs=jobs,
+                        limits=limits.Limits(markers=limits.MARKERS),
+                        skipped=skipped,
+                        validators=(self.Foo,),
+                    )
+                    self.assertEqual(n, 1)
+                    self.assertEqual(len(errors), 1)
+                    self.assertIsInstance(errors[0], FileNotFoundError)
+                    self.assertEqual([s.path for s in skipped], [generated])
+                    self.assertIn("0123456789abcdef", saved.read_text())
+
+            config = __main__.parse_args(
+                [
+                    "--baseline",
+                    os.fspath(saved),
+                    "--select",
+                    "NoTestMethod",
+                    "--update-baseline",
+                    os.fspath(foo),
+                    os.fspath(d / "Missing.cls"),
+                ]
+            )
+            self.assertEqual(
+                __main__.main(
+                    config, output=io.StringIO(), output_count=io.StringIO()
+                ),
+                2,
+            )
+            self.assertIn("0123456789abcdef", saved.read_text())
+
+    def test_pickle(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "baseline.txt"
+            path.write_text("Validator\tFoo.cls\t0123456789abcdef\n")
+            data = pickle.dumps(Baseline.open(path))
+            self.assertNotIn(b"0123456789abcdef", data)
+            self.assertEqual(len(pickle.loads(data)), 1)
+
+
+class TestClassIndex(unittest.TestCase):
+    def test_classes(self):
+        class Case(NamedTuple):
+            contents: str
+            expected: Iterable[classindex.Class]
+
+        for c in (
+            Case("", []),
+            Case("class Foo {}", [classindex.Class("Foo", 1, 0, False)]),
+            Case(
+                "@isTest\nprivate class Foo {\n  class Bar {}\n}",
+                [
+                    classindex.Class("Foo", 2, 0, True),
+                    classindex.Class("Bar", 3, 1, False),
+                ],
+            ),
+            Case(
+                "@IsTest(SeeAllData=false) class Foo {",
+                [classindex.Class("Foo", 1, 0, True)],
+            ),
+            Case("Type t = Foo.class;", []),
+            Case("// @isTest class Foo", []),
+        ):
+            with self.subTest(c):
+                self.assertEqual(
+                    list(classindex.classes(c.contents.splitlines())),
+                    c.expected,
+                )
+
+    def test_update(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            test, other = d / "Checks.cls", d / "Other.cls"
+            test.write_text("@isTest class Checks {}")
+            other.write_text("class Other {}")
+
+            index = classindex.Index.open(d / "index.json")
+            self.assertEqual(index.update([test, other]), 2)
+            self.assertTrue(index.test(test))
+            self.assertFalse(index.test(other))
+            self.assertIsNone(index.test(d / "Missing.cls"))
+            index.save()
+
+            # Unchanged files are not indexed again
+            index = classindex.Index.open(d / "index.json")
+            self.assertEqual(index.update([test, other]), 0)
+
+            # Neither are files that were only touched
+            stat = other.stat()
+            os.utime(other, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertEqual(index.update([test, other]), 0)
+
+            other.write_text("@isTest class Other {}")
+            self.assertEqual(index.update([test, other]), 1)
+            self.assertTrue(index.test(other))
+
+            # Deleted files are dropped
+            other.unlink()
+            index.update([test])
+            self.assertIsNone(index.test(other))
+
+    def test_pickle(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            path = d / "Checks.cls"
+            path.write_text("@isTest class Checks {}")
+
+            index = classindex.Index.open(d / "index.json")
+            index.update([path])
+            index.save()
+
+            data = pickle.dumps(index)
+            self.assertNotIn(b"Checks", data)
+            self.assertTrue(pickle.loads(data).test(path))
+
+    def test_NoFutureInTest(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            test, other = d / "Checks.cls", d / "OtherTest.cls"
+            test.write_text("@isTest class Checks {\n@future void f() {}\n}")
+            other.write_text("class OtherTest {\n@future void f() {}\n}")
+
+            index = classindex.Index(d / "index.json")
+            index.update([test, other])
+            self.assertEqual(
+                [
+                    str(m.location)
+                    for m in match.files(
+                        [test, other],
+                        index=index,
+                        validators=(validators.NoFutureInTest,),
+                    )
+                ],
+                [f"{test}:2:0"],
+            )
+
+
+class TestLexer(unittest.TestCase):
+    def test_tokenize(self):
+        class Case(NamedTuple):
+            lines: Iterable[str]
+            expected: Iterable[tuple]
+
+        K = lexer.Kind
+        for c in (
+            Case([""], []),
+            Case(
+                ["new Map<Id, X>();"],
+                [
+                    (K.KEYWORD, "new"),
+                    (K.IDENTIFIER, "map"),
+                    (K.OPERATOR, "<"),
+                    (K.IDENTIFIER, "id"),
+                    (K.OPERATOR, ","),
+                    (K.IDENTIFIER, "x"),
+                    (K.OPERATOR, ">"),
+                    (K.OPERATOR, "("),
+                    (K.OPERATOR, ")"),
+                    (K.OPERATOR, ";"),
+                ],
+            ),
+            Case(["@ IsTest"], [(K.ANNOTATION, "@istest")]),
+            # Generics close one bracket at a time
+            Case(
+                ["List<List<Id>>"],
+                [
+                    (K.IDENTIFIER, "list"),
+                    (K.OPERATOR, "<"),
+                    (K.IDENTIFIER, "list"),
+                    (K.OPERATOR, "<"),
+                    (K.IDENTIFIER, "id"),
+                    (K.OPERATOR, ">"),
+                    (K.OPERATOR, ">"),
+                ],
+            ),
+            # Strings
+            Case(
+                ["'a\\'b' c"],
+                [(K.STRING, "'a\\'b'"), (K.IDENTIFIER, "c")],
+            ),
+            Case(["'a // b"], [(K.STRING, "'a // b")]),
+            # Double-quoted string aren't strings in Apex
+            Case(
+                ['"a"'],
+                [(K.OPERATOR, '"'), (K.IDENTIFIER, "a"), (K.OPERATOR, '"')],
+            ),
+            # Comments
+            Case(["a // b"], [(K.IDENTIFIER, "a"), (K.COMMENT, "// b")]),
+            Case(
+                ["a /* b", "c */ d"],
+                [
+                    (K.IDENTIFIER, "a"),
+                    (K.COMMENT, "/* b"),
+                    (K.COMMENT, "c */"),
+                    (K.IDENTIFIER, "d"),
+                ],
+            ),
+            Case(
+                ["/* '", "*/ a"],
+                [(K.COMMENT, "/* '"), (K.COMMENT, "*/"), (K.IDENTIFIER, "a")],
+            ),
+        ):
+            with self.subTest(c):
+                self.assertEqual(
+                    [(t.kind, t.key) for t in lexer.tokenize(c.lines)],
+                    c.expected,
+                )
+
+    def test_positions(self):
+        tokens = list(lexer.tokenize(["a  bc", " /* x", "*/ d"]))
+        self.assertEqual(
+            [(t.line, t.column, t.end) for t in tokens],
+            [(1, 0, 1), (1, 3, 5), (2, 1, 5), (3, 0, 2), (3, 3, 4)],
+        )
+
+    def test_scopes(self):
+        tokens = lexer.code(
+            lexer.tokenize(
+                [
+                    "@isTest(SeeAllData=false) class A {",
+                    "  @future void f() { x; }",
+                    "  int y;",
+                    "} z;",
+                ]
+            )
+        )
+        scopes = lexer.Scopes()
+        found = {}
+        for t in tokens:
+            if t.key in ("@future", "x", "y", "z"):
+                scope = scopes.scope
+                found[t.key] = (scope.depth, scope.annotations, scope.test)
+            scopes.advance(t)
+        self.assertEqual(
+            found,
+            {
+                "@future": (1, {"@istest"}, True),
+                "x": (2, {"@istest", "@future"}, True),
+                "y": (1, {"@istest"}, True),
+                "z": (0, set(), False),
+            },
+        )
+        self.assertEqual(lexer.Scopes(*scopes.state()).scope, scopes.scope)
+        self.assertTrue(lexer.Scopes(test_file=True).scope.test)
+
+    def test_type_arguments(self):
+        class Case(NamedTuple):
+            source: str
+            expected: Optional[Iterable[str]]
+
+        for c in (
+            Case("<Id>", ["id"]),
+            Case("<Id, List<X>>", ["id", "list<x>"]),
+            Case("<Schema.SObjectType, X[]>", ["schema.sobjecttype", "x[]"]),
+            Case("<>", None),
+            Case("<Id", None),
+            Case("< b && c >", None),
+            Case("< 'a' >", None),
+        ):
+            with self.subTest(c):
+                args = lexer.type_arguments(
+                    lexer.code(lexer.tokenize([c.source])), 0
+                )
+                self.assertEqual(
+                    args if args is None else [lexer.join(a) for a in args],
+                    c.expected,
+                )
+
+
+class TestPathtools(unittesttools.PathLikeTestCase):
+    def test_paths(self):
+        class Case(NamedTuple):
+            filename: str
+            expected: os.PathLike
+
+        for c in (
+            Case("-", pathtools.stdin),
+            Case("./-", pathlib.Path("-")),
+            Case("Foo.cls", pathlib.Path("Foo.cls")),
+        ):
+            with self.subTest(c):
+                self.assertSamePaths(
+                    pathtools.paths([c.filename]), [c.expected]
+                )
+
+    def test_unique(self):
+        class Case(NamedTuple):
+            filenames: Iterable[str]
+            expected: Iterable[str]
+
+        for c in (
+            Case([], []),
+            Case(["Foo.cls"], ["Foo.cls"]),
+            Case(["Foo.cls", "Bar.cls", "Foo.cls"], ["Foo.cls", "Bar.cls"]),
+        ):
+            with self.subTest(c):
+                self.assertSamePaths(
+                    pathtools.unique(pathlib.Path(n) for n in c.filenames),
+                    c.expected,
+                )
+
+    def test_names(self):
+        class Case(NamedTuple):
+            data: bytes
+            separator: bytes
+            expected: List[str]
+
+        for c in (
+            Case(b"", b"\n", []),
+            Case(b"Foo.cls", b"\n", ["Foo.cls"]),
+            Case(b"Foo.cls\nBar.cls\n", b"\n", ["Foo.cls", "Bar.cls"]),
+            Case(b"Foo.cls\n\nBar.cls", b"\n", ["Foo.cls", "Bar.cls"]),
+            Case(b"A b.cls\0C\nd.cls\0", b"\0", ["A b.cls", "C\nd.cls"]),
+        ):
+            for size in (1, 3, 1024):
+                with self.subTest(c, size=size):
+                    self.assertEqual(
+                        list(
+                            pathtools.names(
+                                io.BytesIO(c.data),
+                                separator=c.separator,
+                                size=size,
+                            )
+                        ),
+                        c.expected,
+                    )
+
+    def test_names_lazy(self):
+        """Each name is returned without reading the rest of the stream."""
+        stream = io.BytesIO(b"Foo.cls\nBar.cls\n")
+        names = pathtools.names(stream, size=8)
+        self.assertEqual(next(names), "Foo.cls")
+        self.assertEqual(stream.tell(), 8)
+        self.assertEqual(list(names), ["Bar.cls"])
+
+    def test_walk(self):
+        with tempfile.TemporaryDirectory() as dname:
+            d = pathlib.Path(dname)
+
+            # Populate test directory
+            for filename in ("-", "Foo.cls", "src/classes/Bar.cls"):
+                path = d.joinpath(filename)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch(exist_ok=True)
+
+            class Case(NamedTuple):
+                paths: Iterable[Union[pathlib.Path, str]]
+                expected: Iterable[Union[pathlib.Path, str]]
+
+                @staticmethod
+                def testdir(p: Union[pathlib.Path, str]) -> pathlib.Path:
+                    return p if isinstance(p, pathlib.Path) else d.joinpath(p)
+
+            for c in (
+                Case([], []),
+                # Files
+                Case(["Foo.cls"], ["Foo.cls"]),
+                Case(["-"], ["-"]),
+                Case(["Missing.cls"], ["Missing.cls"]),
+                # Directory
+                Case(["src"], ["src/classes/Bar.cls"]),
+                Case(["missing/"], ["missing"]),
+                # Standard input
+                Case([pathtools.stdin], [pathtools.stdin]),
+            ):
+                with self.subTest(c):
+                    self.assertSamePaths(
+                        pathtools.walk(c.testdir(p) for p in c.paths),
+                        [c.testdir(p) for p in c.expected],
+                    )
+
+    def test_shard(self):
+        with tempfile.TemporaryDirectory() as dname:
+            d = pathlib.Path(dname)
+            sizes = {"A.cls": 10, "B.cls": 7, "C.cls": 5, "D.cls": 4, "E": 1}
+            for filename, size in sizes.items():
+                d.joinpath(filename).write_text("x" * size)
+            paths = [d / f for f in sorted(sizes)]
+
+            self.assertEqual(
+                [
+                    [p.name for p in pathtools.shard(paths, index=i, count=2)]
+                    for i in (1, 2)
+                ],
+                [["A.cls", "D.cls"], ["B.cls", "C.cls", "E"]],
+            )
+
+            # The order of paths doesn't matter
+            self.assertEqual(
+                [
+                    p.name
+                    for p in pathtools.shard(
+                        reversed(paths), index=1, count=2
+                    )
+                ],
+                ["D.cls", "A.cls"],
+            )
+
+            # Every path is in exactly one shard
+            for count in (1, 3, 7):
+                with self.subTest(count=count):
+                    self.assertCountEqual(
+                        [
+                            p
+                            for i in range(1, count + 1)
+                            for p in pathtools.shard(
+                                paths, index=i, count=count
+                            )
+                        ],
+                        paths,
+                    )
+
+
+class TestPathtoolsStdIn(unittest.TestCase):
+    def test_equal(self):
+        self.assertEqual(pathtools.stdin, pathtools.stdin)
+        self.assertEqual(pathtools.StdIn(), pathtools.StdIn())
+
+    def test_str(self):
+        self.assertEqual(repr(pathtools.stdin), "StdIn()")
+        self.assertEqual(str(pathtools.stdin), "<stdin>")
+
+    def test_pathtools(self):
+        self.assertEqual(pathtools.stdin.is_dir(), False)
+        self.assertEqual(pathtools.stdin.open(), sys.stdin)
+        self.assertEqual(pathtools.stdin.resolve(), pathtools.stdin)
+
+    def test_typeof(self):
+        self.assertTrue(pathtools.StdIn.typeof(pathtools.stdin))
+        self.assertFalse(pathtools.StdIn.typeof(pathlib.Path("")))
 
 
 class TestRetools(unittest.TestCase):
@@ -1039,6 +3579,9 @@ class TestRetools(unittest.TestCase):
             Case(r"ok", string=r"/* ok */", expected=True),
             Case(r"ok", string=r"/* */ ok", expected=False),
             Case(r"ok", string=r"/* /* */ ok", expected=False),
+            Case(r"ok", string=r"/* /* ok */", expected=True),
+            # The comment continues on the next line
+            Case(r"ok", string=r"/* ok", expected=True),
             # C++-style comment
             Case(r"ok", string=r"// ok", expected=True),
             # Not in comment
@@ -1089,6 +3632,188 @@ class TestRetools(unittest.TestCase):
                 )
                 assertExpected(retools.not_string(c.pattern).search(c.string))
 
+    def test_union(self):
+        """A union matches a line if any of its patterns does."""
+        patterns = [
+            retools.comment("FOO"),
+            retools.not_string(r"\bbar\b", flags=re.IGNORECASE),
+            re.compile(r"(?P<cursor>Set)<Object>"),
+            re.compile(r"^ x  # verbose, to the end", re.VERBOSE),
+        ]
+        union = retools.union(patterns)
+        self.assertIsNotNone(union)
+        rng = random.Random(0)
+        lines = [fuzz.line(rng) for _ in range(500)]
+        lines += ["// FOO", "BAR;", "'bar'", "x", " x", "Set<Object>"]
+        for line in lines:
+            with self.subTest(line=line):
+                self.assertEqual(
+                    bool(union.search(line)),
+                    any(p.search(line) for p in patterns),
+                )
+
+        # Patterns that refer to groups can't be combined
+        for pattern in (r"(?P<a>x)(?P=a)", r"(x)\1", r"(x)?(?(1)y|z)"):
+            with self.subTest(pattern=pattern):
+                self.assertIsNone(
+                    retools.union([patterns[0], re.compile(pattern)])
+                )
+
+
+class TestSuppressions(unittest.TestCase):
+    def test_suppressed(self):
+        index = suppression.Suppressions.parse(
+            [
+                "a; // noqa",  # 1
+                "b; // noqa: Foo, Bar",  # 2
+                "// apexlint: disable=Foo",  # 3
+                "c;",  # 4
+                "// apexlint: disable",  # 5
+                "d;",  # 6
+                "// apexlint: enable",  # 7
+                "e;",  # 8
+                "'// noqa'",  # 9
+                "// apexlint: disable=Baz",  # 10
+            ]
+        )
+
+        class Case(NamedTuple):
+            lineno: int
+            name: str
+            expected: bool
+
+        for c in (
+            Case(1, "Foo", True),
+            Case(1, "Baz", True),
+            Case(2, "foo", True),
+            Case(2, "Bar", True),
+            Case(2, "Baz", False),
+            Case(3, "Foo", True),
+            Case(4, "Foo", True),
+            Case(4, "Bar", False),
+            Case(6, "Bar", True),
+            Case(7, "Foo", False),
+            Case(8, "Foo", False),
+            Case(8, "Baz", False),
+            Case(9, "Foo", False),
+            Case(11, "Baz", True),
+            Case(11, "Foo", False),
+        ):
+            with self.subTest(c):
+                self.assertEqual(
+                    index.suppressed(c.lineno, c.name), c.expected
+                )
+
+    def test_all(self):
+        index = suppression.Suppressions.parse(
+            ["// noqa", "// noqa: Foo", "/* apexlint: disable */", "a;"]
+        )
+        self.assertEqual(
+            [index.all(n) for n in range(1, 5)], [True, False, True, True]
+        )
+
+    def test_empty(self):
+        self.assertFalse(suppression.Suppressions.parse(["a;", "b;"]))
+
+
+class TestWatch(unittest.TestCase):
+    def test_session(self):
+        class Validator(base.Validator):
+            """Found FOO"""
+
+            invalid = re.compile(r"FOO")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            foo, bar = (pathlib.Path(tmpdir) / n for n in ("Foo.cls", "Bar"))
+            foo.write_text("FOO")
+            bar.write_text("FOO")
+
+            session = watch.Session(validators=(Validator,), verbose=-1)
+            self.assertEqual(
+                session.relint([foo, bar]),
+                ([f"{foo}:1:0: error: Found FOO"], []),
+            )
+
+            foo.write_text("\nFOO FOO")
+            self.assertEqual(
+                session.relint([foo]),
+                (
+                    [
+                        f"{foo}:2:0: error: Found FOO",
+                        f"{foo}:2:4: error: Found FOO",
+                    ],
+                    [f"{foo}:1:0: error: Found FOO"],
+                ),
+            )
+            self.assertEqual(session.count, 2)
+
+            foo.unlink()
+            self.assertEqual(session.relint([foo])[0], [])
+            self.assertEqual(session.count, 0)
+
+            # Files the limits skip, as in any other run, have no errors
+            session = watch.Session(
+                limits=limits.Limits(max_bytes=4, markers=limits.MARKERS),
+                validators=(Validator,),
+                verbose=-1,
+            )
+            bar.rename(bar.with_suffix(".cls"))
+            bar = bar.with_suffix(".cls")
+            foo.write_text("// @generated\nFOO")
+            self.assertEqual(
+                session.relint([foo, bar]),
+                ([f"{bar}:1:0: error: Found FOO"], []),
+            )
+            bar.write_text("FOO FOO")
+            self.assertEqual(
+                session.relint([bar]), ([], [f"{bar}:1:0: error: Found FOO"])
+            )
+
+    def test_diff(self):
+        self.assertEqual(
+            list(watch.diff(["a\n b"], ["c"])), ["- c", "+ a\n+  b"]
+        )
+
+    def test_polling(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            foo = d / "Foo.cls"
+            foo.write_text("")
+
+            watcher = watch.PollingWatcher([d], interval=0.01)
+            self.assertEqual(watcher.poll(), set())
+
+            foo.write_text("FOO")
+            bar = d / "src" / "Bar.cls"
+            bar.parent.mkdir()
+            bar.write_text("")
+            self.assertEqual(watcher.wait(timeout=0), {foo, bar})
+
+            foo.unlink()
+            self.assertEqual(watcher.wait(timeout=0), {foo})
+            self.assertEqual(watcher.wait(timeout=0.02), set())
+
+    @unittest.skipUnless(
+        watch.InotifyWatcher.available(), "inotify is not available"
+    )
+    def test_inotify(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            d = pathlib.Path(tmpdir)
+            foo = d / "Foo.cls"
+            foo.write_text("")
+
+            with watch.InotifyWatcher([d]) as watcher:
+                self.assertEqual(watcher.wait(timeout=0), set())
+
+                foo.write_text("FOO")
+                self.assertEqual(watcher.wait(timeout=1), {foo})
+
+                bar = d / "src" / "Bar.cls"
+                bar.parent.mkdir()
+                self.assertEqual(watcher.wait(timeout=1), set())
+                bar.write_text("")
+                self.assertEqual(watcher.wait(timeout=1), {bar})
+
 
 class TestTermInfo(unittest.TestCase):
     @staticmethod
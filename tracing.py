@@ -0,0 +1,135 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import pathlib
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from . import base
+
+# The callbacks of Hooks, in the order they are called for a file
+EVENTS = (
+    "on_file_start",
+    "on_validator_time",
+    "on_message",
+    "on_error",
+    "on_file_end",
+)
+
+
+class Hooks:
+    """Callbacks on the progress of `match.files`, to embed or instrument
+    it. Override the ones you need; the others do nothing, and what they
+    would measure isn't measured.
+    Without hooks, `match.files` runs as if they didn't exist.
+    """
+
+    def on_file_start(self, path: pathlib.Path) -> None:
+        pass
+
+    def on_file_end(
+        self, path: pathlib.Path, *, lines: int, bytes: int
+    ) -> None:
+        pass
+
+    def on_validator_time(
+        self, path: pathlib.Path, validator: str, seconds: float
+    ) -> None:
+        """Called after a file with the time each validator took on it.
+        Overriding this validates the file once per validator.
+        """
+
+    def on_message(self, message: base.Message) -> None:
+        pass
+
+    def on_error(self, path: pathlib.Path, error: Exception) -> None:
+        pass
+
+    def wants(self, event: str) -> bool:
+        """Return whether `event` is overridden, and worth measuring."""
+        return getattr(type(self), event) is not getattr(Hooks, event)
+
+
+class Chain(Hooks):
+    """Call each of several hooks in turn."""
+
+    def __init__(self, *hooks: Hooks) -> None:
+        self.hooks = hooks
+        for event in EVENTS:
+            wanted = [getattr(h, event) for h in hooks if h.wants(event)]
+            if wanted:
+                setattr(self, event, _each(wanted))
+
+    def wants(self, event: str) -> bool:
+        return any(h.wants(event) for h in self.hooks)
+
+
+def _each(callbacks):
+    def each(*args, **kwargs):
+        for callback in callbacks:
+            callback(*args, **kwargs)
+
+    return each
+
+
+def chain(*hooks: Optional[Hooks]) -> Optional[Hooks]:
+    """Return hooks calling each of `hooks` that isn't None, if any."""
+    found = [h for h in hooks if h is not None]
+    if len(found) < 2:
+        return found[0] if found else None
+    return Chain(*found)
+
+
+def wanted(hooks: Optional[Hooks]) -> FrozenSet[str]:
+    """Return the events that `hooks` overrides."""
+    if hooks is None:
+        return frozenset()
+    return frozenset(e for e in EVENTS if hooks.wants(e))
+
+
+Event = Tuple[str, Tuple, Dict[str, Any]]
+
+
+class Recorder(Hooks):
+    """Record the `events` wanted by hooks in another process, to be sent
+    back and replayed on them.
+    """
+
+    def __init__(self, events: FrozenSet[str]) -> None:
+        self.events = events
+        self.recorded: List[Event] = []
+        for event in events:
+            setattr(self, event, self._recorder(event))
+
+    def _recorder(self, event: str):
+        def record(*args, **kwargs):
+            self.recorded.append((event, args, kwargs))
+
+        return record
+
+    def wants(self, event: str) -> bool:
+        return event in self.events
+
+    def replay(self, hooks: Hooks) -> None:
+        for event, args, kwargs in self.recorded:
+            getattr(hooks, event)(*args, **kwargs)
+
+    def __getstate__(self):
+        return self.events, self.recorded
+
+    def __setstate__(self, state):
+        self.__init__(state[0])
+        self.recorded = state[1]
+
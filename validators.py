@@ -14,82 +14,90 @@
 # implied. See the License for the specific language governing
 # permissions and limitations under the License.
 #
-import operator
-import re
-from typing import AbstractSet, Iterable, Type
-
-from . import base, retools
-
-
-BASE_TYPES = r"""
-           (
-               (System\.)?  # Base types are in System namespace
-               (
-                   Blob
-                   | Boolean
-                   | Date
-                   | DateTime
-                   | Decimal
-                   | Double
-                   | Id
-                   | Integer
-                   | Long
-                   | String
-                   | Time
-                   | Type
-               )
-           |
-               (Schema\.)?  # SObject schema namespace
-               (SObjectField|SObjectType)
-           )
-           """
-
-
-class NoObjectMapKeys(base.Validator):
+from typing import AbstractSet, Iterable, Optional, Sequence, Tuple, Type
+
+from . import base, lexer, plugins, retools
+from .rules import Rule, RuleError
+
+
+# Base types are immutable, so they are safe Map keys and Set members.
+BASE_TYPES = frozenset(
+    namespace + name
+    for namespace, names in (
+        # Base types are in System namespace
+        (
+            "system.",
+            (
+                "blob",
+                "boolean",
+                "date",
+                "datetime",
+                "decimal",
+                "double",
+                "id",
+                "integer",
+                "long",
+                "string",
+                "time",
+                "type",
+            ),
+        ),
+        # SObject schema namespace
+        ("schema.", ("sobjectfield", "sobjecttype")),
+    )
+    for namespace in (namespace, "")
+    for name in names
+)
+
+
+def mutable_type_argument(
+    tokens: Sequence[lexer.Token], i: int, *, n: int
+) -> Optional[Tuple[lexer.Token, lexer.Token]]:
+    """Return the `n`th type argument of the generic at `tokens[i]`,
+    unless it is one of the `BASE_TYPES`.
+    """
+    args = lexer.type_arguments(tokens, i)
+    if not args or len(args) <= n:
+        return None
+    arg = args[n]
+    if lexer.join(arg) in BASE_TYPES:
+        return None
+    return arg[0], arg[-1]
+
+
+class NoObjectMapKeys(base.TokenValidator):
     """Map key might be mutable
     See https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md
     """
 
-    invalid = retools.not_string(
-        fr"""
-        \b
-        new\s+ (?:Map)\s*<\s*     # "new Map<"
-        (?!{ BASE_TYPES })      # Exclude these valid base types
-        (?P<cursor>          # Capture key name
-            .+?
-        )
-        \s*\,                # Type ends with comma
-        """,
-        flags=(re.IGNORECASE | re.VERBOSE),
-    )
-    suppress = retools.comment(
-        "https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md"
+    pattern = ("new", "map", "<")
+    suppress = retools.lazy(
+        retools.comment,
+        "https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md",
     )
 
+    @classmethod
+    def check(cls, tokens, i):
+        return mutable_type_argument(tokens, i + 2, n=0)
 
-class NoObjectSetMembers(base.Validator):
+
+class NoObjectSetMembers(base.TokenValidator):
     """Set member might be mutable
     See https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md
     """
 
-    invalid = retools.not_string(
-        fr"""
-        \b
-        new\s+ (?:Set)\s*<\s*     # "new Set<"
-        (?!{ BASE_TYPES })      # Exclude these valid base types
-        (?P<cursor>          # Capture member name
-            .+?
-        )
-        \s*>                 # Type ends with angle bracket
-        """,
-        flags=(re.IGNORECASE | re.VERBOSE),
-    )
-    suppress = retools.comment(
-        "https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md"
+    pattern = ("new", "set", "<")
+    suppress = retools.lazy(
+        retools.comment,
+        "https://github.com/quantcast/apexlint/blob/master/MAPS-AND-SETS.md",
     )
 
+    @classmethod
+    def check(cls, tokens, i):
+        return mutable_type_argument(tokens, i + 2, n=0)
 
-class NoFutureInTest(base.Validator):
+
+class NoFutureInTest(base.TokenValidator):
     """@future used in test class
     The use of @future in Tests is forbidden because:
       1. Futures are scheduled in a small finite queue.
@@ -98,18 +106,16 @@ class NoFutureInTest(base.Validator):
     Use Test.startTest() and Test.stopTest() to avoid "Too Many SOQL Queries"
     """
 
-    filenames = ("*Test.cls", "TestUtils.cls", "UnitTestFactory.cls")
-    invalid = retools.not_string(
-        r"""
-        (?P<cursor>
-            @\s*future
-        )
-        """,
-        flags=(re.IGNORECASE | re.VERBOSE),
-    )
+    filenames = ("*.cls",)
+    pattern = ("@future",)
+
+    @classmethod
+    def in_scope(cls, scope):
+        # In a test class or method, by annotation or by filename
+        return scope.test
 
 
-class NoSeeAllData(base.Validator):
+class NoSeeAllData(base.TokenValidator):
     """SeeAllData used in @isTest
     The use of SeeAllData is forbidden because:
       1. Row-locking conflicts can cause processes and deployments to fail.
@@ -117,53 +123,76 @@ class NoSeeAllData(base.Validator):
       3. SeeAllData=false doesn't do anything in classes where SeeAllData=true.
     """
 
-    invalid = retools.not_string(
-        r"""
-        @\s*isTest
-        \s*\(
-        [^)]*
-        (?P<cursor>              # Capture SeeAllData=true
-            \b
-            SeeAllData
-            \s*=
-            .*?
-        )
-        \s*
-        [,)]
-        """,
-        flags=(re.IGNORECASE | re.VERBOSE),
-    )
+    pattern = ("@istest", "(")
+
+    @classmethod
+    def check(cls, tokens, i):
+        # Find the SeeAllData argument, up to the closing parenthesis
+        depth = 0
+        for j in range(i + 1, len(tokens)):
+            key = tokens[j].key
+            if key == "(":
+                depth += 1
+            elif key == ")":
+                depth -= 1
+                if depth == 0:
+                    return None
+            elif key == "seealldata" and depth == 1:
+                break
+        else:
+            return None
+
+        # The argument ends before the next comma or closing parenthesis
+        for k in range(j + 1, len(tokens)):
+            if tokens[k].key in (",", ")"):
+                return tokens[j], tokens[k - 1]
+        return None
+
+
+class NoTestMethod(base.TokenValidator):
+    """testMethod used instead of @isTest"""
 
+    pattern = ("testmethod",)
 
-class NoTestMethod(base.Validator):
-    """testMethod used instead of @isTest"""
 
-    invalid = re.compile(
-        r"""
-        \b
-        (?P<cursor>
-            testMethod
-        )
-        \b
-        """,
-        flags=(re.IGNORECASE | re.VERBOSE),
-    )
+def subclasses(cls: Type) -> Iterable[Type]:
+    """Return all recursive subclasses of `cls`"""
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from subclasses(subclass)
 
 
 def library(
     *,
     select: AbstractSet[str] = frozenset(),
     ignore: AbstractSet[str] = frozenset(),
-) -> Iterable[Type[base.Validator]]:
-    """Return a tuple of all Validator implementations"""
-    enabled = base.Validator.__subclasses__()
+    rules: Iterable[Rule] = (),
+) -> Iterable[plugins.Validator]:
+    """Return a tuple of all Validator implementations, sorted by name.
+    Plugin validators are returned as a `plugins.Spec` until they are
+    imported, and only those enabled for a file are ever imported.
+    `rules` from a rules file are added, and may not replace any other.
+    """
+    enabled = {v.__name__: v for v in plugins.specs()}
+    enabled.update(
+        (v.__name__, v)
+        for v in subclasses(base.Validator)
+        # Skip abstract validators, and the classes of rules
+        if v.__module__ not in (base.__name__, Rule.__module__)
+    )
+    for rule in rules:
+        if rule.__name__ in enabled:
+            raise RuleError(
+                f"[{rule.__name__}]: a validator has the same name"
+            )
+        enabled[rule.__name__] = rule
     if select:
-        enabled = [v for v in enabled if v.__name__ in select]
+        enabled = {n: v for n, v in enabled.items() if n in select}
     if ignore:
-        enabled = [v for v in enabled if v.__name__ not in ignore]
-    return tuple(sorted(enabled, key=operator.attrgetter("__name__")))
+        enabled = {n: v for n, v in enabled.items() if n not in ignore}
+    return tuple(v for _, v in sorted(enabled.items()))
 
 
-def names() -> Iterable[str]:
+def names(rules: Iterable[Rule] = ()) -> Iterable[str]:
     """Return a tuple of all Validator names"""
-    return tuple(v.__name__ for v in library())
+    return tuple(v.__name__ for v in library(rules=rules))
@@ -0,0 +1,381 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import abc
+import ctypes
+import ctypes.util
+import functools
+import logging
+import os
+import pathlib
+import select
+import struct
+import sys
+import textwrap
+import time
+from typing import (
+    IO,
+    AbstractSet,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
+
+from . import PROGNAME, base, classindex, match, pathtools, sfdx, terminfo
+from .baseline import Baseline
+from .limits import Limits, Skip
+
+log = logging.getLogger(__name__)
+
+
+class Watcher(abc.ABC):
+    """Produce the set of paths that changed under `roots` after each edit.
+    Bursts of changes within `delay` seconds are reported together.
+    """
+
+    def __init__(
+        self, roots: Sequence[pathlib.Path], *, delay: float = 0.1
+    ) -> None:
+        self.roots = roots
+        self.delay = delay
+
+    def __iter__(self) -> Iterator[AbstractSet[pathlib.Path]]:
+        while True:
+            changed = self.wait(timeout=None)
+            # Debounce: collect changes until there is a quiet period
+            while True:
+                more = self.wait(timeout=self.delay)
+                if not more:
+                    break
+                changed |= more
+            if changed:
+                yield changed
+
+    @abc.abstractmethod
+    def wait(self, *, timeout: Optional[float]) -> Set[pathlib.Path]:
+        """Return the paths that changed, waiting at most `timeout`."""
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PollingWatcher(Watcher):
+    """Find changes by comparing the stat of every file every `interval`."""
+
+    def __init__(
+        self,
+        roots: Sequence[pathlib.Path],
+        *,
+        delay: float = 0.1,
+        interval: float = 1.0,
+    ) -> None:
+        super().__init__(roots, delay=delay)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self) -> Dict[pathlib.Path, Tuple[int, int]]:
+        snapshot = {}
+        for path in pathtools.walk(self.roots):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def poll(self) -> Set[pathlib.Path]:
+        """Return the paths that changed since the last poll."""
+        previous, self.snapshot = self.snapshot, self.scan()
+        return {
+            path
+            for path in previous.keys() | self.snapshot.keys()
+            if previous.get(path) != self.snapshot.get(path)
+        }
+
+    def wait(self, *, timeout: Optional[float]) -> Set[pathlib.Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self.poll()
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+            time.sleep(
+                self.interval
+                if deadline is None
+                else max(min(self.interval, deadline - time.monotonic()), 0)
+            )
+
+
+class InotifyWatcher(Watcher):
+    """Find changes with Linux inotify(7), watching every directory."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = (
+        IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    )
+    EVENT = struct.Struct("iIII")
+
+    libc = None
+
+    @classmethod
+    def available(cls) -> bool:
+        if cls.libc is None and sys.platform.startswith("linux"):
+            try:
+                libc = ctypes.CDLL(
+                    ctypes.util.find_library("c") or "libc.so.6",
+                    use_errno=True,
+                )
+                libc.inotify_init1
+                libc.inotify_add_watch
+            except (OSError, AttributeError):
+                return False
+            cls.libc = libc
+        return cls.libc is not None
+
+    def __init__(
+        self, roots: Sequence[pathlib.Path], *, delay: float = 0.1
+    ) -> None:
+        super().__init__(roots, delay=delay)
+        if not self.available():
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: Dict[int, pathlib.Path] = {}
+        # Directories watched only for some files, and those files
+        self.filtered: Set[int] = set()
+        self.files: Set[pathlib.Path] = set()
+        for root in roots:
+            if root.is_dir():
+                self.add(root)
+        recursive = set(self.dirs)
+        for root in roots:
+            if root.is_dir():
+                continue
+            self.files.add(root)
+            wd = self.add(root.parent, recursive=False)
+            if wd is not None and wd not in recursive:
+                self.filtered.add(wd)
+
+    def add(
+        self, directory: pathlib.Path, *, recursive: bool = True
+    ) -> Optional[int]:
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), self.MASK
+        )
+        if wd < 0:
+            log.warning(f"{PROGNAME}: can't watch {directory}")
+            return None
+        self.dirs[wd] = directory
+        if recursive:
+            for d in directory.iterdir():
+                if d.is_dir() and not d.is_symlink():
+                    self.add(d)
+        return wd
+
+    def wait(self, *, timeout: Optional[float]) -> Set[pathlib.Path]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                log.warning(f"{PROGNAME}: too many changes, some were missed")
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None:
+                continue
+            path = directory / name
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.add(path)
+                    changed.update(pathtools.walk([path]))
+                continue
+            if wd in self.filtered and path not in self.files:
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def watcher(roots: Sequence[pathlib.Path], **kwargs) -> Watcher:
+    """Return an inotify Watcher if available, or a polling one."""
+    if InotifyWatcher.available():
+        try:
+            return InotifyWatcher(roots, **kwargs)
+        except OSError as e:
+            log.debug(f"Falling back to polling: {e}")
+    return PollingWatcher(roots, **kwargs)
+
+
+def render(*args, **kwargs) -> List:
+    return list(match.render(*args, **kwargs))
+
+
+class Session:
+    """Keep the violations of every file, and relint files that changed.
+    The worker `pool` and compiled validators stay warm between calls.
+    Files the `limits` skip, like those outside the packages of the sfdx
+    `project`, have no violations.
+    """
+
+    def __init__(
+        self,
+        *,
+        baseline: Optional[Baseline] = None,
+        index: Optional[classindex.Index] = None,
+        limits: Optional[Limits] = None,
+        pool=None,
+        project: Optional[sfdx.Project] = None,
+        suppress: bool = True,
+        term: Optional[Type[terminfo.TermInfo]] = None,
+        validators: Sequence[Type[base.Validator]],
+        verbose: int = 0,
+    ) -> None:
+        self.index = index
+        self.pool = pool
+        self.project = project
+        self.render = functools.partial(
+            render,
+            baseline=baseline,
+            index=index,
+            limits=limits,
+            project=project,
+            suppress=suppress,
+            term=term,
+            validators=validators,
+            verbose=verbose,
+        )
+        self.validators = validators
+        self.messages: Dict[pathlib.Path, List[str]] = {}
+
+    def relint(
+        self, paths: Iterable[pathlib.Path]
+    ) -> Tuple[List[str], List[str]]:
+        """Validate `paths` again, and return the added and removed
+        messages. Paths that no longer exist lose all their messages.
+        """
+        present, gone = [], []
+        for path in paths:
+            if path.is_file():
+                if base.Validator.filter(
+                    self.validators,
+                    path=path,
+                    index=self.index,
+                    project=self.project,
+                ):
+                    present.append(path)
+            else:
+                gone.append(path)
+
+        if self.index is not None:
+            self.index.update(present, pool=self.pool)
+            self.index.save()
+
+        mapper = self.pool.imap if self.pool is not None else map
+        results = mapper(self.render, ((p,) for p in present))
+
+        added, removed = [], []
+        for path, result in zip(present, results):
+            if isinstance(result, Exception):
+                # Given up on by a worker
+                result = [result]
+            messages = []
+            for message in result:
+                if isinstance(message, Exception):
+                    log.error(f"{PROGNAME}: {message}")
+                    continue
+                if isinstance(message, Skip):
+                    log.info(f"{PROGNAME}: skipped {message}")
+                    continue
+                messages.append(message)
+            old = self.messages.get(path, [])
+            added += [m for m in messages if m not in old]
+            removed += [m for m in old if m not in messages]
+            self.messages[path] = messages
+
+        for path in gone:
+            removed += self.messages.pop(path, [])
+
+        return added, removed
+
+    @property
+    def count(self) -> int:
+        return sum(len(m) for m in self.messages.values())
+
+
+def diff(added: Iterable[str], removed: Iterable[str]) -> Iterator[str]:
+    """Return the lines of a diff between violations."""
+    for prefix, messages in (("-", removed), ("+", added)):
+        for message in messages:
+            yield textwrap.indent(
+                message, prefix=prefix + " ", predicate=lambda line: True
+            )
+
+
+def run(
+    roots: Sequence[pathlib.Path],
+    session: Session,
+    *,
+    changes: Optional[Watcher] = None,
+    output: IO = sys.stdout,
+) -> None:
+    """Validate `roots`, then print the diff of violations after each
+    change, until interrupted.
+    """
+    added, _ = session.relint(pathtools.unique(pathtools.walk(roots)))
+    for message in added:
+        print(message, file=output)
+    log.info(f"{PROGNAME}: {session.count} errors; watching for changes")
+
+    with changes or watcher(roots) as w:
+        for changed in w:
+            added, removed = session.relint(sorted(changed))
+            if not added and not removed:
+                continue
+            for line in diff(added, removed):
+                print(line, file=output)
+            output.flush()
+            log.info(f"{PROGNAME}: {session.count} errors")
@@ -0,0 +1,273 @@
+# Copyright 2018-19 Quantcast Corporation. All rights reserved.
+#
+# This file is part of Quantcast Apex Linter for Salesforce
+#
+# Licensed under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+#
+import logging
+import os
+import signal
+import sys
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+log = logging.getLogger(__name__)
+
+
+class Options(NamedTuple):
+    """When to replace a worker, and how long a task may take, if ever."""
+
+    max_rss: Optional[int] = None
+    max_tasks: Optional[int] = None
+    timeout: Optional[float] = None
+
+
+class TaskError(Exception):
+    """A task that didn't finish, returned in place of its result."""
+
+
+def rss() -> int:
+    """Return the resident set size of this process, in bytes.
+    Where /proc isn't available, return the peak size instead.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _serve(connection) -> None:
+    """Run the tasks sent on `connection`, until None or EOF."""
+    # The parent handles interrupts, and stops its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    fn = None
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        kind, value = message
+        if kind == "fn":
+            fn = value
+            continue
+        try:
+            result: Tuple[bool, Any] = (True, fn(*value))
+        except Exception as e:
+            result = (False, e)
+        connection.send(result + (rss(),))
+
+
+class Worker:
+    def __init__(self, context) -> None:
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.fn: Optional[Callable] = None
+        self.tasks = 0
+        # The index, arguments and deadline of the running task
+        self.task: Optional[Tuple[int, Tuple, float]] = None
+
+    def send(self, fn: Callable, index: int, args: Tuple, timeout) -> None:
+        if fn is not self.fn:
+            self.connection.send(("fn", fn))
+            self.fn = fn
+        self.connection.send(("args", args))
+        deadline = time.monotonic() + timeout if timeout else float("inf")
+        self.task = (index, args, deadline)
+        self.tasks += 1
+
+    def stop(self, *, kill: bool = False) -> None:
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+        self.process.join()
+        self.connection.close()
+
+
+def describe(args: Tuple) -> str:
+    """Return the paths a task was given, for its error."""
+    values = args[0]
+    if not isinstance(values, (list, tuple)):
+        values = (values,)
+    return ", ".join(
+        os.fspath(v) if isinstance(v, os.PathLike) else str(v) for v in values
+    )
+
+
+class Pool:
+    """Worker processes that each run one task at a time, like
+    `multiprocessing.Pool`, but which kill a task after `timeout` seconds,
+    and replace workers after `max_tasks` tasks or once their resident
+    size exceeds `max_rss` bytes.
+    A task that times out, or whose worker dies, returns a TaskError.
+    """
+
+    def __init__(
+        self,
+        processes: Optional[int] = None,
+        *,
+        max_rss: Optional[int] = None,
+        max_tasks: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.processes = processes or os.cpu_count() or 1
+        self.max_rss = max_rss
+        self.max_tasks = max_tasks
+        self.timeout = timeout
+
+        import multiprocessing  # Only needed with workers
+
+        self.context = multiprocessing.get_context()
+        self.idle: List[Worker] = []
+        self.busy: Dict[Any, Worker] = {}
+
+    def __enter__(self) -> "Pool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close(kill=exc_info[0] is not None)
+
+    def close(self, *, kill: bool = False) -> None:
+        for worker in self.idle:
+            worker.stop(kill=kill)
+        for worker in self.busy.values():
+            worker.stop(kill=True)
+        self.idle, self.busy = [], {}
+
+    def _worker(self) -> Worker:
+        if self.idle:
+            return self.idle.pop()
+        return Worker(self.context)
+
+    def _retire(self, worker: Worker, size: int) -> bool:
+        """Return whether `worker` has done enough, and stop it if so."""
+        if self.max_tasks and worker.tasks >= self.max_tasks:
+            reason = f"{worker.tasks} tasks"
+        elif self.max_rss and size > self.max_rss:
+            reason = f"{size} bytes resident"
+        else:
+            return False
+        log.debug(f"Replacing worker {worker.process.pid} after {reason}")
+        worker.stop()
+        return True
+
+    def imap_unordered(
+        self, fn: Callable, iterable: Iterable
+    ) -> Iterator[Any]:
+        for _, result in self._run(fn, ((a,) for a in iterable)):
+            yield result
+
+    def imap(self, fn: Callable, iterable: Iterable) -> Iterator[Any]:
+        """Return the results of `fn` for each item, in order."""
+        done: Dict[int, Any] = {}
+        next_index = 0
+        for index, result in self._run(fn, ((a,) for a in iterable)):
+            done[index] = result
+            while next_index in done:
+                yield done.pop(next_index)
+                next_index += 1
+
+    def starmap(self, fn: Callable, iterable: Iterable[Tuple]) -> List[Any]:
+        done = dict(self._run(fn, iterable))
+        return [done[i] for i in range(len(done))]
+
+    def _run(
+        self, fn: Callable, tasks: Iterable[Tuple]
+    ) -> Iterator[Tuple[int, Any]]:
+        """Return the index and result of each task, as they finish."""
+        import multiprocessing.connection
+
+        numbered = enumerate(tasks)
+        try:
+            while True:
+                # Keep every worker busy, reading tasks only as needed
+                while len(self.busy) < self.processes:
+                    task = next(numbered, None)
+                    if task is None:
+                        break
+                    index, args = task
+                    worker = self._worker()
+                    worker.send(fn, index, args, self.timeout)
+                    self.busy[worker.connection] = worker
+                if not self.busy:
+                    return
+
+                deadline = min(w.task[2] for w in self.busy.values())
+                wait = None
+                if deadline != float("inf"):
+                    wait = max(deadline - time.monotonic(), 0)
+                ready = multiprocessing.connection.wait(
+                    list(self.busy), timeout=wait
+                )
+
+                for connection in ready:
+                    worker = self.busy.pop(connection)
+                    index, args, _ = worker.task
+                    worker.task = None
+                    try:
+                        ok, result, size = connection.recv()
+                    except (EOFError, OSError):
+                        worker.stop(kill=True)
+                        yield index, TaskError(
+                            f"{describe(args)}: worker exited with status "
+                            f"{worker.process.exitcode}"
+                        )
+                        continue
+                    if not ok:
+                        worker.stop()
+                        raise result
+                    if not self._retire(worker, size):
+                        self.idle.append(worker)
+                    yield index, result
+
+                now = time.monotonic()
+                for connection, worker in list(self.busy.items()):
+                    index, args, deadline = worker.task
+                    if deadline > now:
+                        continue
+                    del self.busy[connection]
+                    log.debug(f"Killing worker {worker.process.pid}")
+                    worker.stop(kill=True)
+                    yield index, TaskError(
+                        f"{describe(args)}: took longer than {self.timeout} "
+                        "seconds"
+                    )
+        finally:
+            # Abandoned, or failed: no worker may still be running a task
+            for worker in self.busy.values():
+                worker.stop(kill=True)
+            self.busy = {}